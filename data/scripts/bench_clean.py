@@ -0,0 +1,251 @@
+"""
+bench_clean.py — микробенчмарки парсеров вики-разметки с порогом регрессии
+
+Корпус фиксирован: страницы эталона data/golden/pages.json и синтетические страницы
+data/golden/bench_pages.json — большая таблица, глубоко вложенные шаблоны, длинные списки
+ингредиентов, страница с сотнями {{recipes/register}}, страница из одних ссылок.
+Синтетические страницы детерминированно строит make_bench_pages() (--write_corpus).
+
+Каждая функция замеряется отдельно (по каждой странице — лучшее из --repeats прогонов):
+    replace_wikilinks, process_templates, convert_wiki_tables, clean_entry,
+    get_recipes.parse_to_object_format
+Результат каждой функции на каждой странице сверяется с хэшами в data/golden/bench_outputs.json,
+а пропускная способность (символов в секунду) — с data/golden/bench_baseline.json:
+падение больше чем на --tolerance считается регрессией. Код возврата 1 — расхождение или регрессия.
+
+Скорость сравнивается не в абсолютных числах, а относительно калибровочной нагрузки (чистый
+Python и регулярки), замеренной в том же запуске: так меньше шумит загрузка машины. Но базовую
+линию всё равно лучше снимать на той же машине, где потом гоняют проверку.
+
+Использование (из корня репозитория):
+    python data/scripts/bench_clean.py                     # замер, сверка с эталоном и базовой линией
+    python data/scripts/bench_clean.py --update_baseline   # записать текущую скорость как базовую
+    python data/scripts/bench_clean.py --update_outputs    # осознанно обновить эталонные хэши
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import contextlib
+
+import clean_data
+import get_recipes
+from check_golden import GOLDEN_DIR, load_json, use_fixture_recipes
+
+BENCHMARKS = {
+    "replace_wikilinks": lambda page: clean_data.replace_wikilinks(page["content"]),
+    "process_templates": lambda page: clean_data.process_templates(page["content"], clean_data.my_handler),
+    "convert_wiki_tables": lambda page: clean_data.convert_wiki_tables(page["content"]),
+    "clean_entry": lambda page: clean_data.clean_entry(dict(page))["content"],
+    "parse_to_object_format": lambda page: json.dumps(get_recipes.parse_to_object_format(page["content"]),
+                                                      ensure_ascii=False, sort_keys=True),
+}
+
+
+# ---------------------------------------------
+# Корпус
+# ---------------------------------------------
+def make_bench_pages(recipes: dict, seed: int = 42) -> list:
+    """Синтетические страницы: худшие случаи для каждого из парсеров."""
+    rng = random.Random(seed)
+    names = sorted(recipes)
+
+    rows = []
+    for i in range(300):
+        cells = [f"{{{{item|{rng.choice(names)}}}}}<br/>{{{{item|{rng.choice(names)}}}}}", f"{i * 7 % 400}%"]
+        cells += [rng.choice(["{{na}}", str(rng.randint(1, 12)), "[[кирка|кирки]]"]) for _ in range(10)]
+        rows.append("| " + cells[0] + " || " + cells[1] + "\n" + "\n".join("| " + c for c in cells[2:]))
+    big_table = ("'''Большая таблица''' — таблица блоков.\n== Таблица ==\n{| class=\"terraria\"\n"
+                 "! Блок !! Прочность" + "".join(f" !! {{{{item|mode=image|{name}}}}}" for name in names[:10])
+                 + "\n|-\n" + "\n|-\n".join(rows) + "\n|}\n")
+
+    nested = "x"
+    for depth in range(40):
+        nested = rng.choice(["{{note|%s}}", "{{expert|%s}}", "{{chance|%s|{{item|Wood}}}}", "[[a|%s]]"]) % nested
+    nested_page = "'''Вложенные шаблоны''' — стресс-тест.\n" + "\n".join(
+        f"* {nested} {{{{{{param{i}|{{{{item|Wood}}}}}}}}}}" for i in range(60))
+
+    ingredients = "'''Список ингредиентов''' — длинная страница рецептов.\n" + "\n".join(
+        f"=== {name} ===\n{{{{recipes|ingredient={name}|expanded=yes}}}}\n{{{{recipes|result={name}|compact=y}}}}"
+        for name in names) + "\n"
+
+    blocks = []
+    for i in range(400):
+        components = rng.sample(names, 4)
+        blocks.append("{{recipes/register\n| version = {{eversions|1.4.0.1|code=y}}\n"
+                      f"| result = {names[i % len(names)]} | resultid = {1000 + i} | amount = {1 + i % 5}\n"
+                      f"| station = {rng.choice(['Work Bench', 'Anvils', 'Furnace and Sawmill'])}\n"
+                      + "".join(f"| {c} | {rng.randint(1, 20)}\n" for c in components) + "}}")
+    register_page = "\n".join(blocks)
+
+    links = "'''Ссылки''' — страница из одних ссылок.\n" + " ".join(
+        rng.choice([f"[[{name}]]", f"[[{name}|подпись {i}]]", f"[[Файл:{name}.png|link={name}|[[{name}|вложенная]]]]"])
+        for i, name in enumerate(rng.choice(names) for _ in range(3000)))
+
+    return [
+        {"title": "Большая таблица", "content": big_table},
+        {"title": "Вложенные шаблоны", "content": nested_page},
+        {"title": "Список ингредиентов", "content": ingredients},
+        {"title": "Регистрация рецептов", "content": register_page},
+        {"title": "Ссылки", "content": links},
+    ]
+
+
+def load_corpus(golden_dir=GOLDEN_DIR) -> list:
+    return load_json(os.path.join(golden_dir, "pages.json")) + load_json(os.path.join(golden_dir, "bench_pages.json"))
+
+
+# ---------------------------------------------
+# Замеры
+# ---------------------------------------------
+def calibrate(repeats: int = 9) -> float:
+    """Лучшее время фиксированной нагрузки того же рода, что и парсеры: цикл по строке, регулярки, словари."""
+    import re
+    text = "{{item|Wood}} [[кирка|кирки]] || 100%\n" * 2000
+    pattern = re.compile(r"\{\{([^{}|]*)\|([^{}]*)\}\}")
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        counts = {}
+        for ch in text:
+            counts[ch] = counts.get(ch, 0) + 1
+        for m in pattern.finditer(text):
+            counts[m.group(1)] = counts.get(m.group(1), 0) + len(m.group(2))
+        "".join(part.strip() for part in text.split("|"))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def output_hash(output: str) -> str:
+    return hashlib.sha1(output.encode("utf-8")).hexdigest()
+
+
+def run_benchmarks(pages: list, repeats: int = 7, only: list = None) -> dict:
+    """
+    Время функции на корпусе — сумма по страницам лучшего из repeats прогонов (так выбросы
+    отдельных прогонов не складываются), плюс хэши её результатов. calibrated — скорость
+    в символах за время калибровочной нагрузки, она и сравнивается с базовой.
+    """
+    calibration = calibrate()
+    results = {}
+    chars = sum(len(page["content"]) for page in pages)
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        best = {}
+        outputs = {}
+        for _ in range(repeats):
+            # каждый прогон начинается с холодного кэша шаблонов
+            clean_data.engine.clear_cache()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for page in pages:
+                    start = time.perf_counter()
+                    outputs[page["title"]] = bench(page)
+                    elapsed = time.perf_counter() - start
+                    best[page["title"]] = min(best.get(page["title"], elapsed), elapsed)
+        seconds = sum(best.values())
+        results[name] = {
+            "seconds": seconds,
+            "chars_per_sec": chars / max(seconds, 1e-9),
+            "outputs": {title: output_hash(output) for title, output in outputs.items()},
+        }
+    # калибровка до и после замеров: берётся лучшая, как и у самих функций
+    calibration = min(calibration, calibrate())
+    for result in results.values():
+        result["calibrated"] = result["chars_per_sec"] * calibration
+    return results
+
+
+def check_outputs(results: dict, expected: dict) -> int:
+    failed = 0
+    for name, result in results.items():
+        for title, digest in result["outputs"].items():
+            if expected.get(name, {}).get(title) != digest:
+                print(f"❌ {name}: output changed on «{title}»")
+                failed += 1
+    return failed
+
+
+def regressed(results: dict, baseline: dict, tolerance: float) -> list:
+    return [name for name, result in results.items()
+            if name in baseline and result["calibrated"] < baseline[name]["calibrated"] * (1 - tolerance)]
+
+
+def keep_best(results: dict, rerun: dict):
+    """Из двух замеров функции оставляет более быстрый (результаты у них одинаковые — проверено хэшами)."""
+    for name, result in rerun.items():
+        if result["calibrated"] > results[name]["calibrated"]:
+            results[name] = result
+
+
+def check_baseline(results: dict, baseline: dict, tolerance: float) -> int:
+    regressions = 0
+    print(f"{'function':<24} {'ms':>9} {'Mchars/s':>9} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get("calibrated")
+        change = "" if base is None else f"{100 * (result['calibrated'] / base - 1):+.1f}%"
+        print(f"{name:<24} {result['seconds'] * 1000:>9.2f} {result['chars_per_sec'] / 1e6:>9.3f} {change:>8}")
+        if base is not None and result["calibrated"] < base * (1 - tolerance):
+            print(f"❌ {name}: throughput regressed more than {tolerance:.0%} against the baseline")
+            regressions += 1
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Микробенчмарки парсеров вики-разметки")
+    parser.add_argument("--golden_dir", default=GOLDEN_DIR)
+    parser.add_argument("--repeats", type=int, default=7, help="Прогонов на функцию, по каждой странице берётся лучший")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Допустимое падение скорости относительно базовой")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Сколько раз перемерить функции, которые выглядят регрессировавшими (и прогонов для --update_baseline)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Замерить только эти функции")
+    parser.add_argument("--update_baseline", action="store_true", help="Записать текущую скорость как базовую")
+    parser.add_argument("--update_outputs", action="store_true", help="Записать текущие результаты как эталонные")
+    parser.add_argument("--write_corpus", action="store_true", help="Пересоздать bench_pages.json генератором")
+    args = parser.parse_args()
+
+    use_fixture_recipes(args.golden_dir)
+    baseline_path = os.path.join(args.golden_dir, "bench_baseline.json")
+    outputs_path = os.path.join(args.golden_dir, "bench_outputs.json")
+
+    if args.write_corpus:
+        pages = make_bench_pages(load_json(os.path.join(args.golden_dir, "recipes.json")))
+        with open(os.path.join(args.golden_dir, "bench_pages.json"), "w", encoding="utf-8") as f:
+            json.dump(pages, f, ensure_ascii=False, indent=2)
+        print(f"✅ {len(pages)} synthetic pages written to {args.golden_dir}/bench_pages.json")
+
+    pages = load_corpus(args.golden_dir)
+    results = run_benchmarks(pages, args.repeats, args.only)
+    baseline = load_json(baseline_path) if os.path.exists(baseline_path) else {}
+    # на шумной машине один медленный замер — ещё не регрессия: перемериваем только подозрительные функции
+    for _ in range(args.retries):
+        names = list(results) if args.update_baseline else regressed(results, baseline, args.tolerance)
+        if not names:
+            break
+        keep_best(results, run_benchmarks(pages, args.repeats, names))
+
+    if args.update_outputs:
+        expected = load_json(outputs_path) if os.path.exists(outputs_path) else {}
+        expected.update({name: result["outputs"] for name, result in results.items()})
+        with open(outputs_path, "w", encoding="utf-8") as f:
+            json.dump(expected, f, ensure_ascii=False, indent=2)
+        print(f"✅ Expected outputs written to {outputs_path}")
+    if args.update_baseline:
+        baseline.update({name: {key: result[key] for key in ("seconds", "chars_per_sec", "calibrated")}
+                         for name, result in results.items()})
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"✅ Baseline written to {baseline_path}")
+
+    failed = check_outputs(results, load_json(outputs_path)) if os.path.exists(outputs_path) else 0
+    regressions = check_baseline(results, baseline, args.tolerance)
+    if failed or regressions:
+        print(f"❌ {failed} changed outputs, {regressions} throughput regressions")
+        sys.exit(1)
+    print("✅ Outputs match and no throughput regressions")
@@ -0,0 +1,239 @@
+"""
+check_fetch.py — проверка пакетной загрузки get_data.py на локальной заглушке MediaWiki API
+
+Заглушка отвечает на action=query (prop=revisions по titles=, generator=allpages,
+list=recentchanges) и умеет отдавать 429, 500 и страницы без ревизий. Каждый сценарий
+запускается с ограничением по времени: зависшая загрузка считается ошибкой.
+
+Использование (из корня репозитория):
+    python data/scripts/check_fetch.py
+"""
+
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import get_data
+
+SCENARIO_TIMEOUT = 30
+
+
+class StubWiki:
+    """
+    pages — {название: текст}; no_revisions — страницы, которые API возвращает без revisions;
+    throttle — сколько первых запросов ответить 429 (-1 — всегда), errors — сколько ответить 500.
+    """
+
+    def __init__(self, pages: dict, no_revisions=(), throttle: int = 0, errors: int = 0):
+        self.pages = pages
+        self.no_revisions = set(no_revisions)
+        self.throttle = throttle
+        self.errors = errors
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def page(self, title: str, revid: int) -> dict:
+        if title in self.no_revisions:
+            return {"title": title, "ns": 0, "pageid": revid}
+        if title not in self.pages:
+            return {"title": title, "ns": 0, "missing": True}
+        return {
+            "title": title, "ns": 0, "pageid": revid,
+            "revisions": [{"revid": revid, "timestamp": "2024-01-01T00:00:00Z", "user": "stub",
+                           "slots": {"main": {"content": self.pages[title]}}}],
+        }
+
+    def respond(self, params: dict):
+        """(HTTP-статус, заголовки, JSON-ответ)"""
+        with self.lock:
+            self.requests += 1
+            if self.throttle:
+                self.throttle -= 1 if self.throttle > 0 else 0
+                return 429, {"Retry-After": "0.01"}, {}
+            if self.errors:
+                self.errors -= 1
+                return 500, {}, {}
+
+        if params.get("list") == "recentchanges":
+            changes = [{"type": "edit", "title": title} for title in self.pages]
+            return 200, {}, {"query": {"recentchanges": changes}}
+
+        titles = sorted(self.pages) + sorted(self.no_revisions)
+        if params.get("generator") == "allpages":
+            start = int(params.get("gapcontinue", 0))
+            limit = int(params.get("gaplimit", 50))
+            data = {"query": {"pages": [self.page(t, n) for n, t in enumerate(titles[start:start + limit], start)]}}
+            if start + limit < len(titles):
+                data["continue"] = {"gapcontinue": str(start + limit), "continue": "gapcontinue||"}
+            return 200, {}, data
+
+        requested = params["titles"].split("|")
+        return 200, {}, {"query": {"pages": [self.page(t, n) for n, t in enumerate(requested)]}}
+
+
+def start_stub(wiki: StubWiki):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            status, headers, data = wiki.respond(params)
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api.php"
+
+
+def make_pages(count: int) -> dict:
+    return {f"Страница {n}": f"Текст {n}" for n in range(count)}
+
+
+def fast_bucket():
+    return get_data.TokenBucket(rate=1000, max_rate=1000, min_rate=100, capacity=1000)
+
+
+def run_fetch(wiki: StubWiki, titles: list, **kwargs):
+    server, url = start_stub(wiki)
+    fetched = []
+    try:
+        missing, failed = get_data.fetch_pages(titles, fetched.append, url, bucket=fast_bucket(), **kwargs)
+    finally:
+        server.shutdown()
+    return fetched, missing, failed
+
+
+def check_all_pages():
+    pages = make_pages(120)
+    fetched, missing, failed = run_fetch(StubWiki(pages), list(pages))
+    assert sorted(e["title"] for e in fetched) == sorted(pages), "загружены не все страницы"
+    assert not missing and not failed
+    assert all(e["content"] == pages[e["title"]] for e in fetched)
+
+
+def check_missing_and_no_revisions():
+    pages = make_pages(119)
+    titles = list(pages) + ["Служебная страница", "Удалённая страница"]
+    wiki = StubWiki(pages, no_revisions=["Служебная страница"])
+    fetched, missing, failed = run_fetch(wiki, titles, max_retries=3)
+    assert len(fetched) == 119
+    assert sorted(missing) == ["Служебная страница", "Удалённая страница"], missing
+    assert not failed
+
+
+def check_transient_errors():
+    pages = make_pages(60)
+    fetched, missing, failed = run_fetch(StubWiki(pages, throttle=3, errors=2), list(pages))
+    assert len(fetched) == 60 and not missing and not failed
+
+
+def check_always_throttled():
+    pages = make_pages(60)
+    wiki = StubWiki(pages, throttle=-1)
+    fetched, missing, failed = run_fetch(wiki, list(pages), max_throttles=3)
+    assert not fetched and sorted(failed) == sorted(pages)
+    assert wiki.requests == 2 * 4, wiki.requests  # две пачки по 1 + 3 повтора
+
+
+def check_always_failing():
+    pages = make_pages(4)
+    wiki = StubWiki(pages, errors=10 ** 6)
+    fetched, missing, failed = run_fetch(wiki, list(pages), batch_size=4, max_retries=2)
+    assert not fetched and sorted(failed) == sorted(pages)
+
+
+def check_generator():
+    pages = make_pages(120)
+    server, url = start_stub(StubWiki(pages, throttle=2, errors=1))
+    fetched = []
+    try:
+        total = get_data.fetch_all_via_generator(fetched.append, url, fast_bucket())
+    finally:
+        server.shutdown()
+    assert total == 120 and sorted(e["title"] for e in fetched) == sorted(pages)
+
+
+def check_generator_gives_up():
+    server, url = start_stub(StubWiki(make_pages(10), throttle=-1))
+    try:
+        get_data.fetch_all_via_generator(lambda entry: None, url, fast_bucket())
+    except get_data.ThrottledError:
+        return
+    finally:
+        server.shutdown()
+    raise AssertionError("бесконечные 429 не прервали загрузку")
+
+
+def check_sync_revisions_give_up():
+    server, url = start_stub(StubWiki(make_pages(10), throttle=-1))
+    try:
+        get_data.get_last_revisions(list(make_pages(10)), fast_bucket(), url)
+    except get_data.ThrottledError:
+        return
+    finally:
+        server.shutdown()
+    raise AssertionError("бесконечные 429 не прервали get_last_revisions")
+
+
+CHECKS = [
+    check_all_pages,
+    check_missing_and_no_revisions,
+    check_transient_errors,
+    check_always_throttled,
+    check_always_failing,
+    check_generator,
+    check_generator_gives_up,
+    check_sync_revisions_give_up,
+]
+
+
+def run_check(check) -> str:
+    """Запускает сценарий в отдельном потоке; возвращает текст ошибки или пустую строку."""
+    error = []
+
+    def target():
+        try:
+            check()
+        except BaseException as e:
+            error.append(f"{type(e).__name__}: {e}")
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(SCENARIO_TIMEOUT)
+    if thread.is_alive():
+        return f"не завершился за {SCENARIO_TIMEOUT} с"
+    return error[0] if error else ""
+
+
+def main():
+    # повторы без многосекундных пауз
+    get_data.RETRY_BASE_DELAY = 0.01
+    get_data.RETRY_MAX_DELAY = 0.05
+    get_data.print = lambda *args, **kwargs: None
+
+    failed = 0
+    for check in CHECKS:
+        error = run_check(check)
+        if error:
+            failed += 1
+            print(f"❌ {check.__name__}: {error}")
+        else:
+            print(f"✅ {check.__name__}")
+    if failed:
+        print(f"❌ Не прошло {failed} из {len(CHECKS)} проверок")
+        sys.exit(1)
+    print(f"✅ Все {len(CHECKS)} проверок прошли")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+check_golden.py — сверка очистки вики-страниц с эталоном
+
+Эталон data/golden/cleaned.json снят прежним конвейером (clean_entry_legacy) на страницах
+из data/golden/pages.json с рецептами из data/golden/recipes.json. Любое изменение парсера
+должно давать тот же текст — или эталон обновляется осознанно. Кроме того, рецепты, которые
+pipeline.py извлекает из тех же страниц, сверяются с get_recipes.py.
+
+Использование (из корня репозитория):
+    python data/scripts/check_golden.py                 # сверить clean_entry с эталоном
+    python data/scripts/check_golden.py --update        # пересоздать эталон через clean_entry_legacy
+    python data/scripts/check_golden.py --dump data/data/wiki_dump.jsonl
+                                                        # сравнить clean_entry и clean_entry_legacy на всём дампе
+"""
+
+import os
+import sys
+import json
+import time
+import difflib
+import argparse
+import tempfile
+
+import clean_data
+import get_recipes
+
+GOLDEN_DIR = "data/golden"
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def use_fixture_recipes(golden_dir=GOLDEN_DIR):
+    """Шаблоны {{recipes}} раскрываются по фиксированному набору рецептов, а не по текущему recipes_new.json."""
+    clean_data.set_recipes(load_json(os.path.join(golden_dir, "recipes.json")))
+
+
+def clean_pages(pages, clean):
+    return {page["title"]: clean(dict(page))["content"] for page in pages}
+
+
+def print_diff(title, expected, actual, context=2):
+    print(f"❌ {title}")
+    diff = difflib.unified_diff(expected.splitlines(), actual.splitlines(),
+                                fromfile="golden", tofile="actual", lineterm="", n=context)
+    for line in list(diff)[:40]:
+        print("   ", line)
+
+
+def check(golden_dir=GOLDEN_DIR, clean=clean_data.clean_entry):
+    """Сверяет очистку с эталоном, возвращает число расхождений."""
+    use_fixture_recipes(golden_dir)
+    pages = load_json(os.path.join(golden_dir, "pages.json"))
+    golden = load_json(os.path.join(golden_dir, "cleaned.json"))
+
+    actual = clean_pages(pages, clean)
+    failed = 0
+    for title, expected in golden.items():
+        if actual.get(title) != expected:
+            print_diff(title, expected, actual.get(title, ""))
+            failed += 1
+    print(f"{len(golden) - failed}/{len(golden)} pages match the golden output.")
+    return failed
+
+
+def check_recipes(golden_dir=GOLDEN_DIR):
+    """
+    Прогоняет pipeline.py по страницам эталона и сверяет его recipes_new.json с рецептами,
+    которые get_recipes.py извлекает из тех же сырых страниц. Возвращает число расхождений.
+    """
+    import pipeline
+
+    pages = load_json(os.path.join(golden_dir, "pages.json"))
+    expected = {}
+    for page in pages:
+        get_recipes.merge_recipes(expected, get_recipes.parse_to_object_format(page["content"]))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        recipes_path = os.path.join(tmp_dir, "recipes.json")
+        pipeline.run_pipeline(input_path=os.path.join(golden_dir, "pages.json"),
+                              cleaned_path=os.path.join(tmp_dir, "cleaned.jsonl"),
+                              recipes_path=recipes_path,
+                              chunks_path=None)
+        actual = load_json(recipes_path)
+    use_fixture_recipes(golden_dir)
+
+    failed = 0
+    for name in sorted(set(expected) | set(actual)):
+        if actual.get(name) != expected.get(name):
+            print_diff(f"recipe {name}",
+                       json.dumps(expected.get(name), ensure_ascii=False, indent=1),
+                       json.dumps(actual.get(name), ensure_ascii=False, indent=1))
+            failed += 1
+    print(f"{len(expected) - failed}/{len(expected)} pipeline recipes match get_recipes.py.")
+    return failed
+
+
+def update(golden_dir=GOLDEN_DIR):
+    use_fixture_recipes(golden_dir)
+    pages = load_json(os.path.join(golden_dir, "pages.json"))
+    golden = clean_pages(pages, clean_data.clean_entry_legacy)
+    with open(os.path.join(golden_dir, "cleaned.json"), "w", encoding="utf-8") as f:
+        json.dump(golden, f, ensure_ascii=False, indent=2)
+    print(f"✅ Golden output for {len(golden)} pages written to {golden_dir}/cleaned.json")
+
+
+def compare_dump(file_path, limit=None):
+    """Прогоняет обе очистки по дампу и печатает страницы, где они расходятся."""
+    failed = total = 0
+    new_time = legacy_time = 0.0
+    for entry in clean_data.iter_raw_entries(file_path):
+        start = time.perf_counter()
+        new = clean_data.clean_entry(dict(entry))["content"]
+        new_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        legacy = clean_data.clean_entry_legacy(dict(entry))["content"]
+        legacy_time += time.perf_counter() - start
+
+        total += 1
+        if new != legacy:
+            failed += 1
+            print_diff(entry.get("title", ""), legacy, new)
+        if limit and total >= limit:
+            break
+    print(f"{total - failed}/{total} pages match. "
+          f"clean_entry: {new_time:.1f} s, clean_entry_legacy: {legacy_time:.1f} s")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка очистки вики-страниц с эталоном")
+    parser.add_argument("--golden_dir", default=GOLDEN_DIR)
+    parser.add_argument("--update", action="store_true", help="Пересоздать эталон прежним конвейером")
+    parser.add_argument("--dump", default=None, help="Сравнить новую и прежнюю очистку на дампе (JSON или JSONL)")
+    parser.add_argument("--limit", type=int, default=None, help="Сколько страниц дампа проверить")
+    args = parser.parse_args()
+
+    if args.update:
+        update(args.golden_dir)
+    elif args.dump:
+        sys.exit(1 if compare_dump(args.dump, args.limit) else 0)
+    else:
+        failed = check(args.golden_dir)
+        failed += check_recipes(args.golden_dir)
+        sys.exit(1 if failed else 0)
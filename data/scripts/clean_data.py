@@ -1,10 +1,18 @@
 import json
 import os
 import re
+import time
+import heapq
+import argparse
 import regex
+from multiprocessing import Pool
 
-with open("data/data/recipes_new.json", "r", encoding="utf-8") as f:
-    recipes = json.load(f)
+import wikitext
+from template_engine import TemplateEngine
+
+RECIPES_PATH = "data/data/recipes_new.json"
+
+engine = TemplateEngine()
 
 def remove_accent_chars(text: str) -> str:
     """Удаляет символы ударения"""
@@ -127,6 +135,8 @@ def _split_top_level_cells(s: str, sep_double='||', sep_single='|') -> List[str]
     НЕ разделяя внутри {{...}}, [[...]], <...> или ( ... ).
     Возвращает список ячеек (строк).
     """
+    if sep_single not in s and sep_double not in s:
+        return [s.strip()]
     cells = []
     buf = []
     i = 0
@@ -192,12 +202,16 @@ def _split_top_level_cells(s: str, sep_double='||', sep_single='|') -> List[str]
 # -------------------------
 # Удаление любых атрибутов wiki вне шаблонов/ссылок
 # -------------------------
+ATTRIBUTE_PATTERN = re.compile(r'\s*([A-Za-z_:][A-Za-z0-9_.:-]*)\s*=')
+
 def strip_wiki_attributes_outside_templates(s: str) -> str:
     """
     Удаляет любые атрибуты вида name=value (включая name="..." и name='...'),
     НО ТОЛЬКО вне {{...}} и [[...]].
     Оставляет остальной текст как есть.
     """
+    if '=' not in s:
+        return s
     out = []
     i = 0
     n = len(s)
@@ -224,10 +238,10 @@ def strip_wiki_attributes_outside_templates(s: str) -> str:
             out.append(s[i]); i += 1; continue
 
         # outside templates: attempt to match attr name=
-        m = re.match(r'\s*([A-Za-z_:][A-Za-z0-9_.:-]*)\s*=', s[i:])
+        m = ATTRIBUTE_PATTERN.match(s, i)
         if m:
             # skip the attribute name and '=' and its value
-            j = i + m.end()  # position just after '='
+            j = m.end()  # position just after '='
             # skip optional whitespace
             while j < n and s[j].isspace():
                 j += 1
@@ -524,6 +538,71 @@ def format_recipe(recipe):
     return f"(Рецепт: / {components_text} / cоздаётся на: {station} / выход: {amount} шт.)"
 
 
+# ---------------------------------------------
+# Рецепты для {{recipes}}: загружаются при первом обращении
+# ---------------------------------------------
+_recipes = None
+_result_index = None      # предмет -> текст его рецептов
+_ingredient_index = None  # ингредиент -> тексты рецептов, где он нужен (в порядке recipes_new.json)
+
+def set_recipes(data: dict):
+    """Подменяет рецепты (например, фиксированным набором в check_golden.py) и пересобирает индексы."""
+    global _recipes, _result_index, _ingredient_index
+    _recipes = data
+    _result_index = {}
+    _ingredient_index = {}
+
+    for item in data:
+        # раньше {{recipes|result=...}} и {{recipes|ingredient=...}} заново обходили все рецепты на каждый шаблон;
+        # индексы повторяют тот обход, включая пропуск остатка предмета после битой записи
+        text = ""
+        try:
+            for recipe in data[item]['recipes']:
+                text += format_recipe(recipe)
+        except:
+            pass
+        _result_index[item] = text
+
+        stopped = set()
+        try:
+            for recipe in data[item]['recipes']:
+                components = recipe['components'].keys()
+                formatted = None
+                for component in components:
+                    if component in stopped:
+                        continue
+                    if formatted is None:
+                        try:
+                            formatted = format_recipe(recipe)
+                        except:
+                            formatted = False
+                    if formatted is False:
+                        stopped.add(component)
+                    else:
+                        _ingredient_index.setdefault(component, []).append(formatted)
+        except:
+            pass
+
+    engine.clear_cache()
+
+def get_recipes() -> dict:
+    if _recipes is None:
+        with open(RECIPES_PATH, "r", encoding="utf-8") as f:
+            set_recipes(json.load(f))
+    return _recipes
+
+def recipes_as_result(recipe_name: str) -> str:
+    get_recipes()
+    return _result_index.get(recipe_name, "")
+
+def recipes_as_ingredient(recipe_name: str) -> str:
+    get_recipes()
+    return "".join(_ingredient_index.get(recipe_name, ()))
+
+
+# ---------------------------------------------
+# Обработчики шаблонов
+# ---------------------------------------------
 def my_handler(name, args):
     name_l = name.lower()
     bad_words_0 = ["automatic translation", "reflist", "legacy nav tab", "collapse top", "legacy nav tab"]
@@ -533,81 +612,78 @@ def my_handler(name, args):
         if name_l == "na":
             return "not available"
         return name
-    
-    if name_l == "chance":
-        return f"шанс {', '.join(args)}"
-    
-    if name_l == "exclusive":
-        return f"(исключительно {', '.join(args)}!)"
-    
-    if name_l == "expert":
-        return f"в эксперте {', '.join(args)})"
-    
-    if name_l == "master":
-        return f"в мастере {', '.join(args)})"
-    
-    if name_l == "note":
-        return args[-1] if args else ""
-    
-    if name_l == "item infobox":
-        return f"(Параметры предмета: {', '.join(args)})"
+    return engine.expand(name, args)
 
-    if name_l == "npc infobox":
-        return f"(Параметры NPC: {', '.join(args)})"
+@engine.register("chance")
+def _chance(args):
+    return f"шанс {', '.join(args)}"
 
-    if name_l == "buff infobox":
-        return f"(Параметры баффа: {', '.join(args)})"
+@engine.register("exclusive")
+def _exclusive(args):
+    return f"(исключительно {', '.join(args)}!)"
 
-    if name_l == "recipes/register":
-        return ""
-    
-    if name_l == "duration":
-        if len(args[0].split("="))>=2:
-            return args[0].split("=")[1]
-        return args[0]
-    
-    if name_l == "recipes":
-        if len(args) == 2:
-            action = args[0].split('=', 1)[0].strip()
-            recipe_names = args[0].split('=', 1)[1].strip().split('/')
-            if len(recipe_names) >= 2:
-                print(recipe_names)
-            recipe_names = [name.strip() for name in recipe_names]
-        else:
-            return ""
-        if action == "result":
-            text = ""
-            for recipe_name in recipe_names:
-                try:
-                    for recipe in recipes[recipe_name]['recipes']:
-                        text += format_recipe(recipe)
-                except:
-                    pass
-            return text
-        if action == "ingredient":
-            text = ""
-            for recipe_name in recipe_names:
-                for item in recipes:
-                    try:
-                        for recipe in recipes[item]['recipes']:
-                            if recipe_name in recipe['components'].keys():
-                                text += format_recipe(recipe)
-                    except:
-                        pass
-            return text
-        return ""
-        
-    if name_l == "achievement":
-        return f"(Достижение: {', '.join(args)})"
+@engine.register("expert")
+def _expert(args):
+    return f"в эксперте {', '.join(args)})"
 
-    if name_l == "item":
-        return f"(Предмет: {args[0] if args else ''})"
-    
-    if name_l == "history":
-        return f"(История: {', '.join(args)})"
+@engine.register("master")
+def _master(args):
+    return f"в мастере {', '.join(args)})"
+
+@engine.register("note")
+def _note(args):
+    return args[-1] if args else ""
 
+@engine.register("item infobox")
+def _item_infobox(args):
+    return f"(Параметры предмета: {', '.join(args)})"
+
+@engine.register("npc infobox")
+def _npc_infobox(args):
+    return f"(Параметры NPC: {', '.join(args)})"
+
+@engine.register("buff infobox")
+def _buff_infobox(args):
+    return f"(Параметры баффа: {', '.join(args)})"
+
+@engine.register("recipes/register")
+def _recipes_register(args):
     return ""
 
+@engine.register("duration")
+def _duration(args):
+    if len(args[0].split("="))>=2:
+        return args[0].split("=")[1]
+    return args[0]
+
+@engine.register("recipes")
+def _recipes_template(args):
+    if len(args) == 2:
+        action = args[0].split('=', 1)[0].strip()
+        recipe_names = args[0].split('=', 1)[1].strip().split('/')
+        if len(recipe_names) >= 2:
+            print(recipe_names)
+        recipe_names = [name.strip() for name in recipe_names]
+    else:
+        return ""
+    if action == "result":
+        return "".join(recipes_as_result(recipe_name) for recipe_name in recipe_names)
+    if action == "ingredient":
+        return "".join(recipes_as_ingredient(recipe_name) for recipe_name in recipe_names)
+    return ""
+
+@engine.register("achievement")
+def _achievement(args):
+    return f"(Достижение: {', '.join(args)})"
+
+@engine.register("item")
+def _item(args):
+    return f"(Предмет: {args[0] if args else ''})"
+
+@engine.register("history")
+def _history(args):
+    return f"(История: {', '.join(args)})"
+
 def delete_useless_headers(text: str) -> str:
     """Удаляет заголовки секций, которые не несут полезной информации"""
     useless_headers = [
@@ -646,36 +722,112 @@ def delete_everything_after_section(text: str, section_title: str) -> str:
     pattern = re.compile(rf"==+\s*{re.escape(section_title)}\s*==+.*", re.DOTALL)
     return re.sub(pattern, "", text)
 
-def clean_entry(entry: dict) -> dict:
-    """Очищает поле 'content'"""
-    content = entry.get("content", "")
-    title = entry.get("title", "")
-    if not content:
-        return entry
-    content = change_main_word(content, title)
-    content = remove_accent_chars(content)
-    content = replace_wikilinks(content)
-    content = remove_triple_braces(content)
-    content = convert_wiki_tables(content)
-    content = process_templates(content, my_handler)
-    content = change_templates(content)
-    content = remove_wiki_tags(content)
-    #content = delete_useless_headers(content)
-    content = delete_everything_after_section(content, "Сноски")
-
-    # Убираем лишние пробелы и пустые строки
+def expand_template(source: str) -> str:
+    """Раскрывает один шаблон по тексту между {{ и }} (как template_replacer в process_templates)"""
+    inner = source.strip()
+    if not inner:
+        return ""
+    parts = split_top_level(inner)
+    name = parts[0].strip()
+    args = [p.strip() for p in parts[1:]]
+    return my_handler(name, args)
+
+def expand_leftover_templates(content: str) -> str:
+    # шаблоны, которые сложились из остатков битой разметки только после раскрытия соседних
+    if "{{" in content:
+        return process_templates(content, my_handler)
+    return content
+
+def remove_blank_lines(content: str) -> str:
+    return re.sub(r"\n{2,}", "\n", content).strip()
+
+def remove_blank_lines_legacy(content: str) -> str:
     while True:
         length = len(content)
         content = re.sub(r"\n\n", "\n", content)
         if length == len(content):
             break
     #content = re.sub(r"[ \t]{2,}", " ", content)
-    content = content.strip()
+    return content.strip()
+
+# Шаги очистки по порядку: (название, функция(значение, title)). Значение между шагами —
+# текст, а у clean_entry между parse и templates — дерево wikitext.
+PREPARE_STAGES = [
+    ("main_word", change_main_word),
+    ("accents", lambda content, title: remove_accent_chars(content)),
+]
+RENDER_STAGES = [
+    ("templates", lambda nodes, title: wikitext.render(nodes, expand_template)),
+    ("leftover_templates", lambda content, title: expand_leftover_templates(content)),
+    ("tags", lambda content, title: remove_wiki_tags(content)),
+    ("footnotes", lambda content, title: delete_everything_after_section(content, "Сноски")),
+    ("blank_lines", lambda content, title: remove_blank_lines(content)),
+]
+CLEAN_STAGES = PREPARE_STAGES + [
+    ("parse", lambda content, title: parse_content(content)),
+] + RENDER_STAGES
+LEGACY_STAGES = PREPARE_STAGES + [
+    ("wikilinks", lambda content, title: replace_wikilinks(content)),
+    ("triple_braces", lambda content, title: remove_triple_braces(content)),
+    ("tables", lambda content, title: convert_wiki_tables(content)),
+    ("templates", lambda content, title: process_templates(content, my_handler)),
+    ("change_templates", lambda content, title: change_templates(content)),
+    ("tags", lambda content, title: remove_wiki_tags(content)),
+    #("useless_headers", lambda content, title: delete_useless_headers(content)),
+    ("footnotes", lambda content, title: delete_everything_after_section(content, "Сноски")),
+    ("blank_lines", lambda content, title: remove_blank_lines_legacy(content)),
+]
+
+def run_stages(stages, value, title="", profiler=None):
+    """Прогоняет значение через шаги; profiler (clean_profile.StageProfiler) замеряет каждый шаг"""
+    if profiler is not None:
+        return profiler.run(stages, value, title)
+    for _, stage in stages:
+        value = stage(value, title)
+    return value
+
+def clean_entry(entry: dict, profiler=None) -> dict:
+    """
+    Очищает поле 'content'.
+    Ссылки, тройные скобки, таблицы и шаблоны обрабатываются за один разбор (wikitext.py),
+    результат совпадает с clean_entry_legacy.
+    """
+    content = entry.get("content", "")
+    title = entry.get("title", "")
+    if not content:
+        return entry
+    entry["content"] = run_stages(CLEAN_STAGES, content, title, profiler)
+    return entry
+
+def prepare_content(content: str, title: str) -> str:
+    """Правки сырого текста до разбора"""
+    return run_stages(PREPARE_STAGES, content, title)
+
+def parse_content(content: str) -> list:
+    """Дерево страницы (wikitext.parse) с уже сконвертированными таблицами"""
+    return wikitext.parse(content, parse_table_text)
 
-    entry["content"] = content
+def render_content(nodes: list) -> str:
+    """Раскрывает шаблоны дерева и доводит текст до очищенного вида"""
+    return run_stages(RENDER_STAGES, nodes)
+
+def clean_entry_legacy(entry: dict, profiler=None) -> dict:
+    """Прежняя очистка проходами регулярок до неподвижной точки. Эталон для check_golden.py"""
+    content = entry.get("content", "")
+    title = entry.get("title", "")
+    if not content:
+        return entry
+    entry["content"] = run_stages(LEGACY_STAGES, content, title, profiler)
     return entry
 
 
+def is_service_page(title: str) -> bool:
+    """Служебные страницы (строки таблиц, регистрация рецептов, подстраницы) в базу не идут"""
+    nasty_words = ["row", "register", "resultcell", "all increases"]
+    if any(word in title.lower() for word in nasty_words):
+        return True
+    return "/" in title
+
 def clean_all(file_path="data/data/wiki_dump_raw.json", output_path="data/data/wiki_dump_cleaned.json"):
     """Очищает все записи и сохраняет обратно"""
     if not os.path.exists(file_path):
@@ -686,11 +838,7 @@ def clean_all(file_path="data/data/wiki_dump_raw.json", output_path="data/data/w
     cleaned_data = []
     for i, entry in enumerate(data):
         temp = clean_entry(data[entry])
-        nasty_words = ["row", "register", "resultcell", "all increases"]
-        if any(word in temp["title"].lower() for word in nasty_words):
-            continue
-        if "/" in temp["title"]:
-            #print(temp["title"])
+        if is_service_page(temp["title"]):
             continue
         cleaned_data.append(temp)
         if (i + 1) % 100 == 0:
@@ -701,6 +849,103 @@ def clean_all(file_path="data/data/wiki_dump_raw.json", output_path="data/data/w
 
     print(f"✅ Cleaned data written to {output_path}. Total entries: {len(cleaned_data)}")
 
+def iter_raw_entries(file_path):
+    """
+    Отдаёт сырые записи дампа по одной. JSONL-дамп (get_data.py) читается потоково,
+    старый JSON {title: запись} (или список записей) — целиком.
+    """
+    if file_path.endswith((".jsonl", ".jsonl.zst")):
+        from dump_store import DumpStore
+        with DumpStore(file_path) as store:
+            yield from store.iter_entries()
+        return
+    with open(file_path, "r", encoding="utf-8") as infile:
+        data = json.load(infile)
+    yield from (data.values() if isinstance(data, dict) else data)
+
+def _clean_timed(entry):
+    start = time.perf_counter()
+    size = len(entry.get("content", ""))
+    cleaned = clean_entry(entry)
+    return cleaned, time.perf_counter() - start, size
+
+def clean_all_parallel(file_path="data/data/wiki_dump.jsonl",
+                       output_path="data/data/wiki_dump_cleaned.jsonl",
+                       workers=None,
+                       chunksize=8,
+                       top_n=10):
+    """
+    Многопроцессная версия clean_all: страницы читаются потоком, чистятся в пуле процессов
+    с сохранением порядка и сразу дописываются в JSONL. В конце печатает скорость и самые медленные страницы.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"The file {file_path} does not exist.")
+
+    # служебные страницы отбрасываем до очистки — их незачем гонять через пул
+    entries = (entry for entry in iter_raw_entries(file_path) if not is_service_page(entry.get("title", "")))
+
+    slowest = []  # min-heap из (время, название, размер)
+    total = 0
+    start = time.perf_counter()
+    tmp_path = output_path + ".tmp"
+    with Pool(processes=workers) as pool, open(tmp_path, "w", encoding="utf-8") as outfile:
+        for cleaned, elapsed, size in pool.imap(_clean_timed, entries, chunksize=chunksize):
+            outfile.write(json.dumps(cleaned, ensure_ascii=False) + "\n")
+            total += 1
+            heapq.heappush(slowest, (elapsed, cleaned.get("title", ""), size))
+            if len(slowest) > top_n:
+                heapq.heappop(slowest)
+            if total % 100 == 0:
+                print(f"Processed {total} entries, {total / (time.perf_counter() - start):.1f} pages/sec...")
+    os.replace(tmp_path, output_path)
+
+    elapsed_total = time.perf_counter() - start
+    print(f"✅ Cleaned data written to {output_path}. Total entries: {total}, "
+          f"{elapsed_total:.1f} s, {total / max(elapsed_total, 1e-9):.1f} pages/sec")
+    print(f"Slowest {len(slowest)} pages:")
+    for elapsed, title, size in sorted(slowest, reverse=True):
+        print(f"  {elapsed * 1000:8.1f} ms  {size:8d} chars  {title}")
+    return total
+
+def load_cleaned(path):
+    """Очищенные данные: JSON-список (clean_all) или JSONL (clean_all_parallel, pipeline.py)."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def save_cleaned(cleaned_data, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as outfile:
+        if path.endswith(".jsonl"):
+            for entry in cleaned_data:
+                outfile.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        else:
+            json.dump(cleaned_data, outfile, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+def apply_changeset(changeset_path, output_path="data/data/wiki_dump_cleaned.json"):
+    """
+    Применяет changeset от get_data.py --mode sync к уже очищенным данным (JSON или JSONL):
+    чистит только обновлённые страницы и убирает удалённые.
+    Возвращает названия страниц, которые нужно переиндексировать.
+    """
+    with open(changeset_path, "r", encoding="utf-8") as f:
+        changeset = json.load(f)
+    cleaned_data = load_cleaned(output_path)
+
+    touched = set(changeset["deleted"]) | {entry["title"] for entry in changeset["upserted"]}
+    cleaned_data = [entry for entry in cleaned_data if entry["title"] not in touched]
+    for entry in changeset["upserted"]:
+        temp = clean_entry(dict(entry))
+        if is_service_page(temp["title"]):
+            continue
+        cleaned_data.append(temp)
+    save_cleaned(cleaned_data, output_path)
+
+    print(f"✅ Changeset {changeset_path} applied: {len(changeset['upserted'])} updated, {len(changeset['deleted'])} deleted.")
+    return sorted(touched)
+
 def test(ok):
     if ok:
         print(clean_entry({
@@ -714,8 +959,72 @@ def test(ok):
 
     
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Очистка дампа Terraria Wiki")
+    parser.add_argument("--input", default=None, help="Сырой дамп (JSON или JSONL)")
+    parser.add_argument("--output", default=None, help="Куда писать очищенные данные")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Чистить в пуле из N процессов с потоковой записью JSONL (0 — по числу ядер)")
+    parser.add_argument("--chunksize", type=int, default=8, help="Страниц на одну задачу пула")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых медленных страниц показать")
+    parser.add_argument("--template_stats", action="store_true",
+                        help="Показать вызовы, попадания в кэш и время по шаблонам (только без --workers)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Профилировать очистку по шагам вместо записи результата (см. clean_profile.py)")
+    parser.add_argument("--profile_legacy", action="store_true", help="Профилировать clean_entry_legacy")
+    parser.add_argument("--profile_dir", default=None, help="Куда сохранить cProfile самых медленных страниц")
+    parser.add_argument("--profile_pages", type=int, default=3, help="Сколько самых медленных страниц прогнать под cProfile")
+    parser.add_argument("--profile_out", default=None, help="Сохранить отчёт профилирования в JSON")
+    parser.add_argument("--limit", type=int, default=None, help="Сколько страниц дампа профилировать")
+    parser.add_argument("--changeset", nargs="+", default=None,
+                        help="Применить changeset(ы) get_data.py --mode sync к очищенным данным (--output) по порядку")
+    parser.add_argument("--index", action="store_true",
+                        help="После --changeset переиндексировать затронутые страницы в базе --store")
+    parser.add_argument("--manifest", default="docker/db_manifest.json", help="Манифест баз (с --index)")
+    parser.add_argument("--store", default="general", help="База из манифеста, которую обновить (с --index)")
+    parser.add_argument("--cpu", action="store_true", help="Эмбеддить на CPU (с --index)")
+    args = parser.parse_args()
+
+    if args.changeset:
+        cleaned_path = args.output or "data/data/wiki_dump_cleaned.json"
+        touched = set()
+        for changeset_path in args.changeset:
+            touched.update(apply_changeset(changeset_path, cleaned_path))
+        if args.index:
+            from pipeline import reindex_pages
+            reindex_pages(sorted(touched), cleaned_path, args.manifest, args.store, use_cuda=not args.cpu)
+        else:
+            print(f"Затронуто {len(touched)} страниц; чтобы обновить базу, добавь --index")
+        raise SystemExit(0)
+
+    if args.profile:
+        from clean_profile import profile_dump
+        profile_dump(
+            file_path=args.input or "data/data/wiki_dump_raw.json",
+            legacy=args.profile_legacy,
+            top_n=args.top,
+            limit=args.limit,
+            profile_dir=args.profile_dir,
+            profile_pages=args.profile_pages,
+            output_path=args.profile_out
+        )
+        raise SystemExit(0)
+
     ok = False
     test(ok)
     #print(clean_entry({"title":"a", "content":"{{#af_template:itemlist|{{#af_map:|npc|{{item|{{{}}}|icons=no|maxsize=50x50px}}}}}}"}))
-    clean_all()
+    if args.workers is None:
+        clean_all(
+            file_path=args.input or "data/data/wiki_dump_raw.json",
+            output_path=args.output or "data/data/wiki_dump_cleaned.json"
+        )
+        if args.template_stats:
+            engine.report(args.top)
+    else:
+        clean_all_parallel(
+            file_path=args.input or "data/data/wiki_dump.jsonl",
+            output_path=args.output or "data/data/wiki_dump_cleaned.jsonl",
+            workers=args.workers or None,
+            chunksize=args.chunksize,
+            top_n=args.top
+        )
 
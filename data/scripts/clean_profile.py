@@ -0,0 +1,172 @@
+"""
+clean_profile.py — профилирование очистки по шагам (clean_data.py --profile)
+
+StageProfiler передаётся в clean_entry / clean_entry_legacy и замеряет каждый шаг из
+CLEAN_STAGES / LEGACY_STAGES на каждой странице: время, размер на входе и на выходе
+(для дерева wikitext — число узлов верхнего уровня). Отчёт: суммарное время по шагам,
+самые медленные страницы каждого шага и гистограмма времени очистки страницы.
+
+Самые медленные страницы можно прогнать ещё раз под cProfile: .prof-файлы открываются
+в snakeviz или превращаются во flamegraph (flameprof, gprof2dot).
+
+Использование (из корня репозитория):
+    python data/scripts/clean_data.py --profile --input data/data/wiki_dump.jsonl --top 10
+    python data/scripts/clean_data.py --profile --profile_legacy --profile_dir data/profile
+"""
+
+import os
+import re
+import json
+import time
+import heapq
+import cProfile
+
+import clean_data
+
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def _size(value) -> int:
+    return len(value) if isinstance(value, (str, list)) else 0
+
+
+class StageProfiler:
+
+    def __init__(self, top_n: int = 10):
+        self.top_n = top_n
+        self.stages = {}  # шаг -> {"seconds", "calls", "chars_in", "chars_out", "slowest"}
+        self.pages = []   # (секунды, название, размер)
+
+    def run(self, stages, value, title=""):
+        page_start = time.perf_counter()
+        page_size = _size(value)
+        for name, stage in stages:
+            size_in = _size(value)
+            start = time.perf_counter()
+            value = stage(value, title)
+            self._record(name, title, time.perf_counter() - start, size_in, _size(value))
+        self.pages.append((time.perf_counter() - page_start, title, page_size))
+        return value
+
+    def _record(self, name, title, elapsed, size_in, size_out):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = {"seconds": 0.0, "calls": 0, "chars_in": 0, "chars_out": 0, "slowest": []}
+        stats["seconds"] += elapsed
+        stats["calls"] += 1
+        stats["chars_in"] += size_in
+        stats["chars_out"] += size_out
+        # min-heap из top_n самых медленных страниц шага
+        heapq.heappush(stats["slowest"], (elapsed, title, size_in, size_out))
+        if len(stats["slowest"]) > self.top_n:
+            heapq.heappop(stats["slowest"])
+
+    def slowest_pages(self, n: int = None):
+        return heapq.nlargest(n or self.top_n, self.pages)
+
+    def histogram(self):
+        """Число страниц в корзинах по времени очистки: [(верхняя граница в мс или None, число)]"""
+        counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        for elapsed, _, _ in self.pages:
+            ms = elapsed * 1000
+            i = 0
+            while i < len(HISTOGRAM_BUCKETS_MS) and ms >= HISTOGRAM_BUCKETS_MS[i]:
+                i += 1
+            counts[i] += 1
+        return list(zip(HISTOGRAM_BUCKETS_MS + [None], counts))
+
+    def report(self):
+        total = sum(stats["seconds"] for stats in self.stages.values()) or 1e-9
+        print(f"\n📊 {len(self.pages)} pages, {total:.2f} s in cleaning stages")
+        print(f"{'stage':<20} {'total s':>9} {'share':>6} {'avg ms':>8} {'chars in':>12} {'chars out':>12}")
+        for name, stats in self.stages.items():
+            print(f"{name:<20} {stats['seconds']:>9.3f} {100 * stats['seconds'] / total:>5.1f}% "
+                  f"{1000 * stats['seconds'] / max(stats['calls'], 1):>8.2f} "
+                  f"{stats['chars_in']:>12} {stats['chars_out']:>12}")
+
+        for name, stats in sorted(self.stages.items(), key=lambda item: item[1]["seconds"], reverse=True):
+            print(f"\n🐢 Slowest pages in {name}:")
+            for elapsed, title, size_in, size_out in sorted(stats["slowest"], reverse=True):
+                print(f"  {elapsed * 1000:8.2f} ms  {size_in:8d} -> {size_out:<8d} {title}")
+
+        print("\n⏱ Page cleaning time:")
+        peak = max((count for _, count in self.histogram()), default=0) or 1
+        lower = 0
+        for upper, count in self.histogram():
+            label = f"{lower}-{upper} ms" if upper is not None else f">= {lower} ms"
+            print(f"  {label:>14} {count:7d} {'#' * round(40 * count / peak)}")
+            lower = upper
+
+    def to_json(self) -> dict:
+        return {
+            "pages": len(self.pages),
+            "stages": {
+                name: {
+                    "seconds": stats["seconds"],
+                    "calls": stats["calls"],
+                    "chars_in": stats["chars_in"],
+                    "chars_out": stats["chars_out"],
+                    "slowest": [{"ms": elapsed * 1000, "title": title, "size_in": size_in, "size_out": size_out}
+                                for elapsed, title, size_in, size_out in sorted(stats["slowest"], reverse=True)],
+                }
+                for name, stats in self.stages.items()
+            },
+            "slowest_pages": [{"ms": elapsed * 1000, "title": title, "size": size}
+                              for elapsed, title, size in self.slowest_pages()],
+            "histogram_ms": [{"below": upper, "pages": count} for upper, count in self.histogram()],
+        }
+
+
+def dump_cprofile(entries: list, profile_dir: str, legacy: bool = False) -> list:
+    """Прогоняет страницы под cProfile, по одному .prof на страницу. Кэш шаблонов сбрасывается перед каждой."""
+    os.makedirs(profile_dir, exist_ok=True)
+    clean = clean_data.clean_entry_legacy if legacy else clean_data.clean_entry
+    paths = []
+    for i, entry in enumerate(entries):
+        clean_data.engine.clear_cache()
+        profile = cProfile.Profile()
+        profile.enable()
+        clean(dict(entry))
+        profile.disable()
+        name = re.sub(r"[^\w.-]+", "_", entry.get("title", ""))[:60]
+        path = os.path.join(profile_dir, f"{i + 1:02d}_{name}.prof")
+        profile.dump_stats(path)
+        paths.append(path)
+    return paths
+
+
+def profile_dump(file_path: str,
+                 legacy: bool = False,
+                 top_n: int = 10,
+                 limit: int = None,
+                 profile_dir: str = None,
+                 profile_pages: int = 3,
+                 output_path: str = None) -> StageProfiler:
+    """Профилирует очистку дампа (служебные страницы пропускаются, как в clean_all)."""
+    clean = clean_data.clean_entry_legacy if legacy else clean_data.clean_entry
+    profiler = StageProfiler(top_n)
+    worst = []  # min-heap из (время, номер, запись) для повторного прогона под cProfile
+    for i, entry in enumerate(clean_data.iter_raw_entries(file_path)):
+        if limit and i >= limit:
+            break
+        if clean_data.is_service_page(entry.get("title", "")):
+            continue
+        pages_before = len(profiler.pages)
+        clean(dict(entry), profiler)
+        if profile_dir and len(profiler.pages) > pages_before:
+            heapq.heappush(worst, (profiler.pages[-1][0], i, entry))
+            if len(worst) > profile_pages:
+                heapq.heappop(worst)
+
+    profiler.report()
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(profiler.to_json(), f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Profile written to {output_path}")
+    if profile_dir:
+        paths = dump_cprofile([entry for _, _, entry in sorted(worst, reverse=True)], profile_dir, legacy)
+        print(f"\n🔥 cProfile of the {len(paths)} slowest pages: {profile_dir}")
+        for path in paths:
+            print(f"  {path}")
+        print("  (snakeviz <file>.prof или flameprof <file>.prof > flame.svg)")
+    return profiler
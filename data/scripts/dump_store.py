@@ -0,0 +1,257 @@
+"""
+dump_store.py — append-only хранилище дампа вики для get_data.py
+
+Каждая страница дописывается в конец файла данных одной записью (строка JSONL
+или отдельный zstd-фрейм для *.zst), а в индекс <path>.idx — строка
+{"title", "offset", "length", "revid", "timestamp"}. Запись страницы — O(1),
+перезаписи всего дампа нет. Возобновление читает только индекс.
+
+Если процесс убили посреди записи, при открытии хвост файла данных, не попавший
+в индекс, отрезается (для JSONL целые строки из хвоста доиндексируются), битая
+последняя строка индекса отбрасывается — эти страницы просто скачаются заново.
+
+Удаление страницы — запись-надгробие {"title", "deleted": true}.
+Старые ревизии и надгробия убирает compact().
+"""
+
+import json
+import os
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("Для сжатого дампа (*.zst) нужен пакет zstandard: pip install zstandard") from e
+    return zstandard
+
+
+class DumpStore:
+
+    def __init__(self, path: str, fsync_every: int = 100, compressed: bool = None):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.compressed = path.endswith(".zst") if compressed is None else compressed
+        self.fsync_every = fsync_every
+        self.index = {}
+        self._pending = 0
+
+        if self.compressed:
+            zstd = _zstd()
+            self._compressor = zstd.ZstdCompressor()
+            self._decompressor = zstd.ZstdDecompressor()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._recover()
+        self._data = open(self.path, "ab")
+        self._index_file = open(self.index_path, "a", encoding="utf-8")
+
+    # ---------------------------------------------
+    # Открытие и восстановление
+    # ---------------------------------------------
+    def _recover(self):
+        self._finish_compaction()
+        end = 0
+        good_index_bytes = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for raw in f:
+                    try:
+                        item = json.loads(raw)
+                    except json.JSONDecodeError:
+                        break  # недописанная последняя строка
+                    if not raw.endswith(b"\n"):
+                        break
+                    self._apply_index_item(item)
+                    end = max(end, item["offset"] + item["length"])
+                    good_index_bytes += len(raw)
+            if good_index_bytes != os.path.getsize(self.index_path):
+                with open(self.index_path, "r+b") as f:
+                    f.truncate(good_index_bytes)
+
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+            return
+
+        size = os.path.getsize(self.path)
+        if size > end and not self.compressed:
+            end = self._reindex_tail(end)
+        if size > end:
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+    def _finish_compaction(self):
+        """
+        compact() сначала подменяет файл данных, потом индекс. Если упали между ними —
+        новый индекс ещё лежит рядом, доводим подмену до конца. Если упали раньше — выбрасываем черновик.
+        """
+        tmp_path = self.path + ".compact"
+        tmp_index = tmp_path + ".idx"
+        if os.path.exists(tmp_index) and not os.path.exists(tmp_path):
+            os.replace(tmp_index, self.index_path)
+        elif os.path.exists(tmp_path):
+            for leftover in (tmp_path, tmp_index):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def _reindex_tail(self, offset: int) -> int:
+        """Доиндексирует целые JSONL-строки после последней записи индекса."""
+        with open(self.path, "rb") as f, open(self.index_path, "a", encoding="utf-8") as index_file:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(raw)
+                except json.JSONDecodeError:
+                    break
+                item = self._index_item(entry, offset, len(raw))
+                index_file.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self._apply_index_item(item)
+                offset += len(raw)
+        return offset
+
+    @staticmethod
+    def _index_item(entry: dict, offset: int, length: int) -> dict:
+        item = {"title": entry["title"], "offset": offset, "length": length}
+        if entry.get("deleted"):
+            item["deleted"] = True
+        else:
+            item["revid"] = entry.get("revid")
+            item["timestamp"] = entry.get("timestamp")
+        return item
+
+    def _apply_index_item(self, item: dict):
+        if item.get("deleted"):
+            self.index.pop(item["title"], None)
+        else:
+            self.index[item["title"]] = item
+
+    # ---------------------------------------------
+    # Запись
+    # ---------------------------------------------
+    def _write(self, entry: dict):
+        payload = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.compressed:
+            payload = self._compressor.compress(payload)
+        offset = self._data.tell()
+        self._data.write(payload)
+        # индекс пишется только после данных: запись без индекса при восстановлении отбросится
+        self._data.flush()
+        item = self._index_item(entry, offset, len(payload))
+        self._index_file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self._index_file.flush()
+        self._apply_index_item(item)
+
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def append(self, entry: dict):
+        self._write(entry)
+
+    def delete(self, title: str):
+        if title in self.index:
+            self._write({"title": title, "deleted": True})
+
+    def sync(self):
+        """fsync данных и индекса — батчами, а не на каждую страницу."""
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+        self._pending = 0
+
+    def close(self):
+        self.sync()
+        self._data.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------------------------------------------
+    # Чтение
+    # ---------------------------------------------
+    def __contains__(self, title: str) -> bool:
+        return title in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def titles(self):
+        return list(self.index)
+
+    def meta(self, title: str) -> dict:
+        """revid и timestamp страницы без чтения её текста."""
+        return self.index.get(title)
+
+    def _read(self, f, item: dict) -> dict:
+        f.seek(item["offset"])
+        payload = f.read(item["length"])
+        if self.compressed:
+            payload = self._decompressor.decompress(payload)
+        return json.loads(payload)
+
+    def get(self, title: str) -> dict:
+        item = self.index.get(title)
+        if item is None:
+            return None
+        self._data.flush()
+        with open(self.path, "rb") as f:
+            return self._read(f, item)
+
+    def iter_entries(self):
+        """Актуальные записи всех страниц в порядке их расположения в файле."""
+        self._data.flush()
+        with open(self.path, "rb") as f:
+            for item in sorted(self.index.values(), key=lambda it: it["offset"]):
+                yield self._read(f, item)
+
+    # ---------------------------------------------
+    # Обслуживание
+    # ---------------------------------------------
+    def compact(self):
+        """Переписывает дамп, оставляя только последнюю ревизию каждой страницы."""
+        tmp_path = self.path + ".compact"
+        self._finish_compaction()
+
+        with DumpStore(tmp_path, fsync_every=10**9, compressed=self.compressed) as compacted:
+            for entry in self.iter_entries():
+                compacted.append(entry)
+        before = os.path.getsize(self.path)
+
+        self._data.close()
+        self._index_file.close()
+        # порядок важен для _finish_compaction: сначала данные, потом индекс
+        os.replace(tmp_path, self.path)
+        os.replace(tmp_path + ".idx", self.index_path)
+
+        self.index = {}
+        self._pending = 0
+        self._recover()
+        self._data = open(self.path, "ab")
+        self._index_file = open(self.index_path, "a", encoding="utf-8")
+        print(f"🧹 Компактизация: {before} -> {os.path.getsize(self.path)} байт, {len(self.index)} страниц")
+
+    def export_json(self, output_path: str):
+        """Выгружает дамп в прежний формат {title: запись} для скриптов, которые читают JSON."""
+        data = {entry["title"]: entry for entry in self.iter_entries()}
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        return len(data)
+
+    def import_json(self, json_path: str):
+        """Переносит старый wiki_dump.json в хранилище (уже имеющиеся страницы не трогаются)."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        added = 0
+        for title, entry in data.items():
+            if title not in self.index:
+                self.append(entry)
+                added += 1
+        self.sync()
+        return added
@@ -4,7 +4,9 @@ get_data.py — скрипт для выгрузки данных с Terraria Wi
 
 Использование:
     python data/get_data.py --mode list     # выгрузить список всех страниц
-    python data/get_data.py --mode dump     # выгрузить тексты страниц
+    python data/get_data.py --mode dump     # выгрузить тексты страниц (по одной)
+    python data/get_data.py --mode fetch    # выгрузить тексты страниц пачками по 50, параллельно
+    python data/get_data.py --mode sync     # докачать только изменённые с прошлой выгрузки страницы
     
 LICENSE: blablabla
 """
@@ -14,11 +16,20 @@ import json
 import time
 import os
 import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from dump_store import DumpStore
+
+DUMP_PATH = "../data/wiki_dump.jsonl"  # можно *.jsonl.zst — тогда записи сжимаются zstd
+LEGACY_DUMP_PATH = "../data/wiki_dump.json"
 
 BASE_URL = "https://terraria.wiki.gg/ru/api.php"
 HEADERS = {"User-Agent": "TerrariaRAGBot/0.1 (by nvclon)"}
 
-def get_all_pages():
+def get_all_pages(base_url: str = BASE_URL):
     all_pages = []
     apcontinue = None
     tries = 0
@@ -36,7 +47,7 @@ def get_all_pages():
             params["apcontinue"] = apcontinue
 
         try:
-            r = requests.get(BASE_URL, params=params, headers=HEADERS, timeout=15)
+            r = requests.get(base_url, params=params, headers=HEADERS, timeout=15)
             if r.status_code == 429:
                 print("⚠️ HTTP 429 Too Many Requests — жду 15 сек...")
                 time.sleep(15)
@@ -148,50 +159,584 @@ def dump_all_pages():
     with open("../data/pages_list.json", "r", encoding="utf-8") as f:
         pages = json.load(f)
 
-    # Загружаем уже скачанные (если есть)
-    dump_path = "../data/wiki_dump.json"
-    if os.path.exists(dump_path):
-        with open(dump_path, "r", encoding="utf-8") as f:
-            all_data = json.load(f)
-        print(f"🔁 Возобновляем загрузку, уже скачано {len(all_data)} страниц.")
-    else:
-        all_data = {}
+    # Уже скачанные страницы берём из индекса дампа
+    store = open_dump(DUMP_PATH)
 
     for i, page in enumerate(pages, start=1):
         title = page["title"]
-        if title in all_data:
+        if title in store:
             continue  # уже скачано
 
         text = get_page_text(title)
         if text is None:
             continue
 
-        all_data[title] = text
+        store.append(text)
         print(f"{i}/{len(pages)}: {title}")
 
-        # Автосейв каждые 100 страниц
-        if i % 100 == 0:
-            with open(dump_path, "w", encoding="utf-8") as f:
-                json.dump(all_data, f, ensure_ascii=False, indent=2)
-            print(f"💾 Автосохранение: {len(all_data)} страниц")
-
         time.sleep(2)  # небольшая пауза, чтобы не словить 429
 
-    # Финальное сохранение
-    with open(dump_path, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
-    print(f"✅ Готово! Сохранено {len(all_data)} страниц в {dump_path}")
+    store.close()
+    print(f"✅ Готово! Сохранено {len(store)} страниц в {DUMP_PATH}")
+
+
+def open_dump(dump_path: str = DUMP_PATH) -> DumpStore:
+    """Открывает дамп; при первом запуске переносит в него старый wiki_dump.json."""
+    store = DumpStore(dump_path)
+    if len(store) == 0 and os.path.exists(LEGACY_DUMP_PATH):
+        added = store.import_json(LEGACY_DUMP_PATH)
+        print(f"📦 Перенесено {added} страниц из {LEGACY_DUMP_PATH}")
+    elif len(store):
+        print(f"🔁 Возобновляем загрузку, уже скачано {len(store)} страниц.")
+    return store
+
+
+# ---------------------------------------------
+# 3️⃣ Пакетная параллельная загрузка
+# ---------------------------------------------
+MAX_TITLES_PER_REQUEST = 50  # лимит MediaWiki на titles= для обычного клиента
+MAX_RETRIES = 5               # повторов при ошибках (HTTP 5xx, обрыв соединения, ошибка API)
+MAX_THROTTLES = 10            # ответов 429 подряд на один запрос, после которых он считается неудачным
+RETRY_BASE_DELAY = 2.0        # задержка перед первым повтором, дальше удваивается
+RETRY_MAX_DELAY = 60.0
+
+
+class TokenBucket:
+    """
+    Token bucket с адаптивной скоростью (AIMD): после 429 скорость падает вдвое
+    и все потоки ждут Retry-After, после каждого успешного ответа скорость
+    понемногу растёт обратно до max_rate.
+    """
+
+    def __init__(self, rate: float = 1.0, max_rate: float = 5.0, min_rate: float = 0.1, capacity: float = 2.0):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait_for)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.05)
+
+    def on_throttle(self, retry_after: float = None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+
+
+class ThrottledError(Exception):
+    def __init__(self, retry_after: float = None):
+        super().__init__(f"429 Too Many Requests, Retry-After={retry_after}")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_local = threading.local()
+
+
+def get_session() -> requests.Session:
+    # requests.Session не потокобезопасна — держим свою в каждом потоке
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+        _local.session.headers.update(HEADERS)
+    return _local.session
+
+
+def revisions_request(params: dict, bucket: TokenBucket, base_url: str = BASE_URL) -> dict:
+    """Один запрос к API с учётом rate limit. 429 и 5xx превращаются в исключения для повтора."""
+    bucket.acquire()
+    r = get_session().get(base_url, params=params, timeout=60)
+    if r.status_code == 429 or (r.status_code == 503 and "Retry-After" in r.headers):
+        retry_after = parse_retry_after(r.headers.get("Retry-After"))
+        bucket.on_throttle(retry_after)
+        raise ThrottledError(retry_after)
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code}")
+    data = r.json()
+    if "error" in data:
+        if data["error"].get("code") == "ratelimited":
+            bucket.on_throttle()
+            raise ThrottledError()
+        raise RuntimeError(f"Ошибка API: {data['error'].get('info')}")
+    bucket.on_success()
+    return data
+
+
+def request_with_retry(params: dict, bucket: TokenBucket, base_url: str = BASE_URL,
+                       max_retries: int = MAX_RETRIES, max_throttles: int = MAX_THROTTLES) -> dict:
+    """
+    revisions_request с ограниченными повторами: ошибки повторяются с экспоненциальной
+    задержкой не больше max_retries раз, 429 — не больше max_throttles раз (паузу задаёт bucket).
+    Потом пробрасывается последняя ошибка.
+    """
+    errors = throttles = 0
+    while True:
+        try:
+            return revisions_request(params, bucket, base_url)
+        except ThrottledError:
+            throttles += 1
+            if throttles > max_throttles:
+                print(f"❌ Сервер отвечает 429 уже {throttles} раз подряд — сдаюсь")
+                raise
+        except Exception as e:
+            errors += 1
+            if errors > max_retries:
+                print(f"❌ Ошибка: {e}, попытки исчерпаны ({errors})")
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (errors - 1))
+            print(f"⚠️ Ошибка: {e}, повтор {errors}/{max_retries} через {delay:.0f} с...")
+            time.sleep(delay)
+
+
+def page_from_api(page: dict) -> dict:
+    """Запись дампа из страницы ответа prop=revisions (formatversion=2)."""
+    rev = page["revisions"][0]
+    return {
+        "title": page["title"],
+        "pageid": page.get("pageid"),
+        "ns": page.get("ns"),
+        "revid": rev.get("revid"),
+        "timestamp": rev.get("timestamp"),
+        "user": rev.get("user"),
+        "content": rev.get("slots", {}).get("main", {}).get("content", ""),
+    }
+
+
+def fetch_batch(titles: list, bucket: TokenBucket, base_url: str = BASE_URL):
+    """
+    Загружает до 50 страниц одним запросом.
+    Возвращает (страницы, отсутствующие на вики, недогруженные).
+    Недогруженные — страницы без ревизий в ответе (например, API обрезал ответ по размеру).
+    """
+    params = {
+        "action": "query",
+        "prop": "revisions",
+        "rvslots": "main",
+        "rvprop": "content|timestamp|user|ids",
+        "titles": "|".join(titles),
+        "format": "json",
+        "formatversion": "2",
+    }
+    data = revisions_request(params, bucket, base_url)
+    query = data.get("query", {})
+
+    # API нормализует названия (первая буква, подчёркивания) — возвращаемся к исходным
+    original = {t: t for t in titles}
+    for item in query.get("normalized", []):
+        original[item["to"]] = item["from"]
+
+    pages, missing = [], []
+    returned = set()
+    for page in query.get("pages", []):
+        title = original.get(page.get("title"), page.get("title"))
+        returned.add(title)
+        if page.get("missing") or page.get("invalid"):
+            missing.append(title)
+            continue
+        if not page.get("revisions"):
+            returned.discard(title)
+            continue
+        entry = page_from_api(page)
+        entry["title"] = title
+        pages.append(entry)
+
+    incomplete = [t for t in titles if t not in returned]
+    return pages, missing, incomplete
+
+
+def fetch_pages(titles: list,
+                on_page,
+                base_url: str = BASE_URL,
+                workers: int = 4,
+                batch_size: int = MAX_TITLES_PER_REQUEST,
+                max_retries: int = MAX_RETRIES,
+                max_throttles: int = MAX_THROTTLES,
+                bucket: TokenBucket = None):
+    """
+    Загружает страницы пачками по batch_size в workers потоков.
+    on_page(entry) вызывается в основном потоке для каждой загруженной страницы.
+    Неудачные пачки и недогруженные страницы возвращаются в очередь повторов; после max_retries
+    попыток пачка дробится пополам, чтобы одна проблемная страница не тянула за собой остальные.
+    Одиночная страница, которая так и не загрузилась, считается неудачной, а если API раз за разом
+    отдаёт её без ревизий — отсутствующей. Пачка, получившая больше max_throttles ответов 429,
+    тоже считается неудачной. Возвращает (отсутствующие на вики, так и не загруженные).
+    """
+    bucket = bucket or TokenBucket()
+    # (названия, номер попытки, сколько раз получили 429)
+    queue = deque((titles[i:i + batch_size], 0, 0) for i in range(0, len(titles), batch_size))
+    missing, failed = [], []
+    done = 0
+
+    def retry(batch, attempt):
+        """Ставит пачку на повтор или дробит её; False — повторять больше нечего."""
+        if attempt + 1 < max_retries:
+            queue.append((batch, attempt + 1, 0))
+        elif len(batch) > 1:
+            half = len(batch) // 2
+            queue.append((batch[:half], 0, 0))
+            queue.append((batch[half:], 0, 0))
+        else:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while queue or running:
+            while queue and len(running) < workers:
+                batch, attempt, throttles = queue.popleft()
+                running[executor.submit(fetch_batch, batch, bucket, base_url)] = (batch, attempt, throttles)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                batch, attempt, throttles = running.pop(future)
+                try:
+                    pages, batch_missing, incomplete = future.result()
+                except ThrottledError:
+                    # 429 не считаем попыткой — bucket уже замедлился, но и ждать бесконечно не будем
+                    if throttles + 1 > max_throttles:
+                        print(f"❌ Пачка из {len(batch)} страниц получила 429 {throttles + 1} раз — пропускаю")
+                        failed.extend(batch)
+                    else:
+                        queue.append((batch, attempt, throttles + 1))
+                    continue
+                except Exception as e:
+                    print(f"⚠️ Ошибка пачки из {len(batch)} страниц (попытка {attempt + 1}): {e}")
+                    if not retry(batch, attempt):
+                        failed.extend(batch)
+                    continue
+
+                for entry in pages:
+                    on_page(entry)
+                missing.extend(batch_missing)
+                if incomplete and not retry(incomplete, attempt):
+                    print(f"⚠️ API не отдаёт ревизии страницы {incomplete[0]} — считаю её отсутствующей")
+                    missing.extend(incomplete)
+                done += len(pages)
+                print(f"📥 {done}/{len(titles)} страниц, скорость {bucket.rate:.2f} запр/с")
+
+    return missing, failed
+
+
+def fetch_all_via_generator(on_page, base_url: str = BASE_URL, bucket: TokenBucket = None):
+    """
+    Перечисляет и загружает все страницы основного пространства одним проходом
+    через generator=allpages. Продолжение (continue) последовательное, поэтому без потоков.
+    Если запрос не удался и после повторов, ошибка пробрасывается.
+    """
+    bucket = bucket or TokenBucket()
+    params = {
+        "action": "query",
+        "generator": "allpages",
+        "gapnamespace": 0,
+        "gapfilterredir": "nonredirects",
+        "gaplimit": MAX_TITLES_PER_REQUEST,
+        "prop": "revisions",
+        "rvslots": "main",
+        "rvprop": "content|timestamp|user|ids",
+        "format": "json",
+        "formatversion": "2",
+    }
+    cont = {}
+    total = 0
+    while True:
+        data = request_with_retry({**params, **cont}, bucket, base_url)
+
+        for page in data.get("query", {}).get("pages", []):
+            if page.get("revisions"):
+                on_page(page_from_api(page))
+                total += 1
+        print(f"📥 {total} страниц")
+
+        if "continue" not in data:
+            return total
+        cont = data["continue"]
+
+
+def fetch_all_pages(base_url: str = BASE_URL,
+                    workers: int = 4,
+                    rate: float = 1.0,
+                    max_rate: float = 5.0,
+                    source: str = "list",
+                    pages_path: str = "../data/pages_list.json",
+                    dump_path: str = DUMP_PATH):
+    """Пакетная версия dump_all_pages с тем же дампом и возобновлением."""
+    store = open_dump(dump_path)
+
+    def on_page(entry):
+        store.append(entry)
+
+    bucket = TokenBucket(rate=rate, max_rate=max_rate)
+    if source == "allpages":
+        try:
+            fetch_all_via_generator(on_page, base_url, bucket)
+        except Exception as e:
+            store.close()
+            print(f"❌ Загрузка прервана: {e}. Уже скачано {len(store)} страниц — запусти ещё раз")
+            return
+        missing, failed = [], []
+    else:
+        if not os.path.exists(pages_path):
+            print(f"❌ Не найден {pages_path}. Сначала запусти --mode list")
+            store.close()
+            return
+        with open(pages_path, "r", encoding="utf-8") as f:
+            titles = [page["title"] for page in json.load(f)]
+        titles = [t for t in titles if t not in store]
+        missing, failed = fetch_pages(titles, on_page, base_url, workers=workers, bucket=bucket)
+
+    store.close()
+    print(f"✅ Готово! Сохранено {len(store)} страниц в {dump_path}")
+    if missing:
+        print(f"⚠️ Нет на вики: {len(missing)} страниц")
+    if failed:
+        failed_path = os.path.splitext(dump_path)[0] + "_failed.json"
+        with open(failed_path, "w", encoding="utf-8") as f:
+            json.dump(failed, f, ensure_ascii=False, indent=2)
+        print(f"❌ Не удалось загрузить {len(failed)} страниц, список в {failed_path} — запусти ещё раз")
+
+
+# ---------------------------------------------
+# 4️⃣ Инкрементальная синхронизация
+# ---------------------------------------------
+def utc_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def get_recent_changes(since: str, bucket: TokenBucket, base_url: str = BASE_URL):
+    """
+    Страницы основного пространства, созданные, изменённые, удалённые или переименованные после since.
+    Возвращает (изменённые названия, удалённые названия). Список хранится на вики ограниченное
+    время ($wgRCMaxAge, обычно 90 дней) — для более старых дампов используйте strategy=revisions.
+    """
+    params = {
+        "action": "query",
+        "list": "recentchanges",
+        "rcnamespace": 0,
+        "rcdir": "newer",
+        "rcstart": since,
+        "rctype": "edit|new|log",
+        "rcprop": "title|timestamp|loginfo",
+        "rclimit": 500,
+        "format": "json",
+        "formatversion": "2",
+    }
+    # события идут по времени, поэтому последнее событие для страницы определяет её судьбу
+    status = {}
+    cont = {}
+    while True:
+        data = request_with_retry({**params, **cont}, bucket, base_url)
+
+        for change in data.get("query", {}).get("recentchanges", []):
+            title = change["title"]
+            if change.get("type") != "log":
+                status[title] = "changed"
+            elif change.get("logtype") == "delete" and change.get("logaction") == "delete":
+                status[title] = "deleted"
+            elif change.get("logtype") == "delete" and change.get("logaction") == "restore":
+                status[title] = "changed"
+            elif change.get("logtype") == "move":
+                status[title] = "deleted"
+                target = change.get("logparams", {}).get("target_title")
+                if target and change.get("logparams", {}).get("target_ns", 0) == 0:
+                    status[target] = "changed"
+
+        if "continue" not in data:
+            break
+        cont = data["continue"]
+
+    changed = [t for t, st in status.items() if st == "changed"]
+    deleted = [t for t, st in status.items() if st == "deleted"]
+    return changed, deleted
+
+
+def get_last_revisions(titles: list, bucket: TokenBucket, base_url: str = BASE_URL) -> dict:
+    """Последняя ревизия (revid, timestamp) для каждой страницы, без текста — пачками по 50."""
+    revisions = {}
+    for i in range(0, len(titles), MAX_TITLES_PER_REQUEST):
+        batch = titles[i:i + MAX_TITLES_PER_REQUEST]
+        params = {
+            "action": "query",
+            "prop": "revisions",
+            "rvprop": "ids|timestamp",
+            "titles": "|".join(batch),
+            "format": "json",
+            "formatversion": "2",
+        }
+        data = request_with_retry(params, bucket, base_url)
+        original = {t: t for t in batch}
+        for item in data.get("query", {}).get("normalized", []):
+            original[item["to"]] = item["from"]
+        for page in data.get("query", {}).get("pages", []):
+            if page.get("revisions"):
+                rev = page["revisions"][0]
+                revisions[original.get(page["title"], page["title"])] = (rev.get("revid"), rev.get("timestamp"))
+    return revisions
+
+
+def get_changed_by_revisions(store: DumpStore, bucket: TokenBucket, base_url: str = BASE_URL):
+    """
+    Сравнивает последние ревизии всех страниц со списком allpages и дампом.
+    Дороже recentchanges (~len/50 запросов), но не ограничено по давности.
+    """
+    titles = [page["title"] for page in get_all_pages(base_url)]
+    current = get_last_revisions(titles, bucket, base_url)
+    changed = []
+    for title, (revid, timestamp) in current.items():
+        entry = store.meta(title)
+        if entry is None:
+            changed.append(title)
+        elif entry.get("revid") is not None:
+            if entry["revid"] != revid:
+                changed.append(title)
+        elif (entry.get("timestamp") or "") < (timestamp or ""):
+            changed.append(title)
+    deleted = [title for title in store.titles() if title not in current]
+    return changed, deleted
+
+
+def sync_pages(base_url: str = BASE_URL,
+               workers: int = 4,
+               rate: float = 1.0,
+               max_rate: float = 5.0,
+               strategy: str = "recentchanges",
+               since: str = None,
+               dump_path: str = DUMP_PATH,
+               state_path: str = "../data/sync_state.json",
+               changeset_dir: str = "../data/changesets"):
+    """
+    Докачивает в дамп только страницы, изменённые после прошлой синхронизации,
+    и пишет changeset: {"since", "until", "upserted": [записи дампа], "deleted": [названия]}.
+    Его умеет применять clean_data.apply_changeset.
+    """
+    if not os.path.exists(dump_path):
+        print(f"❌ Не найден {dump_path}. Сначала запусти --mode fetch")
+        return
+
+    store = DumpStore(dump_path)
+
+    if since is None and os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            since = json.load(f).get("last_sync")
+    if since is None:
+        since = max((store.meta(t).get("timestamp") or "" for t in store.titles()), default="") or None
+    if since is None and strategy == "recentchanges":
+        print("❌ Не удалось определить время прошлой выгрузки, укажи --since или --strategy revisions")
+        store.close()
+        return
+
+    until = utc_now()
+    bucket = TokenBucket(rate=rate, max_rate=max_rate)
+    print(f"🔎 Ищем изменения с {since} ({strategy})...")
+    try:
+        if strategy == "recentchanges":
+            changed, deleted = get_recent_changes(since, bucket, base_url)
+        else:
+            changed, deleted = get_changed_by_revisions(store, bucket, base_url)
+    except Exception as e:
+        print(f"❌ Не удалось получить список изменений: {e}. Дамп не изменён, запусти ещё раз")
+        store.close()
+        return
+    print(f"✏️ Изменено: {len(changed)}, удалено: {len(deleted)}")
+
+    upserted = []
+
+    def on_page(entry):
+        store.append(entry)
+        upserted.append(entry)
+
+    missing, failed = fetch_pages(changed, on_page, base_url, workers=workers, bucket=bucket)
+    # страница удалена уже после события правки
+    deleted = sorted(set(deleted) | set(missing))
+    for title in deleted:
+        store.delete(title)
+    store.close()
+
+    os.makedirs(changeset_dir, exist_ok=True)
+    changeset_path = os.path.join(changeset_dir, f"changeset_{until.replace(':', '')}.json")
+    with open(changeset_path, "w", encoding="utf-8") as f:
+        json.dump({"since": since, "until": until, "upserted": upserted, "deleted": deleted},
+                  f, ensure_ascii=False, indent=2)
+
+    if failed:
+        print(f"❌ Не удалось загрузить {len(failed)} страниц — время синхронизации не сдвигаем, запусти ещё раз")
+    else:
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"last_sync": until}, f, ensure_ascii=False, indent=2)
+    print(f"✅ Changeset сохранён в {changeset_path}: {len(upserted)} обновлено, {len(deleted)} удалено")
+    return changeset_path
 
 
 # ---------------------------------------------
-# 3️⃣ CLI
+# 5️⃣ CLI
 # ---------------------------------------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Выгрузка Terraria Wiki данных")
-    parser.add_argument("--mode", choices=["list", "dump"], required=True, help="Режим: list или dump")
+    parser.add_argument("--mode", choices=["list", "dump", "fetch", "sync", "compact", "export"], required=True,
+                        help="Режим: list, dump, fetch, sync, compact (убрать старые ревизии из дампа) или export (дамп в JSON)")
+    parser.add_argument("--export_path", default="../data/wiki_dump_raw.json", help="Куда выгрузить дамп в JSON (для export)")
+    parser.add_argument("--base_url", default=BASE_URL, help="URL api.php (для fetch)")
+    parser.add_argument("--workers", type=int, default=4, help="Параллельных запросов (для fetch)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Начальная скорость, запросов в секунду (для fetch)")
+    parser.add_argument("--max_rate", type=float, default=5.0, help="Максимальная скорость, запросов в секунду (для fetch)")
+    parser.add_argument("--source", choices=["list", "allpages"], default="list",
+                        help="Откуда брать названия: pages_list.json или generator=allpages (для fetch)")
+    parser.add_argument("--strategy", choices=["recentchanges", "revisions"], default="recentchanges",
+                        help="Как искать изменения: list=recentchanges или сравнение последних ревизий (для sync)")
+    parser.add_argument("--since", default=None, help="Время прошлой выгрузки, ISO 8601 (для sync; по умолчанию из sync_state.json)")
     args = parser.parse_args()
 
     if args.mode == "list":
         dump_page_list()
     elif args.mode == "dump":
-        dump_all_pages()
\ No newline at end of file
+        dump_all_pages()
+    elif args.mode == "fetch":
+        fetch_all_pages(
+            base_url=args.base_url,
+            workers=args.workers,
+            rate=args.rate,
+            max_rate=args.max_rate,
+            source=args.source,
+        )
+    elif args.mode == "sync":
+        sync_pages(
+            base_url=args.base_url,
+            workers=args.workers,
+            rate=args.rate,
+            max_rate=args.max_rate,
+            strategy=args.strategy,
+            since=args.since,
+        )
+    elif args.mode == "compact":
+        with DumpStore(DUMP_PATH) as store:
+            store.compact()
+    elif args.mode == "export":
+        with DumpStore(DUMP_PATH) as store:
+            count = store.export_json(args.export_path)
+        print(f"✅ {count} страниц выгружено в {args.export_path}")
@@ -8,28 +8,36 @@ def get_all_recipes():
     recipes = {}
 
     for key in data:
-        out = parse_to_object_format(data[key]['content'])
+        merge_recipes(recipes, parse_to_object_format(data[key]['content']))
 
-        for name, info in out.items():
-            if name not in recipes:
-                recipes[name] = info
-            else:
-                # ДОБАВЛЯЕМ рецепты, а не перезаписываем предмет
-                recipes[name]["recipes"].extend(info["recipes"])
+    return recipes
 
-                # ЕСЛИ старого id нет, берем новый
-                if recipes[name].get("id") is None and info.get("id") is not None:
-                    recipes[name]["id"] = info["id"]
+def merge_recipes(recipes, out):
+    """Добавляет рецепты одной страницы (результат parse_to_object_format) к общему словарю."""
+    for name, info in out.items():
+        if name not in recipes:
+            recipes[name] = info
+        else:
+            # ДОБАВЛЯЕМ рецепты, а не перезаписываем предмет
+            recipes[name]["recipes"].extend(info["recipes"])
 
-    return recipes
+            # ЕСЛИ старого id нет, берем новый
+            if recipes[name].get("id") is None and info.get("id") is not None:
+                recipes[name]["id"] = info["id"]
 
-def parse_to_object_format(text):
+def remove_version_lines(text):
     # удаляем строки с version, чтобы не мешали вложенные {{...}}
-    text = re.sub(r"\|\s*version\s*=.*", "", text, flags=re.I)
+    return re.sub(r"\|\s*version\s*=.*", "", text, flags=re.I)
+
+def parse_to_object_format(text):
+    text = remove_version_lines(text)
 
     # находим блоки {{recipes/register ...}}
     blocks = re.findall(r"\{\{recipes/register(.*?)\}\}", text, flags=re.S)
+    return parse_register_blocks(blocks)
 
+def parse_register_blocks(blocks):
+    """Разбирает тела шаблонов {{recipes/register ...}} (без имени шаблона) в {предмет: рецепты}."""
     out = {}
 
     for block in blocks:
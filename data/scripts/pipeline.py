@@ -0,0 +1,467 @@
+"""
+pipeline.py — полное обновление данных за один проход по дампу вики
+
+Каждая страница разбирается один раз (clean_data.parse_content), и за один проход получаются:
+    рецепты       — шаблоны {{recipes/register}} из сырого текста (get_recipes.py) -> recipes_new.json
+    чистый текст  — как clean_data.clean_entry                         -> wiki_dump_cleaned.jsonl
+    чанки         — как manage_db.split_texts с параметрами базы из манифеста -> chunks_general.jsonl
+Очищенный текст и чанки пишутся потоком по мере обработки страниц. Рецепты копятся
+в памяти (страница может дополнять рецепты уже встреченного предмета) и пишутся в конце.
+
+Шаблоны {{recipes|...}} раскрываются по рецептам всего дампа, поэтому страницы с ними
+откладываются (вместе с уже построенным деревом) и дорисовываются после прохода.
+
+Использование (из корня репозитория):
+    python data/scripts/pipeline.py --input data/data/wiki_dump.jsonl
+    python manage_db.py build-all --manifest docker/db_manifest.json   # с "chunks_path" у базы general
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+import clean_data
+from get_recipes import merge_recipes, parse_to_object_format
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+REGISTER = "{{recipes/register"
+RECIPES_TEMPLATE = re.compile(r"\{\{\s*recipes\s*\|", re.I)
+
+
+def recipes_from_raw(content: str) -> dict:
+    """
+    Рецепты страницы — ровно как get_recipes.py, по сырому тексту: после prepare_content
+    в блоках уже раскрыты ссылки и {{PAGENAME}}, снято ''' и ударения, и recipes.json вышел бы другим.
+    Страницы без {{recipes/register}} (почти все) отсекаются проверкой подстроки.
+    """
+    return parse_to_object_format(content) if REGISTER in content else {}
+
+
+def find_store(manifest_path: str, store_name: str) -> dict:
+    """Описание базы из манифеста build-all (читается без manage_db, чтобы не тянуть torch)."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    for store in manifest.get("stores", []):
+        if store.get("name") == store_name:
+            return dict(store, embedding_model=manifest.get("embedding_model", "intfloat/multilingual-e5-large"))
+    raise ValueError(f"Store {store_name} not found in {manifest_path}.")
+
+
+def load_splitter(manifest_path: str, store_name: str):
+    """
+    Возвращает split(texts, metadatas) -> чанки с параметрами базы store_name из манифеста,
+    ровно как их нарежет manage_db.py build-all. manage_db (и torch) импортируется только здесь.
+    """
+    sys.path.insert(0, ROOT_DIR)
+    from src.manage_db import E5_MAX_TOKENS, load_tokenizer, split_texts
+
+    store = find_store(manifest_path, store_name)
+    splitter = store.get("splitter", "chars")
+    tokenizer = None
+    if splitter == "tokens":
+        tokenizer = load_tokenizer(store["embedding_model"])
+
+    def split(texts, metadatas):
+        return split_texts(
+            texts,
+            splitter=splitter,
+            chunk_size=store.get("chunk_size", 5000),
+            chunk_overlap=store.get("chunk_overlap", 1000),
+            min_length=store.get("min_length", 0),
+            separators=store.get("separators", ["\n\n", "\n", " "]),
+            tokenizer=tokenizer,
+            embed_window=store.get("embed_window", E5_MAX_TOKENS),
+            embed_overlap=store.get("embed_overlap", 64),
+            metadatas=metadatas,
+        )
+    return split
+
+
+def run_pipeline(input_path="data/data/wiki_dump.jsonl",
+                 cleaned_path="data/data/wiki_dump_cleaned.jsonl",
+                 recipes_path=clean_data.RECIPES_PATH,
+                 chunks_path="data/data/chunks_general.jsonl",
+                 manifest_path="docker/db_manifest.json",
+                 store_name="general",
+                 batch_pages=64):
+    """Один проход по дампу. chunks_path=None — без нарезки (и без импорта manage_db)."""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"The file {input_path} does not exist.")
+
+    split = load_splitter(manifest_path, store_name) if chunks_path else None
+    # до конца прохода {{recipes}} раскрывать не по чему — и не по устаревшему recipes_new.json
+    clean_data.set_recipes({})
+
+    recipes = {}
+    deferred = []   # (запись, дерево) страниц с {{recipes|...}}
+    pending = []    # очищенные страницы, ждущие нарезки
+    pages = cleaned_count = chunk_count = 0
+    start = time.perf_counter()
+
+    cleaned_tmp = cleaned_path + ".tmp"
+    chunks_tmp = chunks_path + ".tmp" if chunks_path else None
+    cleaned_file = open(cleaned_tmp, "w", encoding="utf-8")
+    chunks_file = open(chunks_tmp, "w", encoding="utf-8") if chunks_path else None
+
+    def flush_chunks():
+        nonlocal chunk_count
+        if not pending:
+            return
+        chunks = split([text for text, _ in pending], [metadata for _, metadata in pending])
+        for chunk in chunks:
+            chunks_file.write(json.dumps({"page_content": chunk.page_content, "metadata": chunk.metadata},
+                                         ensure_ascii=False) + "\n")
+        chunk_count += len(chunks)
+        pending.clear()
+
+    def emit(entry, nodes):
+        nonlocal cleaned_count
+        entry = dict(entry)
+        if entry.get("content"):
+            entry["content"] = clean_data.render_content(nodes)
+        cleaned_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        cleaned_count += 1
+        if split is not None:
+            pending.append((entry.get("content", ""), {"title": entry.get("title", "")}))
+            if len(pending) >= batch_pages:
+                flush_chunks()
+
+    try:
+        for entry in clean_data.iter_raw_entries(input_path):
+            pages += 1
+            title = entry.get("title", "")
+            content = entry.get("content", "")
+
+            # рецепты берём и со служебных страниц: {{recipes/register}} живут как раз на них
+            merge_recipes(recipes, recipes_from_raw(content))
+            if clean_data.is_service_page(title):
+                continue
+            prepared = clean_data.prepare_content(content, title) if content else ""
+            nodes = clean_data.parse_content(prepared) if prepared else []
+            if RECIPES_TEMPLATE.search(prepared):
+                deferred.append((entry, nodes))
+                continue
+            emit(entry, nodes)
+
+            if pages % 100 == 0:
+                print(f"Processed {pages} pages, {pages / (time.perf_counter() - start):.1f} pages/sec...")
+
+        clean_data.set_recipes(recipes)
+        print(f"Rendering {len(deferred)} pages with recipe templates...")
+        for entry, nodes in deferred:
+            emit(entry, nodes)
+        deferred.clear()
+        if split is not None:
+            flush_chunks()
+    finally:
+        cleaned_file.close()
+        if chunks_file is not None:
+            chunks_file.close()
+
+    os.replace(cleaned_tmp, cleaned_path)
+    if chunks_path:
+        os.replace(chunks_tmp, chunks_path)
+    recipes_tmp = recipes_path + ".tmp"
+    with open(recipes_tmp, "w", encoding="utf-8") as f:
+        json.dump(recipes, f, ensure_ascii=False, indent=4)
+    os.replace(recipes_tmp, recipes_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {pages} pages in {elapsed:.1f} s ({pages / max(elapsed, 1e-9):.1f} pages/sec)")
+    print(f"   recipes: {len(recipes)} items -> {recipes_path}")
+    print(f"   cleaned: {cleaned_count} pages -> {cleaned_path}")
+    if chunks_path:
+        print(f"   chunks:  {chunk_count} -> {chunks_path}")
+    return {"pages": pages, "recipes": len(recipes), "cleaned": cleaned_count, "chunks": chunk_count}
+
+
+def reindex_pages(titles: list,
+                  cleaned_path="data/data/wiki_dump_cleaned.json",
+                  manifest_path="docker/db_manifest.json",
+                  store_name="general",
+                  use_cuda=True):
+    """
+    Переиндексирует в базе store_name только страницы titles (например, затронутые changeset'ом):
+    их текущий очищенный текст режется с параметрами базы из манифеста, старые чанки удаляются
+    по metadata["title"], новые добавляются. Удалённые страницы просто пропадают из базы.
+    """
+    if not titles:
+        print("Нечего переиндексировать.")
+        return 0
+    wanted = set(titles)
+    entries = [entry for entry in clean_data.load_cleaned(cleaned_path)
+               if entry.get("title") in wanted and entry.get("content")]
+    split = load_splitter(manifest_path, store_name)
+    chunks = split([entry["content"] for entry in entries], [{"title": entry["title"]} for entry in entries])
+
+    store = find_store(manifest_path, store_name)
+    from src.manage_db import update_chunks, hnsw_configuration
+    update_chunks(
+        store["persist_directory"], chunks, sorted(wanted),
+        embedding_model=store["embedding_model"], use_cuda=use_cuda,
+        collection_configuration=hnsw_configuration(
+            store.get("hnsw_m"), store.get("construction_ef"), store.get("search_ef"))
+    )
+    return len(chunks)
+
+
+CHUNK_CONFIG_KEYS = ["splitter", "chunk_size", "chunk_overlap", "min_length", "separators",
+                     "embed_window", "embed_overlap", "embedding_model"]
+
+
+def run_incremental(input_path="data/data/wiki_dump.jsonl",
+                    cleaned_path="data/data/wiki_dump_cleaned.jsonl",
+                    recipes_path=clean_data.RECIPES_PATH,
+                    chunks_path="data/data/chunks_general.jsonl",
+                    manifest_path="docker/db_manifest.json",
+                    store_name="general",
+                    state_path="data/data/pipeline_state.json",
+                    cache_path="data/data/stage_cache.jsonl",
+                    dry_run=False,
+                    index=False,
+                    use_cuda=True,
+                    batch_pages=64,
+                    gc=False):
+    """
+    То же, что run_pipeline, но через кэш этапов (stage_cache.py): страница разбирается и чистится,
+    только если у этапа поменялся вход — сырой текст, код этапа или его конфигурация.
+    Страницы с {{recipes|...}} зависят ещё и от всех рецептов дампа (их хэша).
+    Чанки ключуются по очищенному тексту, и с index=True в базу уходят только страницы,
+    чьи чанки изменились с прошлой индексации. dry_run=True ничего не считает и не пишет,
+    а только показывает, что будет пересобрано.
+    """
+    from stage_cache import StageCache, text_hash, json_hash, load_state, save_state
+
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"The file {input_path} does not exist.")
+
+    store = find_store(manifest_path, store_name)
+    cache = StageCache(cache_path, {"chunks": {key: store.get(key) for key in CHUNK_CONFIG_KEYS}})
+    state = load_state(state_path)
+    old_pages = state["pages"]
+    old_index = state["index"].get(store_name)
+    split = load_splitter(manifest_path, store_name) if chunks_path and not dry_run else None
+    clean_data.set_recipes({})
+
+    recipes = {}
+    pages = {}       # название -> ключи этапов
+    deferred = []    # (запись, сырой хэш, подготовленный текст)
+    pending = []     # (название, очищенный текст, ключ чанков) для нарезки
+    rebuilt = {"recipes": [], "clean": [], "chunks": []}
+    index_chunks = []  # чанки страниц, которые нужно переэмбеддить
+    start = time.perf_counter()
+
+    if not dry_run:
+        cleaned_file = open(cleaned_path + ".tmp", "w", encoding="utf-8")
+        chunks_file = open(chunks_path + ".tmp", "w", encoding="utf-8") if chunks_path else None
+
+    def flush_chunks():
+        cached = {key: cache.get(key) for _, _, key in pending}
+        missing = [(title, text) for title, text, key in pending if cached[key] is None]
+        by_title = {}
+        if missing:
+            for chunk in split([text for _, text in missing], [{"title": title} for title, _ in missing]):
+                by_title.setdefault(chunk.metadata["title"], []).append(
+                    {"page_content": chunk.page_content, "metadata": chunk.metadata})
+        for title, text, key in pending:
+            chunks = cached[key]
+            if chunks is None:
+                chunks = by_title.get(title, [])
+                cache.put(key, chunks)
+            for chunk in chunks:
+                chunks_file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            if index and (old_index is None or old_index.get(title) != key):
+                index_chunks.extend(chunks)
+        pending.clear()
+
+    def emit(entry, cleaned):
+        title = entry.get("title", "")
+        entry = dict(entry)
+        if entry.get("content"):
+            if cleaned is None:
+                # dry_run: текст не пересчитан, чанки страницы тоже считаем пересобираемыми
+                if chunks_path:
+                    rebuilt["chunks"].append(title)
+                return
+            entry["content"] = cleaned
+        if chunks_path:
+            key = cache.key("chunks", text_hash(title, entry.get("content", "")))
+            pages[title]["chunks"] = key
+            if key not in cache:
+                rebuilt["chunks"].append(title)
+        if dry_run:
+            return
+        cleaned_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        if chunks_path:
+            pending.append((title, entry.get("content", ""), pages[title]["chunks"]))
+            if len(pending) >= batch_pages:
+                flush_chunks()
+
+    def clean(title, clean_key, prepared):
+        cleaned = cache.get(clean_key)
+        if cleaned is None:
+            rebuilt["clean"].append(title)
+            if dry_run:
+                return None
+            cleaned = clean_data.render_content(clean_data.parse_content(prepared))
+            cache.put(clean_key, cleaned)
+        return cleaned
+
+    try:
+        for entry in clean_data.iter_raw_entries(input_path):
+            title = entry.get("title", "")
+            content = entry.get("content", "")
+            raw_h = text_hash(title, content)
+            prepared = clean_data.prepare_content(content, title) if content else ""
+            service = clean_data.is_service_page(title)
+            uses_recipes = bool(RECIPES_TEMPLATE.search(prepared))
+            pages[title] = {"raw": raw_h}
+
+            recipes_key = cache.key("recipes", raw_h)
+            pages[title]["recipes"] = recipes_key
+            page_recipes = cache.get(recipes_key)
+            if page_recipes is None:
+                rebuilt["recipes"].append(title)
+                if not dry_run:
+                    page_recipes = recipes_from_raw(content)
+                    cache.put(recipes_key, page_recipes)
+            if page_recipes:
+                merge_recipes(recipes, page_recipes)
+
+            if service:
+                continue
+            if uses_recipes:
+                deferred.append((entry, raw_h, prepared))
+                continue
+            clean_key = cache.key("clean", raw_h)
+            pages[title]["clean"] = clean_key
+            emit(entry, clean(title, clean_key, prepared) if content else None)
+
+        # рецепты страниц, которые в dry_run не разбирались, неизвестны — тогда хэш рецептов не угадать
+        recipes_known = not (dry_run and rebuilt["recipes"])
+        recipes_h = json_hash(recipes) if recipes_known else None
+        clean_data.set_recipes(recipes)
+        for entry, raw_h, prepared in deferred:
+            title = entry.get("title", "")
+            if not recipes_known:
+                rebuilt["clean"].append(title)
+                pages[title]["clean"] = None
+                emit(entry, None)
+                continue
+            clean_key = cache.key("clean", raw_h, recipes_h)
+            pages[title]["clean"] = clean_key
+            emit(entry, clean(title, clean_key, prepared) if entry.get("content") else None)
+        if not dry_run and chunks_path:
+            flush_chunks()
+    finally:
+        if not dry_run:
+            cleaned_file.close()
+            if chunks_file is not None:
+                chunks_file.close()
+
+    removed = sorted(set(old_pages) - set(pages))
+    print(f"{'Dry run: would rebuild' if dry_run else 'Rebuilt'} in {time.perf_counter() - start:.1f} s "
+          f"({len(pages)} pages, {len(removed)} removed since last run):")
+    if chunks_path:
+        # в базу уйдут страницы, чьи чанки отличаются от проиндексированных (или ещё не посчитаны)
+        rebuilt["index"] = [title for title, keys in pages.items() if "clean" in keys
+                            and (old_index is None or old_index.get(title) != keys.get("chunks"))] + removed
+    for stage, titles in rebuilt.items():
+        preview = ", ".join(titles[:5]) + (", ..." if len(titles) > 5 else "")
+        print(f"   {stage:<8} {len(titles):6d}  {preview}")
+    if dry_run:
+        if not recipes_known:
+            print("   (рецепты изменятся — страницы с {{recipes}} пересчитываются все)")
+        cache.close()
+        return rebuilt
+
+    os.replace(cleaned_path + ".tmp", cleaned_path)
+    if chunks_path:
+        os.replace(chunks_path + ".tmp", chunks_path)
+    recipes_tmp = recipes_path + ".tmp"
+    with open(recipes_tmp, "w", encoding="utf-8") as f:
+        json.dump(recipes, f, ensure_ascii=False, indent=4)
+    os.replace(recipes_tmp, recipes_path)
+
+    new_index = state["index"].get(store_name)
+    if index and chunks_path:
+        current = {title: keys["chunks"] for title, keys in pages.items() if "chunks" in keys}
+        sys.path.insert(0, ROOT_DIR)
+        from src.manage_db import update_chunks, hnsw_configuration
+        if old_index is None:
+            print(f"No index state for {store_name}: rebuilding {store['persist_directory']} from scratch.")
+            stale = None
+        else:
+            stale = sorted({title for title in current if old_index.get(title) != current[title]}
+                           | (set(old_index) - set(current)))
+        update_chunks(
+            store["persist_directory"], index_chunks, stale,
+            embedding_model=store["embedding_model"], use_cuda=use_cuda,
+            collection_configuration=hnsw_configuration(
+                store.get("hnsw_m"), store.get("construction_ef"), store.get("search_ef"))
+        )
+        new_index = current
+
+    state = {"pages": pages, "recipes": recipes_h, "index": dict(state["index"])}
+    if new_index is not None:
+        state["index"][store_name] = new_index
+    save_state(state, state_path)
+    if gc:
+        cache.gc({key for keys in pages.values() for name, key in keys.items() if name != "raw"})
+    cache.close()
+    print(f"✅ Outputs updated, state saved to {state_path}")
+    return rebuilt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Рецепты, очищенный текст и чанки за один проход по дампу")
+    parser.add_argument("--input", default="data/data/wiki_dump.jsonl", help="Сырой дамп (JSON или JSONL)")
+    parser.add_argument("--cleaned_output", default="data/data/wiki_dump_cleaned.jsonl")
+    parser.add_argument("--recipes_output", default=clean_data.RECIPES_PATH)
+    parser.add_argument("--chunks_output", default="data/data/chunks_general.jsonl")
+    parser.add_argument("--no_chunks", action="store_true", help="Не резать на чанки (не нужен manage_db и torch)")
+    parser.add_argument("--manifest", default="docker/db_manifest.json", help="Откуда брать параметры разбиения")
+    parser.add_argument("--store", default="general", help="База из манифеста, для которой режутся чанки")
+    parser.add_argument("--batch_pages", type=int, default=64, help="Сколько страниц резать за один вызов split_texts")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Пересчитывать только страницы и этапы, у которых изменились входы (кэш этапов)")
+    parser.add_argument("--dry_run", action="store_true", help="Только показать, что будет пересобрано (с --incremental)")
+    parser.add_argument("--index", action="store_true",
+                        help="Переэмбеддить в базу только изменившиеся страницы (с --incremental)")
+    parser.add_argument("--state", default="data/data/pipeline_state.json", help="Состояние прошлого запуска")
+    parser.add_argument("--cache", default="data/data/stage_cache.jsonl", help="Кэш результатов этапов")
+    parser.add_argument("--gc", action="store_true", help="Убрать из кэша результаты, не нужные текущему состоянию")
+    parser.add_argument("--cpu", action="store_true", help="Эмбеддить на CPU (с --index)")
+    args = parser.parse_args()
+
+    if args.incremental or args.dry_run:
+        run_incremental(
+            input_path=args.input,
+            cleaned_path=args.cleaned_output,
+            recipes_path=args.recipes_output,
+            chunks_path=None if args.no_chunks else args.chunks_output,
+            manifest_path=args.manifest,
+            store_name=args.store,
+            state_path=args.state,
+            cache_path=args.cache,
+            dry_run=args.dry_run,
+            index=args.index,
+            use_cuda=not args.cpu,
+            batch_pages=args.batch_pages,
+            gc=args.gc
+        )
+        sys.exit(0)
+
+    run_pipeline(
+        input_path=args.input,
+        cleaned_path=args.cleaned_output,
+        recipes_path=args.recipes_output,
+        chunks_path=None if args.no_chunks else args.chunks_output,
+        manifest_path=args.manifest,
+        store_name=args.store,
+        batch_pages=args.batch_pages
+    )
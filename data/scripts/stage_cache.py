@@ -0,0 +1,189 @@
+"""
+stage_cache.py — кэш результатов этапов pipeline.py по хэшу их входов
+
+Ключ результата — sha1 от имени этапа, версии его кода, конфигурации и хэша входа (сырой
+страницы, очищенного текста, ...). Версия кода — хэш исходников функций, которые этап
+действительно выполняет: его точек входа и всего, что они используют из файлов STAGE_MODULES
+(функции, классы, константы, обработчики, зарегистрированные декоратором). Изменился обработчик
+шаблона в clean_data.py — поменялась версия этапа clean, а правка справки CLI, отчётов или
+build_all в manage_db.py версий не трогает. Чанки ключуются по очищенному тексту, поэтому
+страницы, чей текст не изменился, не режутся и не эмбеддятся заново.
+
+Результаты лежат в DumpStore (append-only JSONL с индексом): ключ записан в поле "title".
+Состояние прошлого запуска (какие ключи у каких страниц) — отдельный JSON, по нему считается дельта.
+"""
+
+import os
+import ast
+import json
+import hashlib
+
+from dump_store import DumpStore
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(SCRIPTS_DIR, "..", ".."))
+
+# файлы, по которым прослеживаются зависимости этапов (импорты между ними разрешаются по имени модуля)
+STAGE_MODULES = [
+    "data/scripts/pipeline.py",
+    "data/scripts/get_recipes.py",
+    "data/scripts/clean_data.py",
+    "data/scripts/wikitext.py",
+    "data/scripts/template_engine.py",
+    "src/manage_db.py",
+]
+
+# точки входа этапов: (файл, имя верхнего уровня)
+STAGE_ENTRY_POINTS = {
+    "recipes": [("data/scripts/pipeline.py", "recipes_from_raw")],
+    "clean": [("data/scripts/clean_data.py", "prepare_content"),
+              ("data/scripts/clean_data.py", "parse_content"),
+              ("data/scripts/clean_data.py", "render_content"),
+              ("data/scripts/clean_data.py", "set_recipes")],
+    "chunks": [("src/manage_db.py", "split_texts")],
+}
+
+
+def text_hash(*parts) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def json_hash(value) -> str:
+    return text_hash(json.dumps(value, ensure_ascii=False, sort_keys=True))
+
+
+def parse_module(path: str) -> tuple:
+    """
+    Разбирает файл (без импорта — manage_db тянет torch) и возвращает:
+    исходник, {имя верхнего уровня: [узлы определений]}, {псевдоним: файл модуля},
+    {имя из from-импорта: (файл модуля, имя)}. Функция с декоратором вроде @engine.register(...)
+    нигде не вызывается по имени, поэтому она считается частью определения engine.
+    """
+    modules = {os.path.splitext(os.path.basename(p))[0]: p for p in STAGE_MODULES}
+    with open(os.path.join(ROOT_DIR, path), "r", encoding="utf-8") as f:
+        source = f.read()
+    definitions, aliases, imported = {}, {}, {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                module = alias.name.rsplit(".", 1)[-1]
+                if module in modules:
+                    aliases[alias.asname or alias.name] = modules[module]
+            continue
+        if isinstance(node, ast.ImportFrom):
+            module = (node.module or "").rsplit(".", 1)[-1]
+            if module in modules:
+                for alias in node.names:
+                    imported[alias.asname or alias.name] = (modules[module], alias.name)
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names = [node.name]
+            for decorator in node.decorator_list:
+                names += [n.id for n in ast.walk(decorator) if isinstance(n, ast.Name)]
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names = [n.id for target in targets for n in ast.walk(target) if isinstance(n, ast.Name)]
+        else:
+            continue
+        for name in names:
+            definitions.setdefault(name, []).append(node)
+    return source, definitions, aliases, imported
+
+
+def stage_sources(stage: str) -> dict:
+    """{(файл, имя): исходник} — всё, от чего зависит результат этапа."""
+    modules = {}
+    sources = {}
+    todo = list(STAGE_ENTRY_POINTS[stage])
+    seen = set()
+    while todo:
+        path, name = todo.pop()
+        if (path, name) in seen:
+            continue
+        seen.add((path, name))
+        if path not in modules:
+            modules[path] = parse_module(path)
+        source, definitions, aliases, imported = modules[path]
+        if name not in definitions:
+            if name in imported:
+                todo.append(imported[name])
+            continue
+        segments = []
+        for node in definitions[name]:
+            # вместе с декораторами: @engine.register("имя") — часть обработчика
+            start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+            segments.append("\n".join(source.splitlines()[start - 1:node.end_lineno]))
+            for sub in ast.walk(node):
+                if isinstance(sub, ast.Name):
+                    todo.append((path, sub.id))
+                elif isinstance(sub, ast.Attribute) and isinstance(sub.value, ast.Name) and sub.value.id in aliases:
+                    todo.append((aliases[sub.value.id], sub.attr))
+        sources[(path, name)] = "\n".join(segments)
+    return sources
+
+
+def code_version(stage: str) -> str:
+    h = hashlib.sha1()
+    for (path, name), source in sorted(stage_sources(stage).items()):
+        h.update(f"{path}:{name}\0{source}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_state(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"pages": {}, "recipes": None, "index": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state: dict, path: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class StageCache:
+
+    def __init__(self, path: str, config: dict = None):
+        self.path = path
+        self.store = DumpStore(path, fsync_every=1000)
+        self.config = config or {}
+        self.versions = {stage: code_version(stage) for stage in STAGE_ENTRY_POINTS}
+
+    def key(self, stage: str, *inputs) -> str:
+        return text_hash(stage, self.versions[stage], json_hash(self.config.get(stage)), *inputs)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.store
+
+    def get(self, key: str):
+        entry = self.store.get(key)
+        return None if entry is None else entry["value"]
+
+    def put(self, key: str, value):
+        if key not in self.store:
+            self.store.append({"title": key, "value": value})
+
+    def gc(self, keep: set):
+        """Оставляет в кэше только ключи из keep (обычно — из текущего состояния)."""
+        tmp_path = self.path + ".gc"
+        for leftover in (tmp_path, tmp_path + ".idx"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        with DumpStore(tmp_path, fsync_every=10**9) as kept:
+            for key in keep:
+                entry = self.store.get(key)
+                if entry is not None:
+                    kept.append(entry)
+        self.store.close()
+        os.replace(tmp_path, self.path)
+        os.replace(tmp_path + ".idx", self.path + ".idx")
+        self.store = DumpStore(self.path, fsync_every=1000)
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,80 @@
+"""
+template_engine.py — раскрытие шаблонов {{...}} для clean_data.py
+
+Обработчики регистрируются по имени шаблона (без учёта регистра) и получают список аргументов.
+Результат запоминается по (имя, аргументы): одни и те же {{item|...}} и {{recipes|...}}
+встречаются на сотнях страниц. Для каждого шаблона считаются вызовы, попадания в кэш
+и время раскрытия — report() показывает, какие шаблоны съедают время очистки.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TemplateEngine:
+
+    def __init__(self, cache_size: int = 200_000):
+        self.handlers = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.stats = {}  # имя -> [вызовы, попадания в кэш, секунды]
+
+    def register(self, *names: str, cache: bool = True):
+        """Декоратор: handler(args) -> str для шаблонов с указанными именами."""
+        def decorator(handler):
+            for name in names:
+                self.handlers[name.lower()] = (handler, cache)
+            return handler
+        return decorator
+
+    def expand(self, name: str, args: list) -> str:
+        """Раскрывает шаблон. Для незарегистрированных имён — пустая строка."""
+        name_l = name.lower()
+        stats = self.stats.get(name_l)
+        if stats is None:
+            stats = self.stats[name_l] = [0, 0, 0.0]
+        stats[0] += 1
+
+        handler, cache = self.handlers.get(name_l, (None, False))
+        if handler is None:
+            return ""
+        if not cache:
+            start = time.perf_counter()
+            result = handler(args)
+            stats[2] += time.perf_counter() - start
+            return result
+
+        key = (name_l, tuple(args))
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            stats[1] += 1
+            return result
+
+        start = time.perf_counter()
+        result = handler(args)
+        stats[2] += time.perf_counter() - start
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def reset_stats(self):
+        self.stats = {}
+
+    def report(self, top: int = 20) -> list:
+        """Печатает самые дорогие шаблоны и возвращает строки отчёта."""
+        rows = sorted(
+            ({"template": name, "calls": calls, "hits": hits, "seconds": seconds}
+             for name, (calls, hits, seconds) in self.stats.items()),
+            key=lambda row: row["seconds"], reverse=True
+        )
+        print(f"{'template':<30} {'calls':>8} {'hits':>8} {'hit %':>6} {'total ms':>10}")
+        for row in rows[:top]:
+            hit_rate = 100 * row["hits"] / row["calls"] if row["calls"] else 0
+            print(f"{row['template'][:30]:<30} {row['calls']:>8} {row['hits']:>8} "
+                  f"{hit_rate:>6.1f} {row['seconds'] * 1000:>10.1f}")
+        return rows
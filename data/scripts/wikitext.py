@@ -0,0 +1,383 @@
+"""
+wikitext.py — однопроходный разбор вики-разметки для clean_data.py
+
+parse() один раз проходит по тексту и строит дерево:
+    str       — обычный текст
+    Link      — [[цель|подпись]], сразу сведённая к подписи
+    Template  — {{...}} с вложенными узлами
+    Table     — отметка таблицы {| ... |} верхнего уровня с её исходником
+Тройные скобки {{{...}}} выбрасываются ещё при разборе. Таблицы конвертируются прямо
+при разборе (convert_table), и их текст разбирается на шаблоны вместе с окружающим:
+многострочный шаблон в ячейке может оставить {{ открытыми и после таблицы.
+
+render() обходит дерево один раз. Шаблоны раскрываются «снаружи внутрь», как это делал
+цикл process_templates: обработчик получает аргументы с нераскрытыми вложенными шаблонами,
+а его результат разбирается заново — но только он сам, а не вся страница. Если результат
+обработчика несбалансирован по скобкам и может склеиться с соседним текстом, он возвращается
+нераскрытым, и вызывающий код доводит его старым process_templates. Так же после незакрытых {{
+битого шаблона: они могут замкнуться на результат обработчика.
+
+Разбор повторяет поведение старых регулярок (replace_wikilinks, remove_triple_braces,
+find_table_spans, process_templates), включая их реакцию на битую разметку:
+шаблон с одиночной { или } внутри не раскрывается, незакрытая таблица остаётся текстом,
+незакрытые {{{ вырезают всё до конца страницы.
+Теги и комментарии здесь не трогаются — clean_data удаляет их после раскрытия шаблонов.
+"""
+
+import re
+import regex
+
+# те же паттерны, что и в clean_data.replace_wikilinks
+LINK_PATTERN = regex.compile(r"\[\[([^\[\]]*(?:\[\[.*?\]\][^\[\]]*)*)\]\]")
+LINK_SPLIT = regex.compile(r'\|(?![^\[]*\])')
+
+_TRIPLE = re.compile(r"\{\{\{|\}\}\}")
+_SPECIAL = re.compile(r"[{}]")
+_SPECIAL_TABLES = re.compile(r"[{}\[\]|]")
+_MARKUP_CHARS = frozenset("{}[]|")
+
+
+class Link:
+    __slots__ = ("target", "label")
+
+    def __init__(self, target: str, label: str):
+        self.target = target
+        self.label = label
+
+    def __repr__(self):
+        return f"Link({self.target!r}, {self.label!r})"
+
+
+class Template:
+    __slots__ = ("children",)
+
+    def __init__(self):
+        self.children = []
+
+    def source(self) -> str:
+        """Текст между {{ и }} — с уже сведёнными ссылками, но нераскрытыми вложенными шаблонами."""
+        return "".join(_source(child) for child in self.children)
+
+    def __repr__(self):
+        return f"Template({self.source()!r})"
+
+
+class Table:
+    __slots__ = ("source",)
+
+    def __init__(self, source: str):
+        self.source = source
+
+    def __repr__(self):
+        return f"Table({self.source[:40]!r}...)"
+
+
+def _source(node) -> str:
+    if isinstance(node, str):
+        return node
+    if isinstance(node, Link):
+        return node.label
+    if isinstance(node, Template):
+        return "{{" + node.source() + "}}"
+    return ""  # Table — отметка, её текст уже идёт следом
+
+
+# ---------------------------------------------
+# Лексер: ссылки и тройные скобки
+# ---------------------------------------------
+def _resolve_links(text: str) -> list:
+    """Один проход replace_wikilinks: сводит [[...]] к подписи. Возвращает куски текста и Link."""
+    pieces = []
+    buf = []
+    i = 0
+    while True:
+        j = text.find("[[", i)
+        if j == -1:
+            buf.append(text[i:])
+            break
+        buf.append(text[i:j])
+        link = LINK_PATTERN.match(text, j)
+        if link is None:
+            buf.append("[")
+            i = j + 1
+            continue
+        # берём последнюю часть после верхнеуровневого |
+        parts = LINK_SPLIT.split(link.group(1).strip())
+        label = parts[-1].strip()
+        if label and _MARKUP_CHARS.isdisjoint(label):
+            if buf:
+                pieces.append("".join(buf))
+                buf = []
+            pieces.append(Link(parts[0].strip(), label))
+        else:
+            # подпись с разметкой (или пустая, склеивающая соседей) остаётся текстом:
+            # вложенные ссылки в ней сведёт следующий проход, шаблоны — парсер
+            buf.append(label)
+        i = link.end()
+
+    if buf:
+        pieces.append("".join(buf))
+    return pieces
+
+
+def _remove_triple_braces(pieces: list) -> list:
+    """Выбрасывает {{{...}}} (с вложенными) — после сведения ссылок, как в старом порядке шагов."""
+    out = []
+    depth = 0
+    for piece in pieces:
+        if isinstance(piece, Link):
+            if depth == 0:
+                out.append(piece)
+            continue
+        if depth == 0 and "{{{" not in piece:
+            _append_text(out, piece)
+            continue
+        kept = []
+        i = 0
+        while True:
+            m = _TRIPLE.search(piece, i)
+            if m is None:
+                if depth == 0:
+                    kept.append(piece[i:])
+                break
+            if depth == 0:
+                if m.group() == "{{{":
+                    kept.append(piece[i:m.start()])
+                    depth = 1
+                else:
+                    kept.append(piece[i:m.end()])
+            else:
+                depth += 1 if m.group() == "{{{" else -1
+            i = m.end()
+        _append_text(out, "".join(kept))
+    return out
+
+
+def _append_text(out: list, text: str):
+    # ссылка, вырезанная вместе с {{{...}}}, склеивает соседний текст, как в строке у remove_triple_braces:
+    # "{|" + "|}" или "{" + "{" на стыке должны разбираться как одна разметка
+    if out and isinstance(out[-1], str):
+        out[-1] += text
+    else:
+        out.append(text)
+
+
+def _lex(text: str) -> list:
+    pieces = _resolve_links(text)
+    # replace_wikilinks повторял проход до неподвижной точки. Следующий проход нужен,
+    # только если осталась [[ и из неё складывается ссылка — на обычных страницах это подписи с вложенными ссылками
+    while any(isinstance(p, str) and "[[" in p for p in pieces):
+        joined = "".join(_source(p) for p in pieces)
+        if LINK_PATTERN.search(joined) is None:
+            break
+        pieces = _resolve_links(joined)
+    return _remove_triple_braces(pieces)
+
+
+# ---------------------------------------------
+# Парсер: шаблоны и таблицы
+# ---------------------------------------------
+def _build(pieces: list, convert_table=None) -> list:
+    root = []
+    frames = []   # открытые шаблоны
+    buf = []
+
+    def add(node):
+        (frames[-1].children if frames else root).append(node)
+
+    def flush():
+        if buf:
+            add("".join(buf))
+            buf.clear()
+
+    def fail_frames():
+        # шаблон с одиночной скобкой внутри не раскрывается — ни он, ни объемлющие;
+        # уже закрытые вложенные шаблоны остаются шаблонами
+        flush()
+        for frame in frames:
+            root.append("{{")
+            root.extend(frame.children)
+        frames.clear()
+
+    def feed(text):
+        # шаблоны как в process_templates: {{ ... }} без одиночных { и } внутри
+        i, n = 0, len(text)
+        while i < n:
+            m = _SPECIAL.search(text, i)
+            if m is None:
+                buf.append(text[i:])
+                break
+            j = m.start()
+            if j > i:
+                buf.append(text[i:j])
+            two = text[j:j + 2]
+            if two == "{{":
+                flush()
+                frames.append(Template())
+                i = j + 2
+            elif two == "}}" and frames:
+                flush()
+                node = frames.pop()
+                add(node)
+                i = j + 2
+            elif two == "}}":
+                buf.append(two)
+                i = j + 2
+            else:
+                if frames:
+                    fail_frames()
+                buf.append(text[j])
+                i = j + 1
+
+    stream = []   # текст для поиска шаблонов: исходник вне таблиц и уже сконвертированные таблицы
+    table = None  # куски исходника текущей таблицы
+
+    def feed_stream():
+        if stream:
+            feed("".join(stream))
+            stream.clear()
+
+    def emit_table(source):
+        converted = convert_table(source)
+        # ячейки многострочных шаблонов могут оставить {{ незакрытыми после таблицы —
+        # поэтому результат идёт в общий поток, а Table остаётся отметкой с исходником
+        if not converted:
+            return
+        if stream and stream[-1][-1:] in ("{", "}") or converted[:1] in ("{", "}"):
+            # отметку нельзя вставить, не разрезав возможные {{ или }} на стыке
+            stream.append(converted)
+            return
+        feed_stream()
+        flush()
+        add(Table(source))
+        stream.append(converted)
+
+    # счётчики вложенности как в find_table_spans: таблица начинается только вне {{ }} и [[ ]]
+    depth_curly = depth_brack = depth_table = 0
+
+    for piece in pieces:
+        if isinstance(piece, Link):
+            if table is not None:
+                table.append(piece.label)
+            else:
+                feed_stream()
+                flush()
+                add(piece)
+            continue
+        if convert_table is None:
+            stream.append(piece)
+            continue
+
+        out = stream if table is None else table
+        i, n = 0, len(piece)
+        while i < n:
+            m = _SPECIAL_TABLES.search(piece, i)
+            if m is None:
+                out.append(piece[i:])
+                break
+            j = m.start()
+            if j > i:
+                out.append(piece[i:j])
+            two = piece[j:j + 2]
+
+            if two == "{{":
+                depth_curly += 1
+            elif two == "}}":
+                if depth_curly > 0:
+                    depth_curly -= 1
+            elif two == "[[":
+                depth_brack += 1
+            elif two == "]]":
+                if depth_brack > 0:
+                    depth_brack -= 1
+            elif two == "{|" and depth_curly == 0 and depth_brack == 0:
+                if depth_table == 0:
+                    table = out = []
+                depth_table += 1
+            elif two == "|}" and depth_curly == 0 and depth_brack == 0 and depth_table > 0:
+                depth_table -= 1
+                if depth_table == 0:
+                    table.append(two)
+                    emit_table("".join(table))
+                    table = None
+                    out = stream
+                    i = j + 2
+                    continue
+            else:
+                out.append(piece[j])
+                i = j + 1
+                continue
+            out.append(two)
+            i = j + 2
+
+    if table is not None:
+        # незакрытая таблица не конвертируется
+        stream.extend(table)
+    feed_stream()
+    flush()
+    if frames:
+        fail_frames()
+    return root
+
+
+def parse(text: str, convert_table=None) -> list:
+    """
+    Разбирает сырую вики-разметку в список узлов.
+    Если передан convert_table(source), таблицы конвертируются прямо при разборе.
+    """
+    return _build(_lex(text), convert_table)
+
+
+def parse_expanded(text: str) -> list:
+    """
+    Разбор уже обработанного текста (результат шаблона):
+    ссылки и таблицы к этому моменту уже обработаны, ищутся только шаблоны.
+    """
+    if "{{" not in text:
+        return [text]
+    return _build([text])
+
+
+def render(nodes: list, expand_template) -> str:
+    """
+    Собирает текст из дерева.
+    expand_template(source) получает текст между {{ и }} и возвращает замену.
+    """
+    out = []
+    # перед узлом остались незакрытые {{ (битый шаблон): process_templates начал бы следующий проход
+    # с них и мог бы захватить результат обработчика целиком, ещё нераскрытым
+    opened = False
+    for node in nodes:
+        if isinstance(node, str):
+            piece = node
+        elif isinstance(node, Link):
+            piece = node.label
+        elif isinstance(node, Template):
+            piece = expand_template(node.source())
+            if not opened and ("{" in piece or "}" in piece):
+                rendered = render(parse_expanded(piece), expand_template)
+                if _is_closed(rendered):
+                    piece = rendered
+                # иначе результат может сложиться в шаблон с соседним текстом —
+                # оставляем как есть, его раскроет process_templates в clean_data
+        else:
+            continue
+        if not opened and ("{{" in piece or out and out[-1][-1:] == "{" and piece[:1] == "{"):
+            opened = True
+        out.append(piece)
+    return "".join(out)
+
+
+def _is_closed(text: str) -> bool:
+    """Текст не может образовать {{ или }} с соседями."""
+    return ("{{" not in text and "}}" not in text
+            and text[:1] not in ("{", "}") and text[-1:] not in ("{", "}"))
+
+
+def iter_nodes(nodes: list, node_type=None):
+    """Обходит дерево в глубину (внутрь шаблонов), по желанию только узлы одного типа."""
+    for node in nodes:
+        if node_type is None or isinstance(node, node_type):
+            yield node
+        if isinstance(node, Template):
+            yield from iter_nodes(node.children, node_type)
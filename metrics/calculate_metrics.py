@@ -1,7 +1,11 @@
 import os
 import json
+import random
 import logging
+import argparse
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from mistralai import Mistral
 import sys
@@ -16,56 +20,75 @@ sys.path.insert(0, SRC_DIR)
 
 from src.main import setup_terraria_rag
 from src.agent import MistralLLM
+from src.tracing import Trace
+from results_log import DEFAULT_LOG_PATH, DEFAULT_RUN_ID, LEGACY_RUN_ID, ResultsLog, export_json
+from eval_cache import DEFAULT_CACHE_PATH, EvalCache, baseline_key, verdict_key, clear_cache
+
+BASELINE_SYSTEM_PROMPT = "Ты эксперт по игре Terraria. Ответь на вопрос: "
 
 
 #############################################
-# 0 — Retry Helpers
+# 0 — Лимиты провайдеров и повторы
 #############################################
 
-def safe_eval_call(client, q, gt, my_answer, baseline_answer):
-    """
-    Делает повторные запросы к API, пока не получим успешный ответ.
-    """
-    while True:
-        try:
-            return evaluate_answer(client, q, gt, my_answer, baseline_answer)
-        except Exception as e:
-            logger.warning(f"Baseline error: {e}, retrying in 30s...")
-            time.sleep(30)
-
-
-def safe_run_rag(rag, question):
+class ProviderLimit:
     """
-    Делает повторные запросы к API, пока не получим успешный ответ.
+    Ограничение на одного провайдера: не больше concurrency одновременных
+    запросов и не чаще rps запросов в секунду (rps=0 — без ограничения скорости).
+    RAG ходит в локальную Ollama, baseline и оценщик — в Mistral API.
     """
-    while True:
-        try:
-            return rag.run(question)
-        except Exception as e:
-            logger.warning(f"RAG error: {e}, retrying in 30s...")
-            time.sleep(30)
-
 
-def safe_baseline_answer(baseline, question):
+    def __init__(self, name: str, concurrency: int = 1, rps: float = 0.0):
+        self.name = name
+        self.semaphore = threading.BoundedSemaphore(max(concurrency, 1))
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def _wait_slot(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        self._wait_slot()
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+        return False
+
+
+def call_with_retry(func, limit: ProviderLimit, what: str,
+                    max_retries: int = 5, base_delay: float = 2.0, max_delay: float = 60.0):
     """
-    Делает повторные запросы к API, пока не получим успешный ответ.
+    Вызывает func под лимитом провайдера. При ошибке повторяет с экспоненциальной
+    задержкой (base_delay * 2^попытка, не больше max_delay, со случайным разбросом),
+    после max_retries повторов пробрасывает последнюю ошибку.
     """
-    while True:
+    for attempt in range(max_retries + 1):
         try:
-            return baseline.call(system_prompt="Ты эксперт по игре Terraria. Ответь на вопрос: ", user_prompt=question)
+            with limit:
+                return func()
         except Exception as e:
-            logger.warning(f"Baseline error: {e}, retrying in 30s...")
-            time.sleep(30)
+            if attempt == max_retries:
+                logger.error(f"{what}: {e}, попытки исчерпаны ({max_retries + 1})")
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.warning(f"{what}: {e}, повтор {attempt + 1}/{max_retries} через {delay:.1f}s...")
+            time.sleep(delay)
 
 
 #############################################
 # 1 — Оценщик (большая LLM-модель)
 #############################################
-def evaluate_answer(eval_client, question, groundtruth, my_answer, baseline_answer):
-    """
-    Оценивает ответы модели и baseline с помощью LLM, используя метод .call().
-    """
-    system_prompt = """
+EVALUATOR_SYSTEM_PROMPT = """
 Ты — строгий оценщик ответов на вопросы по Terraria.
 Сравни два ответа на один вопрос с точки зрения качества и соответствия groundtruth.
 Сильно наказывай ложь со стороны модели.
@@ -85,6 +108,11 @@ def evaluate_answer(eval_client, question, groundtruth, my_answer, baseline_answ
 }
 """
 
+
+def evaluate_answer(eval_client, question, groundtruth, my_answer, baseline_answer):
+    """
+    Оценивает ответы модели и baseline с помощью LLM, используя метод .call().
+    """
     user_prompt = f"""
 Question: {question}
 
@@ -99,7 +127,7 @@ Groundtruth:
 """
 
     # Вызов LLM через .call()
-    response = eval_client.call(system_prompt=system_prompt, user_prompt=user_prompt)
+    response = eval_client.call(system_prompt=EVALUATOR_SYSTEM_PROMPT, user_prompt=user_prompt)
 
     text = response  # call() возвращает текст напрямую
 
@@ -117,12 +145,148 @@ Groundtruth:
 # 2 — Основной цикл
 #############################################
 
-def calculate_metrics():
+def run_rag(terraria_rag, question):
+    """
+    Ответ RAG и сводка его трассы: длительности шагов, токены и время LLM
+    по шагам и агентам (prompt_eval_count, eval_count, prefill/decode/load).
+    """
+    trace = Trace()
+    answer = terraria_rag.run(question, trace=trace)
+    return answer, trace.summary()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, round(time.perf_counter() - start, 4)
+
+
+def ask_baseline(baseline, question, limit, max_retries=5, cache=None):
+    """
+    Ответ baseline: (ответ, секунды, из_кэша). Ключ кэша — модель, температура,
+    системный промпт и вопрос; при попадании запрос в Mistral не отправляется.
+    """
+    key = baseline_key(baseline.model_name, baseline.temperature, BASELINE_SYSTEM_PROMPT, question)
+    cached = cache.get("baseline", key) if cache else None
+    if cached is not None:
+        return cached["answer"], cached["latency_s"], True
+    answer, seconds = call_with_retry(
+        lambda: timed(lambda: baseline.call(system_prompt=BASELINE_SYSTEM_PROMPT, user_prompt=question)),
+        limit, "Baseline error", max_retries,
+    )
+    if cache:
+        cache.put("baseline", key, {"answer": answer, "latency_s": seconds},
+                  model=baseline.model_name, question=question)
+    return answer, seconds, False
+
+
+def judge(eval_client, item, my_answer, baseline_answer, limit, max_retries=5, cache=None):
+    """
+    Вердикт оценщика: (оценки, из_кэша). Ключ кэша — хэш модели, промпта оценщика,
+    вопроса, groundtruth и обоих ответов, так что заново оцениваются только изменившиеся пары.
+    """
+    q, groundtruth = item["question"], item["groundtruth"]
+    key = verdict_key(eval_client.model_name, EVALUATOR_SYSTEM_PROMPT, q, groundtruth, my_answer, baseline_answer)
+    cached = cache.get("verdict", key) if cache else None
+    if cached is not None:
+        return cached, True
+    eval_result = call_with_retry(
+        lambda: evaluate_answer(eval_client, q, groundtruth, my_answer, baseline_answer),
+        limit, "Evaluation error", max_retries,
+    )
+    if cache:
+        cache.put("verdict", key, eval_result, model=eval_client.model_name, question=q)
+    return eval_result, False
+
+
+def answer_question(item, terraria_rag, baseline, eval_client, limits, answers_pool, max_retries=5, cache=None):
+    """
+    Обрабатывает один вопрос: ответ baseline запрашивается в answers_pool
+    параллельно с ответом RAG, затем оба ответа уходят оценщику.
+    Ответы baseline и вердикты берутся из cache, если он передан.
+    """
+    q = item["question"]
+    baseline_future = answers_pool.submit(ask_baseline, baseline, q, limits["mistral"], max_retries, cache)
+    try:
+        my_answer, rag_trace = call_with_retry(lambda: run_rag(terraria_rag, q), limits["ollama"], "RAG error", max_retries)
+    finally:
+        # ответ baseline дожидаемся в любом случае, чтобы не оставлять висящих запросов
+        baseline_answer, baseline_seconds, baseline_cached = baseline_future.result()
+
+    eval_result, eval_cached = judge(eval_client, item, my_answer, baseline_answer,
+                                     limits["mistral"], max_retries, cache)
+
+    return {
+        "question": q,
+        "theme": item.get("theme", ""),
+        "groundtruth": item["groundtruth"],
+        "complexity": item["complexity"],
+        "my_model_answer": my_answer,
+        "baseline_answer": baseline_answer,
+        "evaluation": eval_result,
+        "rag_trace": rag_trace,
+        "baseline_latency_s": baseline_seconds,
+        "baseline_cached": baseline_cached,
+        "evaluation_cached": eval_cached,
+    }
+
+
+def calculate_metrics(workers: int = 4,
+                      ollama_concurrency: int = 2,
+                      ollama_rps: float = 0.0,
+                      mistral_concurrency: int = 4,
+                      mistral_rps: float = 1.0,
+                      max_retries: int = 5,
+                      questions_path: str = "metrics/benchmark_questions.json",
+                      log_path: str = DEFAULT_LOG_PATH,
+                      run_id: str = DEFAULT_RUN_ID,
+                      export_path: str = "metrics/out/model_evaluation.json",
+                      cache_path: str = DEFAULT_CACHE_PATH,
+                      refresh=(),
+                      legacy_path: str = ""):
+    """
+    Считает метрики по бенчмарку. Вопросы обрабатываются параллельно в workers потоках,
+    запросы к Ollama и к Mistral API ограничиваются отдельно. Каждый результат дописывается
+    в журнал log_path с ключом (run_id, хэш вопроса), поэтому прерванный запуск продолжается
+    с того же места; вопросы, на которых исчерпаны повторы, не записываются и будут
+    пересчитаны в следующий раз. В конце результаты запуска выгружаются в export_path.
+
+    Ответы baseline и вердикты оценщика кэшируются в cache_path между запусками
+    (cache_path='' — без кэша); виды из refresh ("baseline", "verdict") запрашиваются заново.
+    legacy_path — старый model_evaluation.json, который сначала переносится в журнал как запуск LEGACY_RUN_ID.
+    """
     logging.basicConfig(level=logging.INFO)
     logger.info("Загружаем бенчмарк...")
-    with open("metrics/benchmark_questions.json", "r", encoding="utf-8") as f:
+    with open(questions_path, "r", encoding="utf-8") as f:
         questions = json.load(f)
 
+    if legacy_path:
+        import_legacy_results(log_path, legacy_path)
+
+    with ResultsLog(log_path, run_id) as results:
+        # Пропускаем уже обработанные в этом запуске вопросы
+        pending = [item for item in questions if item["question"] not in results]
+        logger.info(f"Запуск '{run_id}': пропускаем {len(questions) - len(pending)} уже обработанных вопросов, "
+                    f"осталось {len(pending)}")
+        if pending:
+            cache = EvalCache(cache_path, refresh) if cache_path else None
+            try:
+                run_questions(pending, results, workers, ollama_concurrency, ollama_rps,
+                              mistral_concurrency, mistral_rps, max_retries, cache)
+            finally:
+                if cache:
+                    logger.info(f"Кэш оценки: {cache.stats()}")
+                    cache.close()
+
+    if export_path:
+        count = export_json(log_path, export_path, run_id)
+        logger.info(f"Все метрики вычислены! {count} результатов выгружено в {export_path}")
+    else:
+        logger.info(f"Все метрики вычислены! Журнал результатов: {log_path}")
+
+
+def run_questions(pending, results, workers, ollama_concurrency, ollama_rps,
+                  mistral_concurrency, mistral_rps, max_retries, cache=None):
     logger.info("Инициализация TerrariaRAG...")
     terraria_rag = setup_terraria_rag()
 
@@ -142,95 +306,101 @@ def calculate_metrics():
         model_name="ministral-8b-2410",
     )
 
-    # Загружаем предыдущие результаты, если они есть
-    results = load_existing_results()
-
-    # Получаем список уже обработанных вопросов
-    processed_questions = {r["question"] for r in results}
-
-    for i, item in enumerate(questions):
-        q = item["question"]
-        theme = item.get("theme", "")
-        gt = item["groundtruth"]
-        complexity = item["complexity"]
-
-        # Пропускаем уже обработанные вопросы
-        if q in processed_questions:
-            logger.info(f"Пропускаем уже обработанный вопрос: {q}")
-            continue
-
-        logger.info(f"Обработка ({i+1}/{len(questions)}): {q}")
-
-        try:
-            my_answer = safe_run_rag(terraria_rag, q)
-        except Exception as e:
-            logger.error(f"My model error: {e}")
-            my_answer = ""
-
-        try:
-            baseline_answer = safe_baseline_answer(baseline, q)
-        except Exception as e:
-            logger.error(f"Baseline error: {e}")
-            baseline_answer = ""
-
-        try:
-            eval_result = safe_eval_call(
-                eval_client, q, gt, my_answer, baseline_answer
-            )
-        except Exception as e:
-            logger.error(f"Evaluation error: {e}")
-            eval_result = {
-                "rag_score": 0,
-                "baseline_score": 0
-            }
-
-        new_result = {
-            "question": q,
-            "theme": theme,
-            "groundtruth": gt,
-            "complexity": complexity,
-            "my_model_answer": my_answer,
-            "baseline_answer": baseline_answer,
-            "evaluation": eval_result
+    limits = {
+        "ollama": ProviderLimit("ollama", ollama_concurrency, ollama_rps),
+        "mistral": ProviderLimit("mistral", mistral_concurrency, mistral_rps),
+    }
+    failed = []
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as answers_pool, \
+            ThreadPoolExecutor(max_workers=workers) as questions_pool:
+        futures = {
+            questions_pool.submit(
+                answer_question, item, terraria_rag, baseline, eval_client, limits, answers_pool, max_retries, cache
+            ): item
+            for item in pending
         }
-        results.append(new_result)
-
-        save_results(results)
-        logger.info(f"Сохранен результат для вопроса {i+1}/{len(questions)}")
-
-    logger.info("Все метрики вычислены! Финальный результат в metrics/out/model_evaluation.json")
-
-def load_existing_results():
-    """Загружает существующие результаты если они есть"""
-    os.makedirs("metrics/out", exist_ok=True)
-    results_file = "metrics/out/model_evaluation.json"
+        for done, future in enumerate(as_completed(futures), start=1):
+            q = futures[future]["question"]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Вопрос не обработан ({done}/{len(pending)}): {q}: {e}")
+                failed.append(q)
+                continue
+            logger.info(f"Сохранен результат ({done}/{len(pending)}, {time.perf_counter() - start:.0f}s): {q}")
 
-    if os.path.exists(results_file):
-        try:
-            with open(results_file, "r", encoding="utf-8") as f:
-                results = json.load(f)
-            logger.info(f"Загружено {len(results)} предыдущих результатов")
-            return results
-        except Exception as e:
-            logger.warning(f"Не удалось загрузить предыдущие результаты: {e}")
+    if failed:
+        logger.warning(f"Не удалось обработать {len(failed)} вопросов, они будут пересчитаны при следующем запуске")
 
-    return []
-
-def save_results(results):
-    """Сохраняет результаты в файл"""
-    os.makedirs("metrics/out", exist_ok=True)
-    results_file = "metrics/out/model_evaluation.json"
 
+def import_legacy_results(log_path: str, json_path: str):
+    """
+    Переносит результаты из старого model_evaluation.json в журнал — только по явному --import_legacy:
+    тот же файл по умолчанию перезаписывается выгрузкой, и без журнала он подхватился бы повторно.
+    Они всегда попадают в отдельный запуск LEGACY_RUN_ID, а не в запрошенный: иначе новый
+    --run_id получил бы готовые старые ответы вместо свежего прогона. Уже перенесённые вопросы пропускаются.
+    """
     try:
-        temp_file = results_file + ".tmp"
-        with open(temp_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
-
-        os.replace(temp_file, results_file)
-        logger.debug(f"Результаты сохранены ({len(results)} записей)")
-
+        with open(json_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
     except Exception as e:
-        logger.error(f"Ошибка сохранения результатов: {e}")
+        logger.warning(f"Не удалось загрузить предыдущие результаты: {e}")
+        return
+    imported = 0
+    with ResultsLog(log_path, LEGACY_RUN_ID) as results:
+        for result in legacy:
+            if result["question"] not in results:
+                results.append(result)
+                imported += 1
+    logger.info(f"Перенесено {imported} из {len(legacy)} предыдущих результатов из {json_path} в {log_path} "
+                f"(запуск '{LEGACY_RUN_ID}')")
 
 if __name__ == "__main__":
-    calculate_metrics()
+    parser = argparse.ArgumentParser(description="Evaluate TerrariaRAG against a baseline model on the benchmark questions.")
+    parser.add_argument("--questions", type=str, default="metrics/benchmark_questions.json", help="Benchmark questions.")
+    parser.add_argument("--workers", type=int, default=4, help="Questions processed in parallel.")
+    parser.add_argument("--ollama_concurrency", type=int, default=2, help="Concurrent TerrariaRAG runs against Ollama.")
+    parser.add_argument("--ollama_rps", type=float, default=0.0, help="TerrariaRAG runs per second (0 = unlimited).")
+    parser.add_argument("--mistral_concurrency", type=int, default=4, help="Concurrent Mistral API requests.")
+    parser.add_argument("--mistral_rps", type=float, default=1.0, help="Mistral API requests per second (0 = unlimited).")
+    parser.add_argument("--max_retries", type=int, default=5, help="Retries per call with exponential backoff.")
+    parser.add_argument("--log", type=str, default=DEFAULT_LOG_PATH, help="Append-only JSONL results log.")
+    parser.add_argument("--run_id", type=str, default=DEFAULT_RUN_ID, help="Run to resume or start in the log.")
+    parser.add_argument("--export_json", type=str, default="metrics/out/model_evaluation.json",
+                        help="Export the run as a JSON array here ('' to skip).")
+    parser.add_argument("--import_legacy", type=str, default="",
+                        help=f"Import a pre-log model_evaluation.json into the log as run '{LEGACY_RUN_ID}'.")
+    parser.add_argument("--cache", type=str, default=DEFAULT_CACHE_PATH,
+                        help="Persistent cache of baseline answers and evaluator verdicts.")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the cache.")
+    parser.add_argument("--refresh_baseline", action="store_true",
+                        help="Ignore cached baseline answers and overwrite them with fresh ones.")
+    parser.add_argument("--refresh_verdicts", action="store_true",
+                        help="Ignore cached evaluator verdicts and overwrite them with fresh ones.")
+    parser.add_argument("--clear_cache", choices=["all", "baseline", "verdict"],
+                        help="Delete cached entries of this kind before the run.")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        kinds = ("baseline", "verdict") if args.clear_cache == "all" else (args.clear_cache,)
+        removed = clear_cache(args.cache, kinds)
+        print(f"🧹 Удалено {removed} записей из кэша {args.cache}")
+    refresh = [kind for kind, flag in (("baseline", args.refresh_baseline), ("verdict", args.refresh_verdicts)) if flag]
+
+    calculate_metrics(
+        workers=args.workers,
+        ollama_concurrency=args.ollama_concurrency,
+        ollama_rps=args.ollama_rps,
+        mistral_concurrency=args.mistral_concurrency,
+        mistral_rps=args.mistral_rps,
+        max_retries=args.max_retries,
+        questions_path=args.questions,
+        log_path=args.log,
+        run_id=args.run_id,
+        export_path=args.export_json,
+        cache_path="" if args.no_cache else args.cache,
+        refresh=refresh,
+        legacy_path=args.import_legacy,
+    )
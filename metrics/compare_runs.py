@@ -0,0 +1,314 @@
+"""
+compare_runs.py — сравнение прогонов бенчмарка (calculate_metrics.py) и проверка бюджета регрессий
+
+Первый прогон — базовый, остальные сравниваются с ним. Прогон задаётся файлом результатов:
+экспортом .json или журналом .jsonl, для журнала run id указывается через "@" (обязательно,
+если в журнале больше одного запуска):
+    metrics/out/model_evaluation.jsonl@before
+Подпись прогона — run id или имя файла; если подписи совпадают, берётся путь целиком.
+
+По каждой группе вопросов (все, по сложности, по теме) считаются средний rag_score,
+p50/p95 задержки RAG, токены (промпт + ответ) и число вызовов LLM на вопрос, а также дельты
+к базовому прогону. Значимость — на вопросах, которые есть в обоих прогонах: для среднего
+балла, токенов и вызовов — парный перестановочный тест (случайная смена знака разностей),
+для p50/p95 — парный бутстрэп по вопросам. Для метрик без трассы (старые прогоны) дельта
+не считается.
+
+Бюджет регрессий: падение среднего балла больше --max_score_drop или относительный рост
+p50/p95, токенов или вызовов больше --max_latency_increase / --max_tokens_increase /
+--max_calls_increase, причём значимый (p < --alpha), — регрессия. Если она есть в проверяемых
+группах (--check_groups), скрипт выходит с кодом 1.
+
+Использование:
+    python metrics/compare_runs.py metrics/out/model_evaluation.jsonl@before metrics/out/model_evaluation.jsonl@after
+    python metrics/compare_runs.py before.json after.json --check_groups all complexity --markdown metrics/out/compare.md
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+from results_log import load_results, run_ids
+
+METRICS = {
+    # метрика: (как извлечь из результата, "больше — лучше")
+    "score": (lambda r: r.get("evaluation", {}).get("rag_score"), True),
+    "latency": (lambda r: (r.get("rag_trace") or {}).get("duration"), False),
+    "tokens": (lambda r: _tokens(r.get("rag_trace")), False),
+    "llm_calls": (lambda r: (r.get("rag_trace") or {}).get("llm_calls"), False),
+}
+
+
+def _tokens(trace):
+    if not trace or "prompt_tokens" not in trace:
+        return None
+    return trace["prompt_tokens"] + trace.get("completion_tokens", 0)
+
+
+#############################################
+# 0 — Загрузка
+#############################################
+
+def load_run(spec: str) -> tuple:
+    """
+    'path' или 'path.jsonl@run_id' -> (подпись, {вопрос: результат}).
+    Журнал с несколькими запусками без @run_id не принимается: иначе запуски смешались бы.
+    """
+    path, _, run_id = spec.partition("@")
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if path.endswith(".jsonl") and not run_id:
+        ids = run_ids(path)
+        if len(ids) > 1:
+            raise ValueError(f"в {path} несколько запусков ({', '.join(map(str, ids))}), укажите {path}@run_id")
+    results = load_results(path, run_id or None)
+    label = run_id or os.path.splitext(os.path.basename(path))[0]
+    return label, {r["question"]: r for r in results}
+
+
+def unique_labels(runs: list, specs: list) -> list:
+    """
+    Одинаковые подписи (model_evaluation.json из разных папок, a.jsonl@after и b.jsonl@after)
+    заменяются полной спецификацией прогона, а повтор той же спецификации получает номер.
+    """
+    labels = [label for label, _ in runs]
+    labels = [spec if labels.count(label) > 1 else label for label, spec in zip(labels, specs)]
+    unique = []
+    for label in labels:
+        n = 1
+        candidate = label
+        while candidate in unique:
+            n += 1
+            candidate = f"{label} #{n}"
+        unique.append(candidate)
+    return [(label, results) for label, (_, results) in zip(unique, runs)]
+
+
+def group_questions(results: dict) -> dict:
+    groups = defaultdict(list)
+    for q, r in results.items():
+        groups[("all", "all")].append(q)
+        groups[("complexity", r.get("complexity", "unknown"))].append(q)
+        groups[("theme", r.get("theme") or "unknown")].append(q)
+    return groups
+
+
+#############################################
+# 1 — Статистика
+#############################################
+
+def values(results: dict, questions: list, metric: str) -> list:
+    extract = METRICS[metric][0]
+    return [v for v in (extract(results[q]) for q in questions if q in results) if v is not None]
+
+
+def paired(base: dict, other: dict, questions: list, metric: str) -> tuple:
+    extract = METRICS[metric][0]
+    pairs = [(extract(base[q]), extract(other[q])) for q in questions if q in base and q in other]
+    pairs = [(a, b) for a, b in pairs if a is not None and b is not None]
+    return np.array([a for a, _ in pairs], dtype=float), np.array([b for _, b in pairs], dtype=float)
+
+
+def permutation_p_value(a: np.ndarray, b: np.ndarray, n: int = 10000, seed: int = 0) -> float:
+    """Двусторонний парный перестановочный тест для разности средних."""
+    diffs = b - a
+    if len(diffs) == 0 or not diffs.any():
+        return 1.0
+    rng = np.random.default_rng(seed)
+    observed = abs(diffs.mean())
+    signs = rng.choice([-1.0, 1.0], size=(n, len(diffs)))
+    null = np.abs((signs * diffs).mean(axis=1))
+    return float((np.sum(null >= observed - 1e-12) + 1) / (n + 1))
+
+
+def bootstrap_p_value(a: np.ndarray, b: np.ndarray, q: float, n: int = 10000, seed: int = 0) -> float:
+    """
+    Парный бутстрэп по вопросам для разности перцентилей: двусторонний p — удвоенная доля
+    перевыборок, где разность по знаку противоположна наблюдаемой.
+    """
+    if len(a) < 2:
+        return 1.0
+    observed = np.percentile(b, q) - np.percentile(a, q)
+    if observed == 0:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(a), size=(n, len(a)))
+    deltas = np.percentile(b[idx], q, axis=1) - np.percentile(a[idx], q, axis=1)
+    opposite = np.sum(deltas <= 0) if observed > 0 else np.sum(deltas >= 0)
+    return float(min(1.0, 2 * (opposite + 1) / (n + 1)))
+
+
+def summarize(results: dict, questions: list) -> dict:
+    scores = values(results, questions, "score")
+    latencies = values(results, questions, "latency")
+    tokens = values(results, questions, "tokens")
+    calls = values(results, questions, "llm_calls")
+    return {
+        "n": len([q for q in questions if q in results]),
+        "score": float(np.mean(scores)) if scores else None,
+        "latency_p50": float(np.percentile(latencies, 50)) if latencies else None,
+        "latency_p95": float(np.percentile(latencies, 95)) if latencies else None,
+        "tokens": float(np.mean(tokens)) if tokens else None,
+        "llm_calls": float(np.mean(calls)) if calls else None,
+    }
+
+
+def compare(base: dict, other: dict, questions: list, budget: dict, alpha: float, n_resamples: int) -> dict:
+    """Дельты other - base по группе, значимость и нарушения бюджета."""
+    checks = {}
+    a, b = paired(base, other, questions, "score")
+    if len(a):
+        delta = float(b.mean() - a.mean())
+        p = permutation_p_value(a, b, n_resamples)
+        checks["score"] = {"delta": delta, "p": p, "paired": len(a),
+                           "regression": delta < -budget["score"] and p < alpha}
+
+    a, b = paired(base, other, questions, "latency")
+    for q in (50, 95):
+        if len(a):
+            before, after = float(np.percentile(a, q)), float(np.percentile(b, q))
+            rel = (after - before) / before if before else 0.0
+            p = bootstrap_p_value(a, b, q, n_resamples)
+            checks[f"latency_p{q}"] = {"delta": after - before, "relative": rel, "p": p, "paired": len(a),
+                                       "regression": rel > budget["latency"] and p < alpha}
+
+    for metric in ("tokens", "llm_calls"):
+        a, b = paired(base, other, questions, metric)
+        if len(a):
+            before = float(a.mean())
+            rel = float(b.mean() - before) / before if before else 0.0
+            p = permutation_p_value(a, b, n_resamples)
+            checks[metric] = {"delta": float(b.mean() - before), "relative": rel, "p": p, "paired": len(a),
+                              "regression": rel > budget[metric] and p < alpha}
+    return checks
+
+
+#############################################
+# 2 — Отчёт
+#############################################
+
+def _fmt(value, digits=2):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def _fmt_check(check: dict) -> str:
+    if not check:
+        return "-"
+    text = f"{check['delta']:+.2f}"
+    if "relative" in check:
+        text += f" ({check['relative']:+.0%})"
+    text += f" p={check['p']:.3f}"
+    return text + (" ❌" if check["regression"] else "")
+
+
+def build_report(runs: list, budget: dict, alpha: float, n_resamples: int) -> dict:
+    base_label, base = runs[0]
+    groups = group_questions(base)
+    report = {"baseline": base_label, "budget": budget, "alpha": alpha, "groups": []}
+    for (kind, name), questions in sorted(groups.items(), key=lambda item: (item[0][0] != "all", item[0])):
+        entry = {"kind": kind, "name": name, "runs": {}, "checks": {}}
+        for label, results in runs:
+            entry["runs"][label] = summarize(results, questions)
+        for label, results in runs[1:]:
+            entry["checks"][label] = compare(base, results, questions, budget, alpha, n_resamples)
+        report["groups"].append(entry)
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n📊 Baseline: {report['baseline']}, alpha={report['alpha']}, budget={report['budget']}")
+    for entry in report["groups"]:
+        print(f"\n[{entry['kind']}] {entry['name']}")
+        print(f"  {'run':<20} {'n':>4} {'score':>6} {'p50 s':>7} {'p95 s':>7} {'tokens':>8} {'calls':>6}")
+        for label, s in entry["runs"].items():
+            print(f"  {label:<20} {s['n']:>4} {_fmt(s['score']):>6} {_fmt(s['latency_p50']):>7} "
+                  f"{_fmt(s['latency_p95']):>7} {_fmt(s['tokens'], 0):>8} {_fmt(s['llm_calls']):>6}")
+        for label, checks in entry["checks"].items():
+            parts = [f"{metric}: {_fmt_check(check)}" for metric, check in checks.items()]
+            print(f"  Δ {label}: " + ("; ".join(parts) if parts else "нет общих вопросов"))
+
+
+def markdown_report(report: dict) -> str:
+    lines = [f"# Сравнение прогонов (база: {report['baseline']})", "",
+             f"alpha={report['alpha']}, бюджет: {report['budget']}", ""]
+    for entry in report["groups"]:
+        lines += [f"## {entry['kind']}: {entry['name']}", "",
+                  "| run | n | score | p50, s | p95, s | tokens | LLM calls |",
+                  "|---|---|---|---|---|---|---|"]
+        for label, s in entry["runs"].items():
+            lines.append(f"| {label} | {s['n']} | {_fmt(s['score'])} | {_fmt(s['latency_p50'])} | "
+                         f"{_fmt(s['latency_p95'])} | {_fmt(s['tokens'], 0)} | {_fmt(s['llm_calls'])} |")
+        for label, checks in entry["checks"].items():
+            lines.append("")
+            lines.append(f"Δ {label}: " + "; ".join(f"{m}: {_fmt_check(c)}" for m, c in checks.items()))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def regressions(report: dict, check_groups) -> list:
+    found = []
+    for entry in report["groups"]:
+        if entry["kind"] not in check_groups:
+            continue
+        for label, checks in entry["checks"].items():
+            for metric, check in checks.items():
+                if check["regression"]:
+                    found.append((label, entry["kind"], entry["name"], metric, check))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark runs and fail on regressions beyond a budget.")
+    parser.add_argument("runs", nargs="+", help="Result files; the first is the baseline. Use log.jsonl@run_id for logs.")
+    parser.add_argument("--max_score_drop", type=float, default=0.2, help="Allowed drop of the mean rag_score.")
+    parser.add_argument("--max_latency_increase", type=float, default=0.1, help="Allowed relative p50/p95 growth.")
+    parser.add_argument("--max_tokens_increase", type=float, default=0.1, help="Allowed relative tokens/question growth.")
+    parser.add_argument("--max_calls_increase", type=float, default=0.0, help="Allowed relative LLM calls/question growth.")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Significance level for a regression.")
+    parser.add_argument("--resamples", type=int, default=10000, help="Permutations / bootstrap resamples.")
+    parser.add_argument("--check_groups", nargs="+", default=["all"], choices=["all", "complexity", "theme"],
+                        help="Groups whose regressions fail the run.")
+    parser.add_argument("--out", type=str, default=None, help="Write the full report as JSON.")
+    parser.add_argument("--markdown", type=str, default=None, help="Write a Markdown before/after report.")
+    args = parser.parse_args()
+
+    if len(args.runs) < 2:
+        parser.error("нужно хотя бы два прогона")
+
+    try:
+        runs = unique_labels([load_run(spec) for spec in args.runs], args.runs)
+    except ValueError as e:
+        parser.error(str(e))
+    budget = {
+        "score": args.max_score_drop,
+        "latency": args.max_latency_increase,
+        "tokens": args.max_tokens_increase,
+        "llm_calls": args.max_calls_increase,
+    }
+    report = build_report(runs, budget, args.alpha, args.resamples)
+    print_report(report)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.markdown:
+        os.makedirs(os.path.dirname(os.path.abspath(args.markdown)), exist_ok=True)
+        with open(args.markdown, "w", encoding="utf-8") as f:
+            f.write(markdown_report(report))
+
+    found = regressions(report, args.check_groups)
+    if found:
+        print(f"\n❌ {len(found)} regressions over budget:")
+        for label, kind, name, metric, check in found:
+            print(f"  {label} [{kind}] {name}: {metric} {_fmt_check(check)}")
+        sys.exit(1)
+    print("\n✅ No regressions over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+eval_cache.py — кэш ответов baseline и вердиктов оценщика между прогонами calculate_metrics.py
+
+Ответ baseline ключуется по (модель, температура, системный промпт, вопрос), вердикт оценщика —
+по хэшу (модель, промпт оценщика, вопрос, groundtruth, ответ RAG, ответ baseline). Если поменялась
+только RAG-часть, baseline берётся из кэша, а заново оцениваются лишь пары с новым ответом RAG.
+
+Хранилище — append-only JSONL {"key", "kind", "value", ...} (src/jsonl_log.py):
+запись дописывается в конец, при чтении побеждает последняя запись ключа.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from src.jsonl_log import JsonlAppender, iter_records
+
+logger = logging.getLogger("EvalCache")
+
+DEFAULT_CACHE_PATH = "metrics/out/eval_cache.jsonl"
+
+
+def cache_key(kind: str, *parts) -> str:
+    h = hashlib.sha1(kind.encode("utf-8"))
+    for part in parts:
+        h.update(b"\0")
+        h.update(str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+def baseline_key(model: str, temperature: float, system_prompt: str, question: str) -> str:
+    return cache_key("baseline", model, temperature, system_prompt, question)
+
+
+def verdict_key(model: str, system_prompt: str, question: str, groundtruth: str,
+                rag_answer: str, baseline_answer: str) -> str:
+    return cache_key("verdict", model, system_prompt, question, groundtruth, rag_answer, baseline_answer)
+
+
+class EvalCache:
+    """
+    refresh — виды записей ("baseline", "verdict"), которые не читаются из кэша,
+    а считаются заново и перезаписываются.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, refresh=(), fsync_every: int = 20):
+        self.path = path
+        self.refresh = set(refresh)
+        self.entries = {record["key"]: record for record in iter_records(path)}
+        self.hits = {"baseline": 0, "verdict": 0}
+        self.misses = {"baseline": 0, "verdict": 0}
+        self._lock = threading.Lock()
+        self._log = JsonlAppender(path, fsync_every)
+        logger.info(f"Кэш оценки: {len(self.entries)} записей в {path}")
+
+    def get(self, kind: str, key: str):
+        with self._lock:
+            record = None if kind in self.refresh else self.entries.get(key)
+            (self.hits if record is not None else self.misses)[kind] += 1
+        return None if record is None else record["value"]
+
+    def put(self, kind: str, key: str, value, **meta):
+        record = {"key": key, "kind": kind, "value": value, **meta}
+        with self._lock:
+            self.entries[key] = record
+        self._log.write(record)
+
+    def stats(self) -> str:
+        return ", ".join(f"{kind}: {self.hits[kind]} из кэша, {self.misses[kind]} запросов" for kind in self.hits)
+
+    def close(self):
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def clear_cache(path: str = DEFAULT_CACHE_PATH, kinds=("baseline", "verdict")):
+    """Удаляет из кэша записи указанных видов (переписывает файл)."""
+    if not os.path.exists(path):
+        return 0
+    kept, removed = [], 0
+    for record in iter_records(path):
+        if record.get("kind") in kinds:
+            removed += 1
+        else:
+            kept.append(record)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in kept:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return removed
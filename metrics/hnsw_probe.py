@@ -0,0 +1,157 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from src.manage_db import get_embeddings
+from src.hnsw import hnsw_configuration, collection_hnsw, set_search_ef
+from metrics.index_sweep import dir_size_mb, clear_chroma_cache
+from langchain_chroma import Chroma
+
+
+#############################################
+# 0 — Точный top-k перебором
+#############################################
+
+def brute_force_top_k(vectors: np.ndarray, queries: np.ndarray, k: int, space: str = "l2") -> list[np.ndarray]:
+    """Индексы точных k ближайших соседей в той же метрике, что и у коллекции."""
+    if space == "l2":
+        distances = (queries ** 2).sum(1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(1)[None, :]
+    elif space == "ip":
+        distances = 1 - queries @ vectors.T
+    elif space == "cosine":
+        v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        distances = 1 - q @ v.T
+    else:
+        raise ValueError(f"Unknown space: {space}")
+    return [np.argsort(row)[:k] for row in distances]
+
+
+#############################################
+# 1 — Замер одной настройки
+#############################################
+
+def probe_search(collection, query_vectors, exact_ids, k, search_ef) -> dict:
+    set_search_ef(collection, search_ef)
+    # первый запрос поднимает индекс в память — его не считаем
+    collection.query(query_embeddings=[query_vectors[0]], n_results=k, include=[])
+
+    latencies = []
+    recalls = []
+    for vector, exact in zip(query_vectors, exact_ids):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[vector], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(result["ids"][0]) & exact) / len(exact))
+
+    return {
+        "search_ef": search_ef,
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        "min_recall": round(float(np.min(recalls)), 4),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def build_copy(persist_directory, ids, vectors, hnsw_m, construction_ef, batch_size=1000):
+    """Строит временную коллекцию с другими M/construction_ef из уже посчитанных эмбеддингов."""
+    store = Chroma(
+        persist_directory=persist_directory,
+        collection_configuration=hnsw_configuration(hnsw_m, construction_ef)
+    )
+    start = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        store._collection.add(ids=ids[i:i + batch_size], embeddings=vectors[i:i + batch_size])
+    return store, time.perf_counter() - start
+
+
+#############################################
+# 2 — Основной цикл
+#############################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HNSW search against brute-force top-k for a Chroma store.")
+    parser.add_argument("--persist_directory", type=str, default="terraria_db/general", help="Store to probe.")
+    parser.add_argument("--questions", type=str, default="metrics/benchmark_questions.json", help="Sample queries.")
+    parser.add_argument("--out_dir", type=str, default="metrics/out", help="Where to write the results table.")
+    parser.add_argument("--embedding_model", type=str, default="intfloat/multilingual-e5-large", help="Embedding model to use.")
+    parser.add_argument("--cpu", action="store_true", help="Do not use CUDA even if it is available.")
+    parser.add_argument("--k", type=int, default=8, help="Top-k to compare (GeneralAgent uses 8, CraftAgent 24).")
+    parser.add_argument("--search_efs", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--hnsw_ms", type=int, nargs="+", help="Also rebuild copies of the store with these M values.")
+    parser.add_argument("--construction_efs", type=int, nargs="+", help="Also rebuild copies of the store with these construction ef values.")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+
+    embedding = get_embeddings(args.embedding_model, not args.cpu)
+    source = Chroma(persist_directory=args.persist_directory, embedding_function=embedding)
+    data = source._collection.get(include=["embeddings"])
+    ids = list(data["ids"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    query_vectors = np.asarray([embedding.embed_query(q) for q in questions], dtype=np.float32)
+
+    original = collection_hnsw(source._collection)
+    space = original.get("space", "l2")
+    k = min(args.k, len(ids))
+    exact_ids = [{ids[i] for i in row} for row in brute_force_top_k(vectors, query_vectors, k, space)]
+    print(f"Probing {args.persist_directory}: {len(ids)} vectors, {len(questions)} queries, k={k}, space={space}.")
+
+    rows = []
+    # сначала текущая база как есть, затем копии с другими параметрами построения
+    builds = [(None, None)]
+    if args.hnsw_ms or args.construction_efs:
+        builds += list(itertools.product(args.hnsw_ms or [None], args.construction_efs or [None]))
+
+    # ef поиска сохраняется в коллекции на диске — после пробы возвращаем исходное значение
+    try:
+        for hnsw_m, construction_ef in builds:
+            if hnsw_m is None and construction_ef is None:
+                collection, build_time, size = source._collection, None, dir_size_mb(args.persist_directory)
+                label = {"hnsw_m": original.get("max_neighbors"), "construction_ef": original.get("ef_construction"), "rebuilt": False}
+                tmp_dir = None
+            else:
+                tmp_dir = tempfile.mkdtemp(prefix="terraria_hnsw_")
+                store, build_time = build_copy(tmp_dir, ids, vectors, hnsw_m, construction_ef)
+                collection, size = store._collection, dir_size_mb(tmp_dir)
+                label = {"hnsw_m": hnsw_m, "construction_ef": construction_ef, "rebuilt": True}
+            try:
+                for search_ef in args.search_efs:
+                    row = {
+                        **label,
+                        **probe_search(collection, query_vectors, exact_ids, k, search_ef),
+                        "build_time_s": None if build_time is None else round(build_time, 2),
+                        "index_size_mb": round(size, 2),
+                    }
+                    print(row)
+                    rows.append(row)
+            finally:
+                if tmp_dir is not None:
+                    clear_chroma_cache()
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+    finally:
+        set_search_ef(source._collection, original.get("ef_search", 100))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, "hnsw_probe.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(args.out_dir, "hnsw_probe.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print("Таблица сохранена в:", os.path.join(args.out_dir, "hnsw_probe.csv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import os
+import re
+import csv
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import matplotlib.pyplot as plt
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from src.manage_db import (
+    E5_MAX_TOKENS,
+    load_texts,
+    load_tokenizer,
+    split_texts,
+    count_oversized_chunks,
+    get_embeddings,
+    add_chunks,
+    hnsw_configuration,
+)
+from src.agent import GeneralAgent
+from langchain_chroma import Chroma
+
+
+#############################################
+# 0 — Вспомогательные функции
+#############################################
+
+def rss_mb() -> float:
+    """Текущий resident set size процесса в МБ."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        # на macOS ru_maxrss в байтах, на Linux — в КБ; это пиковое значение, а не текущее
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def dir_size_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total / 2**20
+
+
+def keyword_stems(text: str, min_len: int = 4, stem_len: int = 6) -> set:
+    """
+    Грубая нормализация для русского текста: нижний регистр, ё -> е,
+    слова короче min_len выкидываются, у остальных отрезается окончание
+    (до двух символов, но не короче min_len) и основа обрезается до stem_len символов.
+    Числа сохраняются как есть.
+    """
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    stems = set()
+    for w in words:
+        if w.isdigit():
+            stems.add(w)
+        elif len(w) >= min_len:
+            stems.add(w[:max(min_len, len(w) - 2)][:stem_len])
+    return stems
+
+
+def keyword_overlap(groundtruth: str, docs_text: str) -> float:
+    gt = keyword_stems(groundtruth)
+    if not gt:
+        return 0.0
+    return len(gt & keyword_stems(docs_text)) / len(gt)
+
+
+def clear_chroma_cache() -> None:
+    """Сбрасывает кэш клиентов Chroma, чтобы следующее открытие базы шло с диска."""
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    except Exception:
+        pass
+
+
+def build_grid(args) -> list[dict]:
+    grid = []
+    for splitter, chunk_size, chunk_overlap, min_length, embed_window, hnsw_m, construction_ef in itertools.product(
+            args.splitters, args.chunk_sizes, args.chunk_overlaps, args.min_lengths, args.embed_windows,
+            args.hnsw_ms or [None], args.construction_efs or [None]):
+        if chunk_overlap >= chunk_size:
+            continue
+        grid.append({
+            "splitter": splitter,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "min_length": min_length,
+            "embed_window": embed_window if splitter == "tokens" else None,
+            "hnsw_m": hnsw_m,
+            "construction_ef": construction_ef,
+        })
+    # для chars embed_window не используется — убираем дубликаты
+    unique = []
+    for config in grid:
+        if config not in unique:
+            unique.append(config)
+    return unique
+
+
+def config_label(config: dict) -> str:
+    label = f"{config['splitter']} {config['chunk_size']}/{config['chunk_overlap']} min{config['min_length']}"
+    if config.get("embed_window"):
+        label += f" w{config['embed_window']}"
+    if config.get("hnsw_m"):
+        label += f" M{config['hnsw_m']}"
+    if config.get("construction_ef"):
+        label += f" ef{config['construction_ef']}"
+    return label
+
+
+#############################################
+# 1 — Прогон одной конфигурации
+#############################################
+
+def agent_docs(vectorstore, question: str, k: int, fetch_k: int) -> list:
+    """Документы, которые GeneralAgent отправил бы в LLM: fetch_k окон без повторов контекста, первые k."""
+    return GeneralAgent._unique_contexts(vectorstore.similarity_search(question, k=fetch_k))[:k]
+
+
+def run_config(config, texts, questions, tokenizer, embedding, k, fetch_k, hit_threshold):
+    persist_directory = tempfile.mkdtemp(prefix="terraria_sweep_")
+    try:
+        start = time.perf_counter()
+        chunks = split_texts(
+            texts,
+            splitter=config["splitter"],
+            chunk_size=config["chunk_size"],
+            chunk_overlap=config["chunk_overlap"],
+            min_length=config["min_length"],
+            tokenizer=tokenizer,
+            embed_window=config["embed_window"] or E5_MAX_TOKENS,
+        )
+        vectorstore = Chroma(
+            persist_directory=persist_directory,
+            embedding_function=embedding,
+            collection_configuration=hnsw_configuration(config["hnsw_m"], config["construction_ef"])
+        )
+        add_chunks(vectorstore, chunks, embedding)
+        build_time = time.perf_counter() - start
+        del vectorstore
+        clear_chroma_cache()
+
+        # открываем базу заново и прогреваем HNSW первым запросом
+        rss_before = rss_mb()
+        vectorstore = Chroma(persist_directory=persist_directory, embedding_function=embedding)
+        vectorstore.similarity_search(questions[0]["question"], k=fetch_k)
+        rss_after = rss_mb()
+
+        latencies = []
+        overlaps = []
+        context_chars = []
+        context_tokens = []
+        for item in questions:
+            start = time.perf_counter()
+            docs = agent_docs(vectorstore, item["question"], k, fetch_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            # крупные чанки покрывают больше ключевых слов просто за счёт объёма — размер контекста рядом
+            context = "\n".join(d.page_content for d in docs)
+            overlaps.append(keyword_overlap(item["groundtruth"], context))
+            context_chars.append(len(context))
+            context_tokens.append(len(tokenizer.encode(context, add_special_tokens=False, verbose=False)))
+
+        return {
+            **config,
+            "chunks": len(chunks),
+            "oversized_chunks": count_oversized_chunks(chunks, tokenizer),
+            "build_time_s": round(build_time, 2),
+            "index_size_mb": round(dir_size_mb(persist_directory), 2),
+            "rss_mb": round(rss_after, 1),
+            "rss_delta_mb": round(rss_after - rss_before, 1),
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "latency_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "hit_rate": round(float(np.mean([o >= hit_threshold for o in overlaps])), 3),
+            "keyword_overlap": round(float(np.mean(overlaps)), 3),
+            "context_chars": round(float(np.mean(context_chars))),
+            "context_tokens": round(float(np.mean(context_tokens))),
+        }
+    finally:
+        clear_chroma_cache()
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+#############################################
+# 2 — Сохранение и графики
+#############################################
+
+def save_rows(rows, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "index_sweep.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(out_dir, "index_sweep.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def plot_bars(labels, series, ylabel, title, path):
+    x = np.arange(len(labels))
+    width = 0.8 / len(series)
+
+    plt.figure(figsize=(12, 6))
+    for i, (name, values) in enumerate(series.items()):
+        plt.bar(x - 0.4 + width * (i + 0.5), values, width, label=name)
+
+    plt.xticks(x, labels, rotation=30, ha="right")
+    plt.ylabel(ylabel)
+    plt.title(title)
+    if len(series) > 1:
+        plt.legend()
+
+    plt.grid(axis="y", alpha=0.3)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_sweep(rows, out_dir):
+    out_dir = os.path.join(out_dir, "index_sweep")
+    os.makedirs(out_dir, exist_ok=True)
+    labels = [config_label(r) for r in rows]
+
+    plot_bars(labels, {"hit rate": [r["hit_rate"] for r in rows],
+                       "keyword overlap": [r["keyword_overlap"] for r in rows]},
+              "Score", "Качество поиска по конфигурациям индекса", os.path.join(out_dir, "quality.png"))
+    plot_bars(labels, {"p50": [r["latency_p50_ms"] for r in rows],
+                       "p95": [r["latency_p95_ms"] for r in rows]},
+              "Latency, ms", "Задержка поиска по конфигурациям индекса", os.path.join(out_dir, "latency.png"))
+    plot_bars(labels, {"index size, MB": [r["index_size_mb"] for r in rows],
+                       "RSS delta, MB": [r["rss_delta_mb"] for r in rows]},
+              "MB", "Размер индекса и память после загрузки", os.path.join(out_dir, "size.png"))
+    plot_bars(labels, {"build time, s": [r["build_time_s"] for r in rows]},
+              "Seconds", "Время построения индекса", os.path.join(out_dir, "build_time.png"))
+    plot_quality_vs_context(rows, labels, os.path.join(out_dir, "quality_vs_context.png"))
+    return out_dir
+
+
+def plot_quality_vs_context(rows, labels, path):
+    """Hit rate против размера контекста на запрос: выгоднее конфигурации левее и выше."""
+    plt.figure(figsize=(12, 6))
+    plt.scatter([r["context_tokens"] for r in rows], [r["hit_rate"] for r in rows])
+    for r, label in zip(rows, labels):
+        plt.annotate(label, (r["context_tokens"], r["hit_rate"]), fontsize=8,
+                     xytext=(4, 4), textcoords="offset points")
+    plt.xlabel("Context tokens per query")
+    plt.ylabel("Hit rate")
+    plt.title("Качество поиска против размера контекста")
+    plt.grid(alpha=0.3)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+#############################################
+# 3 — Основной цикл
+#############################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking and index settings over temporary Chroma indexes.")
+    parser.add_argument("--json_path", type=str, default="data/data/wiki_dump_cleaned.json", help="Data to index.")
+    parser.add_argument("--questions", type=str, default="metrics/benchmark_questions.json", help="Benchmark questions with groundtruth.")
+    parser.add_argument("--out_dir", type=str, default="metrics/out", help="Where to write the results table and plots.")
+    parser.add_argument("--embedding_model", type=str, default="intfloat/multilingual-e5-large", help="Embedding model to use.")
+    parser.add_argument("--cpu", action="store_true", help="Do not use CUDA even if it is available.")
+    parser.add_argument("--splitters", type=str, nargs="+", default=["chars"], choices=["chars", "tokens"])
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", default=[1000, 2500, 5000])
+    parser.add_argument("--chunk_overlaps", type=int, nargs="+", default=[200, 1000])
+    parser.add_argument("--min_lengths", type=int, nargs="+", default=[200])
+    parser.add_argument("--embed_windows", type=int, nargs="+", default=[E5_MAX_TOKENS])
+    parser.add_argument("--hnsw_ms", type=int, nargs="+", help="HNSW M values (Chroma default if omitted).")
+    parser.add_argument("--construction_efs", type=int, nargs="+", help="HNSW construction ef values (Chroma default if omitted).")
+    parser.add_argument("--k", type=int, default=8, help="Documents per query (GeneralAgent uses max_docs=8).")
+    parser.add_argument("--fetch_k", type=int, default=None,
+                        help="Windows fetched before dropping repeated contexts, like GeneralAgent (default: 3 * k).")
+    parser.add_argument("--hit_threshold", type=float, default=0.5, help="Share of groundtruth keywords that counts as a hit.")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    texts = load_texts(args.json_path)
+    tokenizer = load_tokenizer(args.embedding_model)
+    embedding = get_embeddings(args.embedding_model, not args.cpu)
+    fetch_k = max(args.fetch_k or 3 * args.k, args.k)
+
+    grid = build_grid(args)
+    print(f"Sweeping {len(grid)} configurations over {len(questions)} questions.")
+
+    rows = []
+    for i, config in enumerate(grid, start=1):
+        print(f"[{i}/{len(grid)}] {config_label(config)}")
+        row = run_config(config, texts, questions, tokenizer, embedding, args.k, fetch_k, args.hit_threshold)
+        print(f"  hit rate {row['hit_rate']} at {row['context_tokens']} context tokens/query, "
+              f"p95 {row['latency_p95_ms']} ms, {row['index_size_mb']} MB")
+        rows.append(row)
+        # сохраняем после каждой конфигурации, чтобы не терять результаты долгого прогона
+        save_rows(rows, args.out_dir)
+
+    plots_dir = plot_sweep(rows, args.out_dir)
+    print("Таблица сохранена в:", os.path.join(args.out_dir, "index_sweep.csv"))
+    print("Графики сохранены в:", plots_dir)
+
+
+if __name__ == "__main__":
+    main()
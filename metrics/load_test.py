@@ -0,0 +1,346 @@
+"""
+load_test.py — нагрузочный тест TerrariaRAG: задержки p50/p95/p99, пропускная способность
+и разбивка времени запроса по шагам (routing, <агент>.retrieval, <агент>.generation, merge)
+
+Режимы:
+    inprocess — TerrariaRAG.run в этом же процессе, шаги берутся из timings;
+    http      — GET /ask запущенного API, шаги берутся из заголовка Server-Timing (API с RAG_SERVER_TIMING=1).
+
+Нагрузка задаётся уровнями --concurrency. При --rate 0 каждый уровень — замкнутый цикл
+(concurrency потоков шлют запросы друг за другом), при --rate > 0 запросы приходят
+пуассоновским потоком с этой интенсивностью, а задержка считается от момента прихода,
+то есть включает ожидание в очереди.
+
+Офлайн (без GPU-сервера): --stub_llm поднимает заглушку Ollama из stub_llm.py на --stub_port.
+    python metrics/load_test.py --mode inprocess --stub_llm --concurrency 1 2 4 8 --requests 40
+    RAG_SERVER_TIMING=1 RAG_LLM_URL=http://127.0.0.1:11435/api/generate uvicorn src.api:app --port 8000 &
+    python metrics/load_test.py --mode http --stub_llm --url http://127.0.0.1:8000 --concurrency 1 4 16
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+import requests
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from stub_llm import start_stub_server
+from src.tracing import Trace, tokens_per_second
+
+logger = logging.getLogger("LoadTest")
+
+PERCENTILES = [50, 95, 99]
+
+
+#############################################
+# 0 — Клиенты
+#############################################
+
+def parse_server_timing(header: str) -> dict:
+    """'routing;dur=812.4, merge;dur=950' -> {"routing": 0.8124, "merge": 0.95} (в секундах)."""
+    timings = {}
+    for part in (header or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        for field in fields[1:]:
+            if field.startswith("dur="):
+                try:
+                    timings[fields[0]] = float(field[4:]) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+def inprocess_client(terraria_rag):
+    def ask(question: str) -> dict:
+        trace = Trace()
+        terraria_rag.run(question, trace=trace)
+        summary = trace.summary()
+        return {"stages": summary["stages"], "llm": summary["llm"]}
+    return ask
+
+
+def http_client(url: str, timeout: float = 600.0):
+    local = threading.local()
+
+    def ask(question: str) -> dict:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        response = local.session.get(f"{url.rstrip('/')}/ask", params={"question": question}, timeout=timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return {"stages": parse_server_timing(response.headers.get("Server-Timing")), "llm": {}}
+    return ask
+
+
+#############################################
+# 1 — Прогон одного уровня нагрузки
+#############################################
+
+def timed_request(ask, question: str, arrived: float = None) -> dict:
+    """arrived — момент прихода запроса (открытая нагрузка); None — запрос начинается сразу."""
+    started = time.perf_counter()
+    arrived = started if arrived is None else arrived
+    record = {"question": question, "queue": started - arrived, "ok": True, "error": None, "stages": {}, "llm": {}}
+    try:
+        record.update(ask(question))
+    except Exception as e:
+        record["ok"] = False
+        record["error"] = str(e)
+    finished = time.perf_counter()
+    record["service"] = finished - started
+    record["latency"] = finished - arrived
+    record["finished"] = finished
+    return record
+
+
+def run_level(ask, questions: list, concurrency: int, n_requests: int, rate: float = 0.0, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    picked = [rng.choice(questions) for _ in range(n_requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        arrival = start
+        for question in picked:
+            if rate > 0:
+                arrival += rng.expovariate(rate)
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(timed_request, ask, question, arrival if rate > 0 else None))
+        records = [f.result() for f in futures]
+    wall = max(r["finished"] for r in records) - start
+    for r in records:
+        r["finished"] -= start
+        r.update(concurrency=concurrency, rate=rate)
+    return {"records": records, "wall": wall}
+
+
+def summarize(records: list, wall: float, concurrency: int, rate: float) -> dict:
+    ok = [r for r in records if r["ok"]]
+    latencies = np.array([r["latency"] for r in ok]) if ok else np.zeros(1)
+    row = {
+        "concurrency": concurrency,
+        "rate": rate,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else 0.0,
+        "mean_s": round(float(latencies.mean()), 3),
+        "queue_mean_s": round(float(np.mean([r["queue"] for r in ok])), 3) if ok else 0.0,
+    }
+    for p in PERCENTILES:
+        row[f"p{p}_s"] = round(float(np.percentile(latencies, p)), 3)
+    stage_names = sorted({name for r in ok for name in r["stages"]})
+    row["stages"] = {
+        name: {
+            "mean_s": round(float(np.mean([r["stages"].get(name, 0.0) for r in ok])), 3),
+            "p95_s": round(float(np.percentile([r["stages"].get(name, 0.0) for r in ok], 95)), 3),
+        }
+        for name in stage_names
+    }
+    # статистика LLM по шагам (только inprocess: Server-Timing токенов не передаёт)
+    llm_names = sorted({name for r in ok for name in r["llm"]})
+    row["llm"] = {}
+    for name in llm_names:
+        stats = [r["llm"][name] for r in ok if name in r["llm"]]
+        totals = {field: sum(s.get(field, 0) for s in stats)
+                  for field in ("llm_calls", "prompt_tokens", "completion_tokens", "prefill_s", "decode_s", "model_loads")}
+        row["llm"][name] = {
+            "calls_per_request": round(totals["llm_calls"] / len(ok), 2),
+            "prompt_tokens_mean": round(totals["prompt_tokens"] / len(stats), 1),
+            "completion_tokens_mean": round(totals["completion_tokens"] / len(stats), 1),
+            "prefill_tps": tokens_per_second(totals["prompt_tokens"], totals["prefill_s"]),
+            "decode_tps": tokens_per_second(totals["completion_tokens"], totals["decode_s"]),
+            "model_loads": totals["model_loads"],
+        }
+    return row
+
+
+#############################################
+# 2 — Отчёт
+#############################################
+
+def print_summary(rows: list):
+    print(f"\n{'conc':>5} {'rate':>6} {'req':>5} {'err':>4} {'rps':>7} {'mean':>7} "
+          + " ".join(f"{'p' + str(p):>7}" for p in PERCENTILES) + f" {'queue':>7}")
+    for row in rows:
+        print(f"{row['concurrency']:>5} {row['rate']:>6g} {row['requests']:>5} {row['errors']:>4} "
+              f"{row['throughput_rps']:>7.2f} {row['mean_s']:>7.2f} "
+              + " ".join(f"{row[f'p{p}_s']:>7.2f}" for p in PERCENTILES) + f" {row['queue_mean_s']:>7.2f}")
+    for row in rows:
+        if row["stages"]:
+            print(f"\n⏱ Stages at concurrency {row['concurrency']} (mean / p95, s):")
+            for name, stats in row["stages"].items():
+                print(f"  {name:<28} {stats['mean_s']:>7.3f} {stats['p95_s']:>7.3f}")
+        if row["llm"]:
+            print(f"\n🔤 LLM at concurrency {row['concurrency']}: "
+                  f"{'calls':>6} {'prompt':>8} {'output':>8} {'prefill t/s':>12} {'decode t/s':>11} {'loads':>6}")
+            for name, stats in row["llm"].items():
+                print(f"  {name:<28} {stats['calls_per_request']:>6} {stats['prompt_tokens_mean']:>8} "
+                      f"{stats['completion_tokens_mean']:>8} {str(stats['prefill_tps']):>12} "
+                      f"{str(stats['decode_tps']):>11} {stats['model_loads']:>6}")
+
+
+def save_results(rows: list, records: list, out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "requests.jsonl"), "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    stage_names = sorted({name for row in rows for name in row["stages"]})
+    fields = [k for k in rows[0] if k not in ("stages", "llm")] + [f"{name}_mean_s" for name in stage_names]
+    with open(os.path.join(out_dir, "summary.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            flat = {k: v for k, v in row.items() if k not in ("stages", "llm")}
+            flat.update({f"{name}_mean_s": row["stages"].get(name, {}).get("mean_s", 0.0) for name in stage_names})
+            writer.writerow(flat)
+
+
+def plot_results(rows: list, out_dir: str):
+    levels = [row["concurrency"] for row in rows]
+    x = np.arange(len(levels))
+
+    fig, (ax_lat, ax_rps) = plt.subplots(1, 2, figsize=(14, 5))
+    for p in PERCENTILES:
+        ax_lat.plot(x, [row[f"p{p}_s"] for row in rows], marker="o", label=f"p{p}")
+    ax_lat.set_ylabel("Latency, s")
+    ax_rps.plot(x, [row["throughput_rps"] for row in rows], marker="o")
+    ax_rps.set_ylabel("Throughput, req/s")
+    for ax in (ax_lat, ax_rps):
+        ax.set_xticks(x, [str(level) for level in levels])
+        ax.set_xlabel("Concurrency")
+        ax.grid(alpha=0.3)
+    ax_lat.legend()
+    fig.tight_layout()
+    fig.savefig(os.path.join(out_dir, "latency_throughput.png"))
+    plt.close(fig)
+
+    stage_names = sorted({name for row in rows for name in row["stages"]})
+    if not stage_names:
+        return
+    plt.figure(figsize=(12, 6))
+    bottom = np.zeros(len(rows))
+    for name in stage_names:
+        values = np.array([row["stages"].get(name, {}).get("mean_s", 0.0) for row in rows])
+        plt.bar(x, values, bottom=bottom, label=name)
+        bottom += values
+    plt.xticks(x, [str(level) for level in levels])
+    plt.xlabel("Concurrency")
+    plt.ylabel("Mean time per request, s")
+    plt.title("Разбивка времени запроса по шагам")
+    plt.legend()
+    plt.grid(axis="y", alpha=0.3)
+    plt.tight_layout()
+    plt.savefig(os.path.join(out_dir, "stage_breakdown.png"))
+    plt.close()
+
+
+#############################################
+# 3 — Запуск
+#############################################
+
+def load_test(mode: str = "inprocess",
+              url: str = "http://127.0.0.1:8000",
+              concurrency_levels=(1, 2, 4, 8),
+              n_requests: int = 40,
+              rate: float = 0.0,
+              warmup: int = 2,
+              questions_path: str = "metrics/benchmark_questions.json",
+              out_dir: str = "metrics/out/load_test",
+              stub_llm: bool = False,
+              stub_latency: float = 0.5,
+              stub_port: int = 11435,
+              stub_options: dict = None,
+              seed: int = 42) -> list:
+    with open(questions_path, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+
+    stub = None
+    if stub_llm:
+        stub = start_stub_server(port=stub_port, latency=stub_latency, **(stub_options or {}))
+        logger.info(f"Заглушка LLM: {stub.url}")
+
+    if mode == "inprocess":
+        from src.main import setup_terraria_rag
+        terraria_rag = setup_terraria_rag(api_url=stub.url if stub else None)
+        terraria_rag.warm_up()
+        ask = inprocess_client(terraria_rag)
+    else:
+        ask = http_client(url)
+
+    for question in questions[:warmup]:
+        timed_request(ask, question)
+
+    rows, all_records = [], []
+    for concurrency in concurrency_levels:
+        logger.info(f"Уровень нагрузки: concurrency={concurrency}, rate={rate}, запросов {n_requests}")
+        level = run_level(ask, questions, concurrency, n_requests, rate, seed)
+        rows.append(summarize(level["records"], level["wall"], concurrency, rate))
+        all_records.extend(level["records"])
+
+    print_summary(rows)
+    save_results(rows, all_records, out_dir)
+    plot_results(rows, out_dir)
+    print(f"\n✅ Results written to {out_dir}")
+
+    if stub:
+        stub.shutdown()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmark for TerrariaRAG.run and the /ask API.")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8000", help="API base URL for --mode http.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="Concurrency levels to test.")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per concurrency level.")
+    parser.add_argument("--rate", type=float, default=0.0, help="Poisson arrival rate, req/s (0 = closed loop).")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before the first level.")
+    parser.add_argument("--questions", type=str, default="metrics/benchmark_questions.json")
+    parser.add_argument("--out_dir", type=str, default="metrics/out/load_test")
+    parser.add_argument("--stub_llm", action="store_true", help="Serve LLM calls from the local stub (offline).")
+    parser.add_argument("--stub_latency", type=float, default=0.5, help="Stub response delay, seconds.")
+    parser.add_argument("--stub_port", type=int, default=11435, help="Stub port (point the API's RAG_LLM_URL here).")
+    parser.add_argument("--stub_prefill_per_1k", type=float, default=0.0, help="Stub delay per 1000 prompt tokens.")
+    parser.add_argument("--stub_token_latency", type=float, default=0.0, help="Stub delay per generated token.")
+    parser.add_argument("--stub_error_rate", type=float, default=0.0, help="Share of stub responses that are HTTP 500.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_test(
+        mode=args.mode,
+        url=args.url,
+        concurrency_levels=args.concurrency,
+        n_requests=args.requests,
+        rate=args.rate,
+        warmup=args.warmup,
+        questions_path=args.questions,
+        out_dir=args.out_dir,
+        stub_llm=args.stub_llm,
+        stub_latency=args.stub_latency,
+        stub_port=args.stub_port,
+        stub_options={
+            "prefill_per_1k": args.stub_prefill_per_1k,
+            "token_latency": args.stub_token_latency,
+            "error_rate": args.stub_error_rate,
+        },
+        seed=args.seed,
+    )
@@ -0,0 +1,109 @@
+"""
+results_log.py — append-only журнал результатов бенчмарка (JSONL)
+
+Каждый обработанный вопрос дописывается в конец журнала одной строкой:
+результат из calculate_metrics плюс поля "run_id" и "question_hash" (sha1 вопроса).
+Запись — O(1), весь файл не перезаписывается; fsync делается раз в fsync_every записей
+и при закрытии. Возобновление читает журнал потоково и собирает только ключи.
+
+Если процесс убили посреди записи, битая последняя строка при чтении пропускается —
+этот вопрос просто посчитается заново. Повторные записи одного вопроса в одном запуске
+схлопываются: побеждает последняя.
+
+Чтение и дозапись самого JSONL — iter_records и JsonlAppender из src/jsonl_log.py.
+"""
+
+import os
+import sys
+import json
+import hashlib
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from src.jsonl_log import JsonlAppender, iter_records
+
+DEFAULT_LOG_PATH = "metrics/out/model_evaluation.jsonl"
+DEFAULT_RUN_ID = "default"
+LEGACY_RUN_ID = "legacy"  # результаты, перенесённые из model_evaluation.json до появления журнала
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()
+
+
+def iter_results(path: str, run_id: str = None):
+    """
+    Результаты одного запуска (или всех, если run_id=None) без повторов.
+    Держит в памяти только номера строк с последней версией каждого ключа.
+    """
+    latest = {}
+    for i, record in enumerate(iter_records(path)):
+        if run_id is None or record.get("run_id") == run_id:
+            latest[(record.get("run_id"), record.get("question_hash"))] = i
+    keep = set(latest.values())
+    for i, record in enumerate(iter_records(path)):
+        if i in keep:
+            yield record
+
+
+def load_results(path: str, run_id: str = None) -> list:
+    """Результаты из журнала .jsonl или из старого JSON-массива."""
+    if path.endswith(".jsonl"):
+        return list(iter_results(path, run_id))
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_ids(path: str) -> list:
+    seen = {}
+    for record in iter_records(path):
+        seen.setdefault(record.get("run_id"), None)
+    return list(seen)
+
+
+def export_json(log_path: str, json_path: str, run_id: str = None) -> int:
+    """Выгружает результаты запуска в JSON-массив (формат прежнего model_evaluation.json)."""
+    os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+    count = 0
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for record in iter_results(log_path, run_id):
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(record, ensure_ascii=False, indent=2))
+            count += 1
+        f.write("\n]\n")
+    os.replace(tmp_path, json_path)
+    return count
+
+
+class ResultsLog:
+
+    def __init__(self, path: str = DEFAULT_LOG_PATH, run_id: str = DEFAULT_RUN_ID, fsync_every: int = 20):
+        self.path = path
+        self.run_id = run_id
+        self.done = {record.get("question_hash") for record in iter_records(path)
+                     if record.get("run_id") == run_id}
+        self._log = JsonlAppender(path, fsync_every)
+
+    def __contains__(self, question: str) -> bool:
+        return question_hash(question) in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def append(self, result: dict):
+        record = dict(result, run_id=self.run_id, question_hash=question_hash(result["question"]))
+        self._log.write(record)
+        self.done.add(record["question_hash"])
+
+    def close(self):
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,403 @@
+"""
+retrieval_eval.py — оценка только поиска (без LLM): hit@k, recall@k, precision@k при k=1..24
+и задержка поиска для баз general (GeneralAgent) и recipes (CraftAgent)
+
+Запросы — вопросы бенчмарка и, если есть, их переформулировки маршрутизатором
+(--reformulations; --router_url дозапрашивает недостающие у TerrariaRAG._get_reformulated_questions
+и дописывает в тот же файл, чтобы следующие прогоны были воспроизводимыми).
+
+Релевантность:
+    размеченная (--labels, список {"question", "general": [...], "recipes": [...]}):
+        general — документ релевантен, если его metadata["title"] совпадает со строкой
+        из разметки или строка встречается в тексте документа; recipes — название предмета
+        совпадает со строкой из разметки (без учёта регистра и ё/е). recall@k — доля строк
+        разметки, покрытых первыми k результатами;
+    автоматическая (вопросы без разметки):
+        general — документ покрывает не меньше --hit_threshold ключевых слов groundtruth
+        (как в index_sweep.py); recipes — название предмета встречается в вопросе или groundtruth.
+        Полный список релевантного неизвестен, поэтому recall@k здесь относительный: доля
+        релевантных документов из top-max_k, попавших в top-k.
+
+Бюджет агентов считается по тому контексту, который агент действительно отправляет в LLM:
+GeneralAgent достаёт fetch_k=24 окон, выкидывает повторы родительского контекста
+(GeneralAgent._unique_contexts) и оставляет max_docs=8; CraftAgent берёт первые max_recipes=24.
+Для этого списка — доля полезного контекста, доля дубликатов среди fetch_k окон, доля найденного
+в top-max_k релевантного контекста, которая дошла до LLM, и сколько документов (после удаления
+повторов) и окон поиска нужно, чтобы набрать его весь (p50/p95 по запросам).
+
+Использование:
+    python metrics/retrieval_eval.py --stores general recipes --max_k 24
+    python metrics/retrieval_eval.py --labels metrics/retrieval_labels.json --reformulations metrics/out/reformulations.json
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from src.manage_db import get_embeddings
+from src.agent import GeneralAgent
+from metrics.index_sweep import keyword_overlap
+from langchain_chroma import Chroma
+
+logger = logging.getLogger("RetrievalEval")
+
+STORES = {
+    # база: (каталог, агент, документов в контексте агента (src/main.py), окон, которые он достаёт)
+    "general": ("terraria_db/general", "GeneralAgent", 8, 24),   # GeneralAgent: fetch_k = 3 * max_docs
+    "recipes": ("terraria_db/recipes", "CraftAgent", 24, 24),
+}
+
+
+#############################################
+# 0 — Запросы и разметка
+#############################################
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower().replace("ё", "е")).strip()
+
+
+def load_labels(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {item["question"]: item for item in json.load(f)}
+
+
+def load_reformulations(path: str) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fetch_reformulations(questions: list, reformulations: dict, router_url: str, path: str) -> dict:
+    """Дозапрашивает переформулировки у маршрутизатора TerrariaRAG и сохраняет их в path."""
+    from src.TerrariaRAG import TerrariaRAG
+    router = TerrariaRAG(api_url=router_url, agents=[])
+    for item in questions:
+        q = item["question"]
+        if q not in reformulations:
+            reformulations[q] = router._get_reformulated_questions(q)
+            logger.info(f"Переформулировки для '{q}': {reformulations[q]}")
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(reformulations, f, ensure_ascii=False, indent=2)
+    return reformulations
+
+
+def build_queries(questions: list, reformulations: dict, store: str) -> list:
+    agent = STORES[store][1]
+    queries = []
+    for item in questions:
+        queries.append({"item": item, "kind": "question", "query": item["question"]})
+        for request in reformulations.get(item["question"], []):
+            if request.get("name") == agent and request.get("reformulated_question"):
+                queries.append({"item": item, "kind": "reformulated", "query": request["reformulated_question"]})
+    return queries
+
+
+#############################################
+# 1 — Релевантность
+#############################################
+
+def doc_key(doc) -> str:
+    return doc.metadata.get("parent_id") or doc.page_content
+
+
+def matched_targets(store: str, doc, item: dict, labels: dict, hit_threshold: float) -> set:
+    """Какие цели (строки разметки или сам документ) покрывает документ; пустое множество — нерелевантен."""
+    label = labels.get(item["question"], {}).get(store)
+    if store == "general":
+        text = normalize(doc.metadata.get("context", doc.page_content))
+        title = normalize(doc.metadata.get("title", ""))
+        if label is not None:
+            return {s for s in label if normalize(s) == title or normalize(s) in text}
+        relevant = keyword_overlap(item["groundtruth"], doc.page_content) >= hit_threshold
+        return {doc_key(doc)} if relevant else set()
+
+    name = normalize(doc.page_content)
+    if label is not None:
+        return {s for s in label if normalize(s) == name}
+    haystack = normalize(item["question"] + " " + item["groundtruth"])
+    return {name} if len(name) >= 4 and name in haystack else set()
+
+
+#############################################
+# 2 — Прогон базы
+#############################################
+
+def agent_context(store: str, docs: list, max_docs: int, fetch_k: int) -> list:
+    """Документы, которые агент базы отправит в LLM из результатов поиска docs."""
+    if store == "general":
+        return GeneralAgent._unique_contexts(docs[:fetch_k])[:max_docs]
+    return docs[:max_docs]
+
+
+def evaluate_store(store: str, vectorstore, embedding, queries: list, labels: dict,
+                   max_k: int = 24, latency_ks=(1, 8, 24), hit_threshold: float = 0.5) -> list:
+    _, _, max_docs, fetch_k = STORES[store]
+    records = []
+    for query in queries:
+        start = time.perf_counter()
+        vector = embedding.embed_query(query["query"])
+        embed_ms = (time.perf_counter() - start) * 1000
+
+        search_ms = {}
+        for k in latency_ks:
+            start = time.perf_counter()
+            vectorstore.similarity_search_by_vector(vector, k=k)
+            search_ms[k] = (time.perf_counter() - start) * 1000
+        docs = vectorstore.similarity_search_by_vector(vector, k=max(max_k, fetch_k))
+
+        item = query["item"]
+        label = labels.get(item["question"], {}).get(store)
+        seen_docs, seen_targets = set(), set()
+        relevant_at, new_target_at, duplicate_at = [], [], []
+        # position — номер документа после удаления повторов (так его видит GeneralAgent)
+        for rank, doc in enumerate(docs[:max_k], start=1):
+            key = doc_key(doc)
+            if key in seen_docs:
+                duplicate_at.append(rank)
+                continue
+            seen_docs.add(key)
+            targets = matched_targets(store, doc, item, labels, hit_threshold)
+            if targets:
+                relevant_at.append(rank)
+            if targets - seen_targets:
+                new_target_at.append((rank, len(seen_docs), len(targets - seen_targets)))
+                seen_targets |= targets
+
+        sent_targets, sent_relevant = set(), 0
+        sent = agent_context(store, docs, max_docs, fetch_k)
+        for doc in sent:
+            targets = matched_targets(store, doc, item, labels, hit_threshold)
+            sent_relevant += bool(targets)
+            sent_targets |= targets
+        fetched = docs[:fetch_k]
+
+        records.append({
+            "store": store,
+            "question": item["question"],
+            "complexity": item.get("complexity"),
+            "kind": query["kind"],
+            "query": query["query"],
+            "labeled": label is not None,
+            "targets": len(label) if label is not None else len(seen_targets),
+            "results": len(docs),
+            "relevant_at": relevant_at,
+            "new_target_at": new_target_at,
+            "duplicate_at": duplicate_at,
+            "fetched": len(fetched),
+            "fetched_duplicates": len(fetched) - len({doc_key(doc) for doc in fetched}),
+            "sent": len(sent),
+            "sent_relevant": sent_relevant,
+            "sent_targets": len(sent_targets & seen_targets),
+            "embed_ms": round(embed_ms, 2),
+            "search_ms": {str(k): round(ms, 2) for k, ms in search_ms.items()},
+        })
+    return records
+
+
+def per_k_metrics(records: list, max_k: int) -> list:
+    rows = []
+    for k in range(1, max_k + 1):
+        hits, recalls, precisions = [], [], []
+        for r in records:
+            hits.append(any(rank <= k for rank in r["relevant_at"]))
+            covered = sum(n for rank, _, n in r["new_target_at"] if rank <= k)
+            recalls.append(covered / r["targets"] if r["targets"] else 0.0)
+            precisions.append(sum(rank <= k for rank in r["relevant_at"]) / k)
+        rows.append({
+            "k": k,
+            "hit": round(float(np.mean(hits)), 3),
+            "recall": round(float(np.mean(recalls)), 3),
+            "precision": round(float(np.mean(precisions)), 3),
+        })
+    return rows
+
+
+def budget_summary(records: list, max_docs: int, fetch_k: int) -> dict:
+    """Бюджет по контексту, который агент отправляет в LLM (см. agent_context)."""
+    # сколько документов (после удаления повторов) и окон поиска нужно, чтобы набрать весь
+    # релевантный контекст из top-max_k (запросы без попаданий не учитываются)
+    with_hits = [r for r in records if r["new_target_at"]]
+    docs_needed = [r["new_target_at"][-1][1] for r in with_hits]
+    fetch_needed = [r["new_target_at"][-1][0] for r in with_hits]
+    found = sum(sum(n for _, _, n in r["new_target_at"]) for r in with_hits)
+    return {
+        "max_docs": max_docs,
+        "fetch_k": fetch_k,
+        "sent_per_query": round(float(np.mean([r["sent"] for r in records])), 2),
+        "useful_share": round(float(np.mean([r["sent_relevant"] for r in records])) / max_docs, 3),
+        "useful_per_query": round(float(np.mean([r["sent_relevant"] for r in records])), 2),
+        "duplicate_share": round(float(np.sum([r["fetched_duplicates"] for r in records]))
+                                 / max(sum(r["fetched"] for r in records), 1), 3),
+        "found_sent_share": round(sum(r["sent_targets"] for r in with_hits) / found, 3) if found else None,
+        "queries_with_hits": len(with_hits),
+        "docs_needed_p50": int(np.percentile(docs_needed, 50)) if docs_needed else None,
+        "docs_needed_p95": int(np.ceil(np.percentile(docs_needed, 95))) if docs_needed else None,
+        "fetch_needed_p50": int(np.percentile(fetch_needed, 50)) if fetch_needed else None,
+        "fetch_needed_p95": int(np.ceil(np.percentile(fetch_needed, 95))) if fetch_needed else None,
+    }
+
+
+def latency_summary(records: list) -> dict:
+    summary = {
+        "embed_p50_ms": round(float(np.percentile([r["embed_ms"] for r in records], 50)), 2),
+        "embed_p95_ms": round(float(np.percentile([r["embed_ms"] for r in records], 95)), 2),
+    }
+    for k in records[0]["search_ms"]:
+        values = [r["search_ms"][k] for r in records]
+        summary[f"search_k{k}_p50_ms"] = round(float(np.percentile(values, 50)), 2)
+        summary[f"search_k{k}_p95_ms"] = round(float(np.percentile(values, 95)), 2)
+    return summary
+
+
+#############################################
+# 3 — Отчёт
+#############################################
+
+def print_report(summary: dict, show_ks=(1, 2, 4, 8, 12, 16, 24)):
+    for store, result in summary.items():
+        for kind, block in result["by_kind"].items():
+            print(f"\n📊 {store} / {kind}: {block['queries']} queries ({block['labeled']} labeled)")
+            print(f"{'k':>4} {'hit':>6} {'recall':>7} {'prec':>6}")
+            for row in block["per_k"]:
+                if row["k"] in show_ks:
+                    print(f"{row['k']:>4} {row['hit']:>6.3f} {row['recall']:>7.3f} {row['precision']:>6.3f}")
+            b = block["budget"]
+            found_sent = "-" if b["found_sent_share"] is None else f"{b['found_sent_share']:.1%}"
+            print(f"  agent context max_docs={b['max_docs']} (fetch_k={b['fetch_k']}, sent {b['sent_per_query']} per query): "
+                  f"useful {b['useful_share']:.1%} ({b['useful_per_query']} per query), "
+                  f"duplicates in fetch {b['duplicate_share']:.1%}, found context sent {found_sent}")
+            print(f"  full recall at docs p50={b['docs_needed_p50']} p95={b['docs_needed_p95']}, "
+                  f"fetched windows p50={b['fetch_needed_p50']} p95={b['fetch_needed_p95']}")
+        print(f"  ⏱ latency: {result['latency']}")
+
+
+def save_report(summary: dict, records: list, out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(out_dir, "queries.jsonl"), "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    with open(os.path.join(out_dir, "per_k.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["store", "kind", "k", "hit", "recall", "precision"])
+        writer.writeheader()
+        for store, result in summary.items():
+            for kind, block in result["by_kind"].items():
+                for row in block["per_k"]:
+                    writer.writerow({"store": store, "kind": kind, **row})
+
+    for store, result in summary.items():
+        plt.figure(figsize=(12, 6))
+        for kind, block in result["by_kind"].items():
+            ks = [row["k"] for row in block["per_k"]]
+            for metric, style in (("hit", "-"), ("recall", "--"), ("precision", ":")):
+                plt.plot(ks, [row[metric] for row in block["per_k"]], style, marker=".", label=f"{kind} {metric}@k")
+        plt.axvline(result["fetch_k"], color="grey", alpha=0.6, label=f"fetch_k={result['fetch_k']}")
+        plt.xlabel("k")
+        plt.ylabel("Share")
+        plt.title(f"Поиск по базе {store}")
+        plt.legend()
+        plt.grid(alpha=0.3)
+        plt.tight_layout()
+        plt.savefig(os.path.join(out_dir, f"{store}_at_k.png"))
+        plt.close()
+
+
+#############################################
+# 4 — Запуск
+#############################################
+
+def retrieval_eval(stores=("general", "recipes"),
+                   questions_path: str = "metrics/benchmark_questions.json",
+                   labels_path: str = None,
+                   reformulations_path: str = None,
+                   router_url: str = None,
+                   max_k: int = 24,
+                   latency_ks=(1, 8, 24),
+                   hit_threshold: float = 0.5,
+                   embedding_model: str = "intfloat/multilingual-e5-large",
+                   use_cuda: bool = True,
+                   out_dir: str = "metrics/out/retrieval_eval") -> dict:
+    with open(questions_path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    labels = load_labels(labels_path)
+    reformulations = load_reformulations(reformulations_path)
+    if router_url:
+        reformulations = fetch_reformulations(questions, reformulations, router_url, reformulations_path)
+
+    embedding = get_embeddings(embedding_model, use_cuda)
+    embedding.embed_query("прогрев")
+
+    summary, all_records = {}, []
+    for store in stores:
+        persist_directory, _, max_docs, fetch_k = STORES[store]
+        vectorstore = Chroma(persist_directory=persist_directory, embedding_function=embedding)
+        vectorstore.similarity_search("Terraria", k=1)  # первый запрос поднимает HNSW-индекс с диска
+
+        records = evaluate_store(store, vectorstore, embedding, build_queries(questions, reformulations, store),
+                                 labels, max_k, latency_ks, hit_threshold)
+        all_records.extend(records)
+        by_kind = {}
+        for kind in ("question", "reformulated"):
+            kind_records = [r for r in records if r["kind"] == kind]
+            if kind_records:
+                by_kind[kind] = {
+                    "queries": len(kind_records),
+                    "labeled": sum(r["labeled"] for r in kind_records),
+                    "per_k": per_k_metrics(kind_records, max_k),
+                    "budget": budget_summary(kind_records, max_docs, fetch_k),
+                }
+        summary[store] = {"max_docs": max_docs, "fetch_k": fetch_k, "by_kind": by_kind,
+                          "latency": latency_summary(records)}
+
+    print_report(summary)
+    save_report(summary, all_records, out_dir)
+    print(f"\n✅ Results written to {out_dir}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval-only hit/recall@k and latency for the general and recipes stores.")
+    parser.add_argument("--stores", type=str, nargs="+", default=["general", "recipes"], choices=list(STORES))
+    parser.add_argument("--questions", type=str, default="metrics/benchmark_questions.json")
+    parser.add_argument("--labels", type=str, default=None, help="JSON list of {question, general: [...], recipes: [...]}.")
+    parser.add_argument("--reformulations", type=str, default=None, help="JSON {question: router output}; read and extended.")
+    parser.add_argument("--router_url", type=str, default=None, help="LLM URL to fetch missing reformulations from.")
+    parser.add_argument("--max_k", type=int, default=24, help="Deepest k to evaluate.")
+    parser.add_argument("--latency_ks", type=int, nargs="+", default=[1, 8, 24], help="k values to time the search at.")
+    parser.add_argument("--hit_threshold", type=float, default=0.5, help="Groundtruth keyword share for unlabeled general hits.")
+    parser.add_argument("--embedding_model", type=str, default="intfloat/multilingual-e5-large")
+    parser.add_argument("--cpu", action="store_true", help="Do not use CUDA even if it is available.")
+    parser.add_argument("--out_dir", type=str, default="metrics/out/retrieval_eval")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    retrieval_eval(
+        stores=args.stores,
+        questions_path=args.questions,
+        labels_path=args.labels,
+        reformulations_path=args.reformulations,
+        router_url=args.router_url,
+        max_k=args.max_k,
+        latency_ks=args.latency_ks,
+        hit_threshold=args.hit_threshold,
+        embedding_model=args.embedding_model,
+        use_cuda=not args.cpu,
+        out_dir=args.out_dir,
+    )
@@ -0,0 +1,329 @@
+"""
+stub_llm.py — заглушка Ollama /api/generate для офлайн-тестов производительности
+
+Реализует тот же контракт, что и Ollama:
+    "stream": false — один JSON {"model", "created_at", "response", "done": true, ...};
+    "stream": true (по умолчанию, как в Ollama) — NDJSON: по строке на токен и финальная
+    строка с "done": true.
+В финальном ответе есть поля статистики Ollama (total_duration, load_duration,
+prompt_eval_count, prompt_eval_duration, eval_count, eval_duration; длительности в нс).
+Запрос без промпта (keep-alive из TerrariaRAG._ping_llm) только "загружает модель".
+
+Шаг конвейера узнаётся по промпту (detect_stage): маршрутизатору (_get_reformulated_questions)
+возвращается валидный JSON с агентами, агентам и объединению — текст. Шаблоны ответов можно
+переопределить JSON-файлом {шаг: текст}, в тексте доступны {query} и {stage}.
+
+Задержка детерминированная: latency до первого токена + prefill_per_1k секунд на каждую
+тысячу токенов промпта + token_latency на каждый токен ответа (токен ≈ 4 символа промпта
+или одно слово ответа). Ошибки: error_rate — доля ответов HTTP 500, timeout_rate — доля
+запросов, которые висят timeout_sleep секунд и обрываются без ответа; выбор случайный,
+но воспроизводимый по seed. Каждый запрос можно писать в JSONL-журнал (log_path).
+
+Использование:
+    python metrics/stub_llm.py --port 11435 --latency 0.2 --prefill_per_1k 0.3 --token_latency 0.02
+    python metrics/stub_llm.py --error_rate 0.05 --timeout_rate 0.01 --log metrics/out/stub_llm.jsonl
+    RAG_LLM_URL=http://127.0.0.1:11435/api/generate uvicorn src.api:app
+"""
+
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("StubLLM")
+
+ROUTING_MARKER = "каких агентов нужно привлечь"
+MERGE_MARKER = "Сформулировать единый"
+CRAFT_MARKER = "находить рецепты крафта"
+QUERY_PREFIX = "Запрос пользователя: "
+QUERY_SUFFIX_PREFIX = "Ответь на запрос: "
+MERGE_QUERY_PREFIX = "Начальный вопрос пользователя: "
+
+CHARS_PER_TOKEN = 4
+
+DEFAULT_TEMPLATES = {
+    "GeneralAgent": "Ответ заглушки GeneralAgent на вопрос «{query}». "
+                    "В документах есть нужные сведения, подробности приведены ниже.",
+    "CraftAgent": "Ответ заглушки CraftAgent: рецепт для «{query}» — верстак, компоненты x1.",
+    "merge": "Итоговый ответ заглушки на вопрос «{query}», собранный из ответов агентов.",
+}
+
+
+def detect_stage(prompt: str) -> str:
+    if ROUTING_MARKER in prompt:
+        return "routing"
+    if MERGE_MARKER in prompt:
+        return "merge"
+    if CRAFT_MARKER in prompt:
+        return "CraftAgent"
+    return "GeneralAgent"
+
+
+def extract_query(prompt: str, stage: str) -> str:
+    prefix = {"routing": QUERY_PREFIX, "merge": MERGE_QUERY_PREFIX}.get(stage, QUERY_SUFFIX_PREFIX)
+    return prompt.rsplit(prefix, 1)[-1].strip() if prefix in prompt else ""
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def stub_response(prompt: str, agents=("GeneralAgent",), templates: dict = None) -> str:
+    stage = detect_stage(prompt)
+    query = extract_query(prompt, stage)
+    template = (templates or {}).get(stage)
+    if stage == "routing" and template is None:
+        return json.dumps({"agents": [{"name": name, "reformulated_question": query} for name in agents]},
+                          ensure_ascii=False)
+    template = template or DEFAULT_TEMPLATES.get(stage, "Ответ заглушки ({stage}).")
+    return template.replace("{query}", query).replace("{stage}", stage)
+
+
+class StubLLM:
+    """Состояние заглушки: настройки задержек и ошибок, генератор случайных чисел, журнал запросов."""
+
+    def __init__(self,
+                 latency: float = 0.5,
+                 prefill_per_1k: float = 0.0,
+                 token_latency: float = 0.0,
+                 load_latency: float = 0.0,
+                 agents=("GeneralAgent",),
+                 templates: dict = None,
+                 error_rate: float = 0.0,
+                 timeout_rate: float = 0.0,
+                 timeout_sleep: float = 30.0,
+                 seed: int = 42,
+                 log_path: str = None):
+        self.latency = latency
+        self.prefill_per_1k = prefill_per_1k
+        self.token_latency = token_latency
+        self.load_latency = load_latency
+        self.agents = tuple(agents)
+        self.templates = templates or {}
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_sleep = timeout_sleep
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.requests = 0
+        self.log_file = open(log_path, "a", encoding="utf-8") if log_path else None
+
+    def fault(self) -> str:
+        """None, "error" или "timeout" для очередного запроса."""
+        with self.lock:
+            roll = self.rng.random()
+        if roll < self.error_rate:
+            return "error"
+        if roll < self.error_rate + self.timeout_rate:
+            return "timeout"
+        return None
+
+    def take_load_latency(self) -> float:
+        """Первый запрос после старта "загружает модель" (load_duration у Ollama)."""
+        with self.lock:
+            if self.loaded:
+                return 0.0
+            self.loaded = True
+            return self.load_latency
+
+    def prefill_seconds(self, prompt_tokens: int) -> float:
+        return self.latency + self.prefill_per_1k * prompt_tokens / 1000
+
+    def log(self, record: dict):
+        with self.lock:
+            self.requests += 1
+            if self.log_file:
+                self.log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.log_file.flush()
+
+    def close(self):
+        if self.log_file:
+            self.log_file.close()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # Ollama отвечает на / строкой "Ollama is running", на /api/tags — списком моделей
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json(200, {"models": [{"name": "qwen3:8b", "model": "qwen3:8b"}]})
+        elif self.path in ("", "/"):
+            self._send_body(200, b"Ollama is running", "text/plain")
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        stub = self.server.stub
+        started = time.perf_counter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_json(400, {"error": f"invalid JSON: {e}"})
+            return
+
+        prompt = body.get("prompt") or ""
+        stream = body.get("stream", True)
+        stage = detect_stage(prompt) if prompt else "load"
+        record = {"time": _now(), "stage": stage, "stream": stream, "prompt_chars": len(prompt)}
+
+        fault = stub.fault() if prompt else None
+        if fault == "timeout":
+            time.sleep(stub.timeout_sleep)
+            record.update(status="timeout", seconds=round(time.perf_counter() - started, 4))
+            stub.log(record)
+            self.close_connection = True
+            return
+        if fault == "error":
+            self._send_json(500, {"error": "injected error"})
+            record.update(status=500, seconds=round(time.perf_counter() - started, 4))
+            stub.log(record)
+            return
+
+        load_seconds = stub.take_load_latency()
+        time.sleep(load_seconds)
+        model = body.get("model", "stub")
+
+        if not prompt:
+            # keep-alive: модель загружена, генерации нет
+            self._send_json(200, {"model": model, "created_at": _now(), "response": "", "done": True,
+                                  "done_reason": "load"})
+            record.update(status=200, seconds=round(time.perf_counter() - started, 4))
+            stub.log(record)
+            return
+
+        prompt_tokens = count_tokens(prompt)
+        prefill = stub.prefill_seconds(prompt_tokens)
+        time.sleep(prefill)
+        tokens = self._tokens(stub_response(prompt, stub.agents, stub.templates))
+
+        decode_start = time.perf_counter()
+        if stream:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(stub.token_latency)
+                self._write_chunk({"model": model, "created_at": _now(), "response": token, "done": False})
+        else:
+            time.sleep(stub.token_latency * len(tokens))
+        decode_seconds = time.perf_counter() - decode_start
+
+        final = {
+            "model": model,
+            "created_at": _now(),
+            "response": "" if stream else "".join(tokens),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int(decode_seconds * 1e9),
+        }
+        if stream:
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send_json(200, final)
+        record.update(status=200, prompt_tokens=prompt_tokens, eval_tokens=len(tokens),
+                      seconds=round(time.perf_counter() - started, 4))
+        stub.log(record)
+
+    @staticmethod
+    def _tokens(text: str) -> list:
+        # "токен" заглушки — слово вместе с пробелом перед ним, склейка даёт исходный текст
+        words = text.split(" ")
+        return [words[0]] + [" " + word for word in words[1:]] if text else []
+
+    def _write_chunk(self, payload: dict):
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: dict):
+        self._send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send_body(self, status: int, data: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.5,
+                      agents=("GeneralAgent",), **options) -> ThreadingHTTPServer:
+    """
+    Запускает заглушку в фоновом потоке. port=0 — свободный порт; адрес в server.url.
+    options — остальные параметры StubLLM (prefill_per_1k, token_latency, error_rate, ...).
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.stub = StubLLM(latency=latency, agents=agents, **options)
+    server.url = f"http://{host}:{server.server_address[1]}/api/generate"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_templates(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for the Ollama /api/generate endpoint.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token.")
+    parser.add_argument("--prefill_per_1k", type=float, default=0.0, help="Extra seconds per 1000 prompt tokens.")
+    parser.add_argument("--token_latency", type=float, default=0.0, help="Seconds per generated token.")
+    parser.add_argument("--load_latency", type=float, default=0.0, help="One-off model load delay on the first request.")
+    parser.add_argument("--agents", type=str, nargs="+", default=["GeneralAgent"], help="Agents the router picks.")
+    parser.add_argument("--templates", type=str, default=None, help="JSON file {stage: response template}.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Share of requests answered with HTTP 500.")
+    parser.add_argument("--timeout_rate", type=float, default=0.0, help="Share of requests that hang and drop.")
+    parser.add_argument("--timeout_sleep", type=float, default=30.0, help="How long a 'timeout' request hangs.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for error injection.")
+    parser.add_argument("--log", type=str, default=None, help="Append one JSON line per request here.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = start_stub_server(
+        args.host, args.port, args.latency, args.agents,
+        prefill_per_1k=args.prefill_per_1k,
+        token_latency=args.token_latency,
+        load_latency=args.load_latency,
+        templates=load_templates(args.templates),
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_sleep=args.timeout_sleep,
+        seed=args.seed,
+        log_path=args.log,
+    )
+    logger.info(f"Заглушка LLM слушает {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.stub.close()
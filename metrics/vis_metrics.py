@@ -1,20 +1,18 @@
 import os
 import sys
-import json
+import argparse
 from collections import defaultdict
 import matplotlib.pyplot as plt
 import numpy as np
 
-def load_results(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
+from results_log import iter_results, load_results
 
 def analyze_scores(results):
     rag_scores = []
     baseline_scores = []
     complexity_dict = defaultdict(list)
 
+    # results может быть генератором (потоковое чтение журнала .jsonl)
     for item in results:
         eval_data = item.get("evaluation", {})
         rag = eval_data.get("rag_score", 0)
@@ -27,7 +25,7 @@ def analyze_scores(results):
 
     # Подсчёт количеств
     counts = {
-        "all": len(results),
+        "all": len(rag_scores),
         "easy": len(complexity_dict.get("easy", [])),
         "medium": len(complexity_dict.get("medium", [])),
         "hard": len(complexity_dict.get("hard", [])),
@@ -50,6 +48,25 @@ def analyze_scores(results):
 
     return stats, counts
 
+def analyze_llm_usage(results):
+    """Средние токены и время LLM на вопрос по шагам RAG (поле rag_trace результатов)."""
+    totals = defaultdict(lambda: defaultdict(float))
+    questions = 0
+    for item in results:
+        trace = item.get("rag_trace")
+        if not trace:
+            continue
+        questions += 1
+        for stage, stats in trace.get("llm", {}).items():
+            for field in ("llm_calls", "prompt_tokens", "completion_tokens", "prefill_s", "decode_s", "model_loads"):
+                totals[stage][field] += stats.get(field, 0) or 0
+    usage = {}
+    for stage, sums in totals.items():
+        usage[stage] = {field: value / questions for field, value in sums.items()}
+        usage[stage]["prefill_tps"] = sums["prompt_tokens"] / sums["prefill_s"] if sums["prefill_s"] else None
+        usage[stage]["decode_tps"] = sums["completion_tokens"] / sums["decode_s"] if sums["decode_s"] else None
+    return usage, questions
+
 def plot_grouped_bars(stats, counts, out_dir):
     os.makedirs(out_dir, exist_ok=True)
 
@@ -75,20 +92,26 @@ def plot_grouped_bars(stats, counts, out_dir):
     plt.close()
 
 def main():
-    if len(sys.argv) < 2:
-        print("Использование: python3 metrics/vis_metrics.py <path_to_results.json>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Plot RAG vs baseline scores from a results log (.jsonl) or export (.json).")
+    parser.add_argument("file_path", help="metrics/out/model_evaluation.jsonl or an exported .json")
+    parser.add_argument("--run_id", type=str, default=None, help="Run to plot from a .jsonl log (default: all runs).")
+    args = parser.parse_args()
 
-    file_path = sys.argv[1]
+    file_path = args.file_path
     if not os.path.exists(file_path):
         print(f"Файл не найден: {file_path}")
         sys.exit(1)
 
-    results = load_results(file_path)
+    if file_path.endswith(".jsonl"):
+        results = iter_results(file_path, args.run_id)
+    else:
+        results = load_results(file_path)
 
     stats, counts = analyze_scores(results)
 
     base_name = os.path.splitext(os.path.basename(file_path))[0]
+    if args.run_id:
+        base_name += f"_{args.run_id}"
     out_dir = os.path.join(os.path.dirname(file_path), base_name)
 
     plot_grouped_bars(stats, counts, out_dir)
@@ -98,5 +121,16 @@ def main():
     for k, v in counts.items():
         print(f"{k}: {v}")
 
+    # генератор журнала уже прочитан analyze_scores — читаем ещё раз
+    results = iter_results(file_path, args.run_id) if file_path.endswith(".jsonl") else results
+    usage, questions = analyze_llm_usage(results)
+    if usage:
+        print(f"\nLLM на вопрос по шагам RAG ({questions} вопросов с трассой):")
+        print(f"{'stage':<28} {'calls':>6} {'prompt':>8} {'output':>8} {'prefill s':>10} {'decode s':>9} {'prefill t/s':>12} {'decode t/s':>11}")
+        for stage, u in sorted(usage.items()):
+            fmt = lambda v: f"{v:.1f}" if v is not None else "-"
+            print(f"{stage:<28} {u['llm_calls']:>6.2f} {u['prompt_tokens']:>8.0f} {u['completion_tokens']:>8.0f} "
+                  f"{u['prefill_s']:>10.2f} {u['decode_s']:>9.2f} {fmt(u['prefill_tps']):>12} {fmt(u['decode_tps']):>11}")
+
 if __name__ == "__main__":
     main()
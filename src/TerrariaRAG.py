@@ -1,10 +1,16 @@
 import os
+import time
 from dotenv import load_dotenv
 from typing import Any
 
 import requests
 import logging
 
+try:
+    from .tracing import Trace, maybe_span, llm_stats
+except ImportError:
+    from tracing import Trace, maybe_span, llm_stats
+
 logger = logging.getLogger('RAG_TerrariaRAG')
 
 
@@ -194,12 +200,22 @@ class TerrariaRAG:
         self.api_url = api_url
         self.agents = agents
         self.message_history = []
+        self.temperature = None  # None — температура по умолчанию на бэкенде
         self.set_api_key()
 
     def set_temperature(self, temperature):
+        """Температура для всех запросов к LLM: маршрутизации, агентов и объединения ответов."""
         if not (0.0 <= temperature <= 1.0):
             raise ValueError("Temperature must be between 0.0 and 1.0")
         self.temperature = temperature
+        for agent in self.agents:
+            agent.temperature = temperature
+
+    def _llm_options(self) -> dict:
+        options = {"num_ctx": 64000}
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        return options
 
     def set_api_key(self):
         load_dotenv()
@@ -207,7 +223,52 @@ class TerrariaRAG:
         if not self.api_key:
             raise ValueError("API_KEY not found in environment variables.")
 
-    def _get_reformulated_questions(self, query):
+    def warm_up(self, ping_llm: bool = False) -> dict:
+        """
+        Прогревает систему до первого настоящего запроса: пробный эмбеддинг,
+        поиск в базе каждого агента и, опционально, keep-alive запрос к LLM,
+        чтобы бэкенд загрузил модель. Возвращает длительности шагов в секундах.
+        """
+        timings = {}
+
+        embeddings = next((a.embeddings for a in self.agents if getattr(a, "embeddings", None) is not None), None)
+        if embeddings is not None:
+            start = time.perf_counter()
+            embeddings.embed_query("прогрев")
+            timings["warmup_embed"] = round(time.perf_counter() - start, 3)
+
+        for agent in self.agents:
+            start = time.perf_counter()
+            agent.warm_up()
+            timings[f"warmup_{agent.name}"] = round(time.perf_counter() - start, 3)
+
+        if ping_llm:
+            start = time.perf_counter()
+            self._ping_llm()
+            timings["warmup_llm"] = round(time.perf_counter() - start, 3)
+
+        for name, duration in timings.items():
+            logger.info(f"Фаза '{name}' заняла {duration:.2f} с")
+        return timings
+
+    def _ping_llm(self, keep_alive: str = "30m"):
+        """
+        Запрос без промпта: Ollama только загружает модель и держит её keep_alive.
+        """
+        response = requests.post(
+            self.api_url,
+            headers={"Content-Type": "application/json"},
+            json={
+                "model": "qwen3:8b",
+                "keep_alive": keep_alive,
+                "stream": False
+            }
+        )
+
+        if response.status_code != 200:
+            raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
+
+    def _get_reformulated_questions(self, query, trace: Trace = None):
         """
         Получает переформулированные вопросы для каждого агента.
         """
@@ -221,20 +282,21 @@ class TerrariaRAG:
             "model":"qwen3:8b",
             "prompt":"{system}\n{user}".format(system=system_prompt, user=user_prompt),
             "stream": False,
-            "options":{
-                "num_ctx":64000
-                }
+            "options": self._llm_options()
             }
-        response = requests.post(
-            self.api_url,
-            headers=headers,
-            json=json
-            )
+        with maybe_span(trace, "routing", prompt_chars=len(json["prompt"])) as span:
+            response = requests.post(
+                self.api_url,
+                headers=headers,
+                json=json
+                )
 
-        if response.status_code != 200:
-            raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
+            if response.status_code != 200:
+                raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
 
-        response = response.json().get('response', '')
+            payload = response.json()
+            response = payload.get('response', '')
+            span.update(llm_stats(payload), response_chars=len(response))
 
         # Парсинг ответа для получения списка агентов и вопросов
 
@@ -260,7 +322,7 @@ class TerrariaRAG:
 
         return agent_requests
 
-    def _get_agents_responses(self, agent_requests):
+    def _get_agents_responses(self, agent_requests, trace: Trace = None):
         """
         Получает ответы от всех агентов на переформулированные вопросы.
         """
@@ -274,7 +336,7 @@ class TerrariaRAG:
             # Поиск агента по имени
             agent = next((a for a in self.agents if a.name == agent_name), None)
             if agent:
-                agent_response_raw, _ = agent.call(reformulated_question)
+                agent_response_raw, _ = agent.call(reformulated_question, trace=trace)
                 agent_response = {
                     agent_name: agent_response_raw
                 }
@@ -283,7 +345,7 @@ class TerrariaRAG:
 
         return agent_responses
 
-    def _build_final_answer(self, agents_responses, query):
+    def _build_final_answer(self, agents_responses, query, trace: Trace = None):
         """
         Строит окончательный ответ на основе ответов агентов.
         Учитывает специализацию каждого агента.
@@ -294,39 +356,52 @@ class TerrariaRAG:
         headers = {
             "Content-Type": "application/json"
         }
-        response = requests.post(
-            self.api_url,
-            headers=headers,
-            json= {
-                "model":"qwen3:8b",
-                "prompt":"{system}\n{user}".format(system=system_prompt, user=user_prompt),
-                "stream": False,
-                "options":{
-                    "num_ctx":64000
+        prompt = "{system}\n{user}".format(system=system_prompt, user=user_prompt)
+
+        with maybe_span(trace, "merge", prompt_chars=len(prompt)) as span:
+            response = requests.post(
+                self.api_url,
+                headers=headers,
+                json= {
+                    "model":"qwen3:8b",
+                    "prompt":prompt,
+                    "stream": False,
+                    "options": self._llm_options()
                     }
-                }
-            )
+                )
 
-        if response.status_code != 200:
-            raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
+            if response.status_code != 200:
+                raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
 
-        final_answer = response.json().get('response', '')
+            payload = response.json()
+            final_answer = payload.get('response', '')
+            span.update(llm_stats(payload), response_chars=len(final_answer))
         return final_answer
 
-    def run(self, query: str) -> str:
+    def run(self, query: str, timings: dict = None, trace: Trace = None) -> str:
         """
         Основной метод для генерации ответа на пользовательский запрос.
+        Шаги запроса (routing, retrieval и generation каждого агента, merge) пишутся в trace;
+        если передан timings, в него складываются их длительности в секундах:
+        routing, <агент>.retrieval, <агент>.generation, merge.
         """
-        # logger.info(f"Запрос пользователя: \n{query}\n" + "=" * 50)
-        agent_requests = self._get_reformulated_questions(query)
-        # logger.info(f"Переформулированные вопросы агентам: \n{agent_requests}\n" + "=" * 40)
-        agents_responses = self._get_agents_responses(agent_requests)
-        agents_responses_with_query = [{"Query": query}] + agents_responses
-        # logger.info(f"Ответы агентов: ")
-        for response in agents_responses_with_query:
-            if response.get("Query") is not None:
-                continue
-            for agent_name, answer in response.items():
-                logger.info(f"{agent_name} ответил: \n{answer}\n")
-        final_answer = self._build_final_answer(agents_responses_with_query, query)
+        trace = Trace() if trace is None else trace
+        try:
+            # logger.info(f"Запрос пользователя: \n{query}\n" + "=" * 50)
+            agent_requests = self._get_reformulated_questions(query, trace)
+            # logger.info(f"Переформулированные вопросы агентам: \n{agent_requests}\n" + "=" * 40)
+            agents_responses = self._get_agents_responses(agent_requests, trace)
+            agents_responses_with_query = [{"Query": query}] + agents_responses
+            # logger.info(f"Ответы агентов: ")
+            for response in agents_responses_with_query:
+                if response.get("Query") is not None:
+                    continue
+                for agent_name, answer in response.items():
+                    logger.info(f"{agent_name} ответил: \n{answer}\n")
+            final_answer = self._build_final_answer(agents_responses_with_query, query, trace)
+        finally:
+            trace.finish()
+            if timings is not None:
+                for name, seconds in trace.durations().items():
+                    timings[name] = timings.get(name, 0.0) + seconds
         return final_answer
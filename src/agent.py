@@ -5,9 +5,17 @@ import requests
 import abc
 import logging
 
+try:
+    from .tracing import Trace, maybe_span, llm_stats
+    from .hnsw import collection_hnsw
+except ImportError:
+    from tracing import Trace, maybe_span, llm_stats
+    from hnsw import collection_hnsw
+
 
 logger = logging.getLogger('RAG_Agent')
 
+
 class MistralLLM:
     """
     Обертка для клиента Mistral.
@@ -111,11 +119,36 @@ class Agent(abc.ABC):
     def __init__(self, name: str, api_url: str):
         self.name = name
         self.api_url = api_url
+        self.temperature = None  # None — температура по умолчанию на бэкенде
+
+    def _llm_options(self) -> Dict[str, Any]:
+        options = {"num_ctx": 64000}
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        return options
 
     @abc.abstractmethod
-    def call(self, query: str, **kwargs) -> Dict[str, Any]:
+    def call(self, query: str, trace: Optional[Trace] = None, **kwargs) -> Dict[str, Any]:
         raise NotImplementedError()
 
+    def warm_up(self) -> None:
+        """
+        Делает пробный поиск: первый запрос к Chroma поднимает HNSW-индекс с диска.
+        """
+        self.retriever._get_relevant_documents("Terraria", run_manager=None)
+
+    def _check_search_ef(self, search_ef: Optional[int]) -> None:
+        """
+        Сверяет ef поиска базы с search_ef из манифеста баз (None — не проверять).
+        Агент базу не меняет: ef сохраняется на диске, его задают build-all и manage_db set-search-ef.
+        """
+        if search_ef is None:
+            return
+        stored = collection_hnsw(self.vectorstore._collection).get("ef_search")
+        if stored != search_ef:
+            logger.warning(f"{self.name}: ef поиска базы {stored}, а в манифесте {search_ef}; "
+                           f"поменять: manage_db.py set-search-ef --search_ef {search_ef}")
+
 
 class CraftAgent(Agent):
     """
@@ -141,13 +174,15 @@ class CraftAgent(Agent):
             api_url: str,
             recipes: Any,
             embeddings: Optional[Any] = None,
-            max_recipes: int = 5
+            max_recipes: int = 5,
+            search_ef: Optional[int] = None
             ):
         super().__init__(name, api_url)
         self.recipes = recipes
         self.max_recipes = max_recipes
         self.embeddings = embeddings
         self.vectorstore = Chroma(persist_directory="./terraria_db/recipes", embedding_function=self.embeddings)
+        self._check_search_ef(search_ef)
         self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": self.max_recipes})
 
     def _get_recipes_context(self, item_names: List[str]) -> str:
@@ -170,7 +205,7 @@ class CraftAgent(Agent):
 
         return "\n".join(contexts) if contexts else "Рецепты не найдены."
 
-    def call(self, query: str) -> Dict[str, Any]:
+    def call(self, query: str, trace: Optional[Trace] = None) -> Dict[str, Any]:
         """
         Поведение:
         - Достаёт из Chroma DB k наиболее подходящих названий предметов для крафта
@@ -178,33 +213,37 @@ class CraftAgent(Agent):
         - Полученные рецепты передаёт в пропмт LLM для генерации ответа
         """
 
-        docs = self.retriever._get_relevant_documents(query, run_manager=None)
-        item_names = "\n".join([d.page_content for d in docs])
+        with maybe_span(trace, "retrieval", agent=self.name) as span:
+            docs = self.retriever._get_relevant_documents(query, run_manager=None)
+            item_names = "\n".join([d.page_content for d in docs])
 
-        context = self._get_recipes_context(item_names.split("\n"))
+            context = self._get_recipes_context(item_names.split("\n"))
+            span.update(docs=len(docs), context_chars=len(context))
         # logger.info(f"CraftAgent контекст для запроса '{query}': \n{context}\n")
 
         headers = {
             "Content-Type": "application/json"
         }
-
-        response = requests.post(
-            self.api_url,
-            headers=headers,
-            json= {
-                "model":"qwen3:8b",
-                "prompt":f"{CraftAgent.SYSTEM_PROMPT}\n{CraftAgent.USER_PROMPT.format(context=context, query=query)}",
-                "stream": False,
-                "options":{
-                    "num_ctx":64000
+        prompt = f"{CraftAgent.SYSTEM_PROMPT}\n{CraftAgent.USER_PROMPT.format(context=context, query=query)}"
+
+        with maybe_span(trace, "generation", agent=self.name, prompt_chars=len(prompt)) as span:
+            response = requests.post(
+                self.api_url,
+                headers=headers,
+                json= {
+                    "model":"qwen3:8b",
+                    "prompt":prompt,
+                    "stream": False,
+                    "options": self._llm_options()
                     }
-                }
-            )
+                )
 
-        if response.status_code != 200:
-            raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
+            if response.status_code != 200:
+                raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
 
-        response_text = response.json().get('response', '')
+            payload = response.json()
+            response_text = payload.get('response', '')
+            span.update(llm_stats(payload), response_chars=len(response_text))
 
         return response_text, docs
 
@@ -233,51 +272,80 @@ class GeneralAgent(Agent):
             name: str,
             api_url: str,
             embeddings: Optional[Any] = None,
-            max_docs: int = 5
+            max_docs: int = 5,
+            search_ef: Optional[int] = None,
+            fetch_k: Optional[int] = None
             ):
+        """
+        fetch_k — сколько окон достаётся из базы до удаления повторов контекста
+        (по умолчанию 3 * max_docs), чтобы после дедупликации осталось max_docs документов.
+        """
         super().__init__(name, api_url)
         self.max_docs = max_docs
+        self.fetch_k = max(fetch_k or 3 * max_docs, max_docs)
         self.embeddings = embeddings
         self.vectorstore = Chroma(persist_directory="./terraria_db/general", embedding_function=self.embeddings)
-        self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": self.max_docs})
+        self._check_search_ef(search_ef)
+        self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": self.fetch_k})
+
+    @staticmethod
+    def _unique_contexts(docs: List[Any]) -> List[Any]:
+        """
+        При token-разбиении несколько окон одного родительского чанка
+        возвращают один и тот же контекст — оставляем его один раз.
+        """
+        seen = set()
+        unique = []
+        for doc in docs:
+            key = doc.metadata.get("parent_id") or doc.page_content
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(doc)
+        return unique
 
-    def call(self, query: str) -> Dict[str, Any]:
+    def call(self, query: str, trace: Optional[Trace] = None) -> Dict[str, Any]:
         """
         Поведение:
-        - Достаёт из Chroma DB k наиболее релевантных документов
+        - Достаёт из Chroma DB fetch_k ближайших окон и оставляет max_docs документов с разным контекстом
         - Передаёт эти документы в пропмт LLM для генерации ответа
         """
-        docs = self.retriever._get_relevant_documents(query, run_manager=None)
-        context = ""
-        for i, doc in enumerate(docs):
-            context += f"\n{i}. Документ\n{doc}"
+        with maybe_span(trace, "retrieval", agent=self.name) as span:
+            docs = self.retriever._get_relevant_documents(query, run_manager=None)
+            docs = self._unique_contexts(docs)[:self.max_docs]
+            context = ""
+            for i, doc in enumerate(docs):
+                context += f"\n{i}. Документ\n{doc}"
 
-        if context == "":
-            context = "\nДокументы не найдены."
+            if context == "":
+                context = "\nДокументы не найдены."
+            span.update(docs=len(docs), context_chars=len(context))
         #context = "\n".join([d.page_content for d in docs]) if docs else "Документы не найдены."
         # logger.info(f"GeneralAgent контекст для запроса '{query}': \n{context}\n")
 
         headers = {
             "Content-Type": "application/json"
         }
-
-        response = requests.post(
-            self.api_url,
-            headers=headers,
-            json= {
-                "model":"qwen3:8b",
-                "prompt":f"{GeneralAgent.SYSTEM_PROMPT}\n{CraftAgent.USER_PROMPT.format(context=context, query=query)}",
-                "stream": False,
-                "options":{
-                    "num_ctx": 64000
+        prompt = f"{GeneralAgent.SYSTEM_PROMPT}\n{CraftAgent.USER_PROMPT.format(context=context, query=query)}"
+
+        with maybe_span(trace, "generation", agent=self.name, prompt_chars=len(prompt)) as span:
+            response = requests.post(
+                self.api_url,
+                headers=headers,
+                json= {
+                    "model":"qwen3:8b",
+                    "prompt":prompt,
+                    "stream": False,
+                    "options": self._llm_options()
                     }
-                }
-            )
+                )
 
-        if response.status_code != 200:
-            raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
+            if response.status_code != 200:
+                raise ValueError(f"Ошибка при вызове модели: {response.status_code}, {response.text}")
 
-        response_text = response.json().get('response', '')
+            payload = response.json()
+            response_text = payload.get('response', '')
+            span.update(llm_stats(payload), response_chars=len(response_text))
 
         return response_text, docs
 
@@ -1,14 +1,41 @@
 import logging
+import os
+import threading
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
 
 from .logging_config import setup_logging
 from .main import setup_terraria_rag
+from .tracing import METRICS, Trace
 
 
 logger = logging.getLogger("RAG_api")
 
+# RAG_SERVER_TIMING=1 — отдавать длительности шагов запроса в заголовке Server-Timing
+SERVER_TIMING = os.getenv("RAG_SERVER_TIMING", "0") == "1"
+
+
+def startup(app: FastAPI) -> None:
+    """
+    Загрузка и прогрев TerrariaRAG. Выполняется в фоновом потоке, чтобы
+    сервер сразу отвечал на /livez, а /readyz стал успешным только после прогрева.
+    """
+    try:
+        terraria_rag = setup_terraria_rag()
+        app.state.startup_timings.update(terraria_rag.startup_timings)
+
+        ping_llm = os.getenv("RAG_WARMUP_LLM", "0") == "1"
+        app.state.startup_timings.update(terraria_rag.warm_up(ping_llm=ping_llm))
+        # /ask видит систему только после прогрева — вместе с успешным /readyz
+        app.state.terraria_rag = terraria_rag
+        app.state.ready = True
+        logger.info("TerrariaRAG готов к работе.")
+    except Exception as e:
+        logger.exception("Не удалось запустить TerrariaRAG")
+        app.state.startup_error = str(e)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -16,24 +43,72 @@ async def lifespan(app: FastAPI):
     Lifespan-хэндлер для инициализации TerrariaRAG при запуске приложения.
     """
     setup_logging()
-    app.state.terraria_rag = setup_terraria_rag()
+    app.state.terraria_rag = None
+    app.state.ready = False
+    app.state.startup_error = None
+    app.state.startup_timings = {}
+    threading.Thread(target=startup, args=(app,), daemon=True).start()
     yield
 
 
 app = FastAPI(title="Terraria RAG API", lifespan=lifespan)
 
 
+@app.get("/livez")
+def livez(request: Request) -> dict:
+    """
+    Процесс жив. Падает только если запуск завершился ошибкой — тогда контейнер нужно перезапустить.
+    """
+    if request.app.state.startup_error is not None:
+        raise HTTPException(status_code=500, detail=request.app.state.startup_error)
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+def readyz(request: Request) -> dict:
+    """
+    Система загружена и прогрета, можно отправлять запросы.
+    """
+    state = request.app.state
+    if not state.ready:
+        detail = state.startup_error or "RAG система ещё не прогрета"
+        raise HTTPException(status_code=503, detail=detail)
+    return {"status": "ready", "startup_timings": state.startup_timings}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> str:
+    """
+    Агрегированные метрики запросов в формате Prometheus: задержки шагов, размеры промптов,
+    число найденных документов, счётчики запросов и ошибок.
+    """
+    return METRICS.render()
+
+
 @app.get("/ask")
-def ask(question: str, request: Request) -> str:
+def ask(question: str, request: Request, response: Response) -> str:
     """
     HTTP-эндпоинт для обращения к RAG-системе.
     Принимает строковый параметр `question` и возвращает строковый ответ.
     """
     terraria_rag = getattr(request.app.state, "terraria_rag", None)
-    if terraria_rag is None:
-        raise HTTPException(status_code=503, detail="RAG система ещё не инициализирована")
+    if terraria_rag is None or not request.app.state.ready:
+        raise HTTPException(status_code=503, detail="RAG система ещё не прогрета")
 
     if not question.strip():
         raise HTTPException(status_code=400, detail="Параметр 'question' не должен быть пустым")
 
-    return terraria_rag.run(question)
+    trace = Trace(request_id=request.headers.get("X-Request-ID"))
+    status = "error"
+    try:
+        with METRICS.track_in_flight():
+            answer = terraria_rag.run(question, trace=trace)
+        status = "ok"
+    finally:
+        METRICS.observe(trace, status)
+        trace.log()
+
+    response.headers["X-Request-ID"] = trace.request_id
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return answer
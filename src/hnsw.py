@@ -0,0 +1,40 @@
+"""
+hnsw.py — настройки HNSW у коллекций Chroma
+
+Общие для manage_db.py (построение и set-search-ef), агентов (проверка ef поиска)
+и проб в metrics/. Только работа с объектом коллекции, без моделей и CLI.
+"""
+
+
+def hnsw_configuration(hnsw_m: int = None, construction_ef: int = None, search_ef: int = None) -> dict:
+    """
+    Конфигурация HNSW для новой коллекции Chroma. Незаданные параметры остаются
+    по умолчанию Chroma (M=16, construction_ef=100, search_ef=100).
+    """
+    hnsw = {}
+    if hnsw_m is not None:
+        hnsw["max_neighbors"] = hnsw_m
+    if construction_ef is not None:
+        hnsw["ef_construction"] = construction_ef
+    if search_ef is not None:
+        hnsw["ef_search"] = search_ef
+    return {"hnsw": hnsw} if hnsw else None
+
+def collection_hnsw(collection) -> dict:
+    """Текущая конфигурация HNSW коллекции (max_neighbors, ef_construction, ef_search, space)."""
+    try:
+        return dict(collection.configuration.get("hnsw") or {})
+    except Exception:
+        return {}
+
+def set_search_ef(collection, search_ef: int):
+    """
+    Меняет ef поиска HNSW у уже построенной коллекции (M и construction_ef так не поменять).
+    Значение сохраняется в коллекции на диске и действует для всех, кто откроет базу потом,
+    поэтому его лучше задавать при построении (search_ef в hnsw_configuration / манифесте).
+    Если ef уже такой, коллекция не трогается. Возвращает прежнее значение.
+    """
+    previous = collection_hnsw(collection).get("ef_search")
+    if previous != search_ef:
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+    return previous
@@ -0,0 +1,77 @@
+"""
+jsonl_log.py — чтение и дозапись append-only JSONL
+
+Общие для пакетного режима main.py, журнала результатов (metrics/results_log.py)
+и кэша оценки (metrics/eval_cache.py). Без зависимостей кроме стандартной библиотеки.
+"""
+
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger('RAG_jsonl_log')
+
+
+def iter_records(path: str):
+    """Потоково читает все записи журнала, пропуская битые строки."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{path}:{line_no}: битая строка пропущена")
+
+
+class JsonlAppender:
+    """
+    Дозапись в append-only JSONL из нескольких потоков: каждая запись — одна строка,
+    flush после каждой, fsync раз в fsync_every записей и при закрытии.
+    Недописанная после падения последняя строка не склеивается с новой записью.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 20):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -1,6 +1,12 @@
+import os
+import csv
 import logging
 import json
+import time
+import argparse
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 
 from dotenv import load_dotenv
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -9,12 +15,16 @@ try:
     # Импорт при использовании пакета src (например, uvicorn src.api:app)
     from .TerrariaRAG import TerrariaRAG
     from .agent import CraftAgent, GeneralAgent
+    from .jsonl_log import JsonlAppender, iter_records
     from .logging_config import setup_logging
+    from .tracing import Trace
 except ImportError:
     # Импорт при прямом запуске файла (python src/main.py)
     from TerrariaRAG import TerrariaRAG
     from agent import CraftAgent, GeneralAgent
+    from jsonl_log import JsonlAppender, iter_records
     from logging_config import setup_logging
+    from tracing import Trace
 
 
 warnings.filterwarnings("ignore")
@@ -23,37 +33,96 @@ logger = logging.getLogger('RAG_main')
 
 load_dotenv()
 
-def setup_terraria_rag() -> TerrariaRAG:
+@contextmanager
+def timed_phase(name: str, timings: dict):
+    """
+    Замеряет фазу запуска и кладёт её длительность (в секундах) в timings.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"Фаза '{name}' заняла {timings[name]:.2f} с")
+
+
+def timed_call(name: str, func, timings: dict):
+    with timed_phase(name, timings):
+        return func()
+
+
+def load_embeddings():
+    return HuggingFaceEmbeddings(
+        model_name="intfloat/multilingual-e5-large"
+    )
+
+
+def load_recipes():
+    with open("data/data/recipes.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+DEFAULT_LLM_URL = "http://192.168.68.111:8000/api/generate"
+DEFAULT_DB_MANIFEST = "docker/db_manifest.json"
+
+
+def load_search_ef(manifest_path: str) -> dict:
+    """ef поиска HNSW баз из манифеста build-all: {"general": ..., "recipes": ...} (только заданные)."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return {store["name"]: store["search_ef"] for store in manifest.get("stores", [])
+            if store.get("name") and store.get("search_ef") is not None}
+
+
+def setup_terraria_rag(api_url: str = None, search_ef: dict = None) -> TerrariaRAG:
+    """
+    Собирает TerrariaRAG. Длительности фаз запуска сохраняются
+    в terraria_rag.startup_timings. Адрес LLM: api_url, иначе переменная
+    окружения RAG_LLM_URL, иначе DEFAULT_LLM_URL. Ожидаемый ef поиска баз ({"general": ..., "recipes": ...}):
+    search_ef, иначе search_ef баз из манифеста RAG_DB_MANIFEST (по умолчанию DEFAULT_DB_MANIFEST);
+    агенты только сверяют его с базой и пишут предупреждение при расхождении.
+    """
+    timings = {}
     logger.info("Загрузка TerrariaRAG...")
     logger.info("Инициализация LLM клиента...")
 
-    api_url = "http://192.168.68.111:8000/api/generate"
+    api_url = api_url or os.getenv("RAG_LLM_URL") or DEFAULT_LLM_URL
+    if search_ef is None:
+        search_ef = load_search_ef(os.getenv("RAG_DB_MANIFEST", DEFAULT_DB_MANIFEST))
 
     logger.info("LLM клиент инициализирован.")
     logger.info("Загрузка вспомогательных данных...")
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name="intfloat/multilingual-e5-large"
-    )
-    recipes = json.load(open("data/data/recipes.json", "r", encoding="utf-8"))
+    # Модель эмбеддингов и recipes.json не зависят друг от друга — грузим параллельно
+    with timed_phase("load_data", timings), ThreadPoolExecutor(max_workers=2) as executor:
+        embeddings_future = executor.submit(timed_call, "load_embeddings", load_embeddings, timings)
+        recipes_future = executor.submit(timed_call, "load_recipes", load_recipes, timings)
+        embeddings = embeddings_future.result()
+        recipes = recipes_future.result()
 
     logger.info("Вспомогательные данные загружены.")
     logger.info("Создание агентов...")
 
-    craft_agent = CraftAgent(
-        name="CraftAgent",
-        api_url=api_url,
-        recipes=recipes,
-        embeddings=embeddings,
-        max_recipes=24
-    )
+    with timed_phase("open_craft_store", timings):
+        craft_agent = CraftAgent(
+            name="CraftAgent",
+            api_url=api_url,
+            recipes=recipes,
+            embeddings=embeddings,
+            max_recipes=24,
+            search_ef=search_ef.get("recipes")
+        )
 
-    general_agent = GeneralAgent(
-        name="GeneralAgent",
-        api_url=api_url,
-        embeddings=embeddings,
-        max_docs=8
-    )
+    with timed_phase("open_general_store", timings):
+        general_agent = GeneralAgent(
+            name="GeneralAgent",
+            api_url=api_url,
+            embeddings=embeddings,
+            max_docs=8,
+            search_ef=search_ef.get("general")
+        )
 
     logger.info("Агенты созданы.")
     logger.info("Создание TerrariaRAG...")
@@ -65,28 +134,136 @@ def setup_terraria_rag() -> TerrariaRAG:
             general_agent
         ]
     )
+    terraria_rag.startup_timings = timings
 
     logger.info("TerrariaRAG создан.")
 
     return terraria_rag
 
 
-if __name__ == "__main__":
+def question_key(question: str) -> str:
+    """Ключ для поиска дубликатов: вопрос без лишних пробелов."""
+    return " ".join(question.split())
+
+
+def read_questions(path: str) -> list:
+    """
+    Читает вопросы из JSONL (строка — объект с полем question или просто строка),
+    CSV (колонка question, иначе первая колонка) или JSON-массива.
+    Возвращает список словарей {"question": ..., "id": ...}; id — номер строки, если его нет.
+    """
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        column = "question" if rows and "question" in rows[0] else (next(iter(rows[0])) if rows else None)
+        items = [{"question": row[column], "id": row.get("id") or str(n)} for n, row in enumerate(rows, start=1)]
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                records = json.load(f)
+            else:
+                records = [json.loads(line) for line in f if line.strip()]
+        items = []
+        for n, record in enumerate(records, start=1):
+            if isinstance(record, str):
+                record = {"question": record}
+            items.append({"question": record["question"], "id": str(record.get("id", n))})
+    return [item for item in items if item["question"] and item["question"].strip()]
+
+
+def load_answered(output_path: str) -> set:
+    """Ключи вопросов, на которые в output_path уже есть ответ (записи с ошибкой не считаются)."""
+    return {question_key(record["question"]) for record in iter_records(output_path)
+            if "answer" in record}
+
+
+def answer_one(terraria_rag: TerrariaRAG, question: str) -> dict:
+    trace = Trace()
+    try:
+        answer = terraria_rag.run(question, trace=trace)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "trace": trace.summary()}
+    return {"answer": answer, "trace": trace.summary()}
+
+
+def answer_batch(terraria_rag: TerrariaRAG, input_path: str, output_path: str, workers: int = 2) -> dict:
+    """
+    Пакетный режим: отвечает на вопросы из input_path одним загруженным конвейером,
+    не больше workers запросов одновременно. Одинаковые вопросы (с точностью до пробелов)
+    отвечаются один раз — в записи перечислены id всех их строк. Каждый ответ сразу
+    дописывается в output_path (JSONL) вместе со сводкой трассы: длительность, шаги, токены.
+    Повторный запуск пропускает вопросы, на которые уже есть ответ; ошибки пересчитываются.
+    """
+    items = read_questions(input_path)
+    unique = {}
+    for item in items:
+        entry = unique.setdefault(question_key(item["question"]), {"question": item["question"].strip(), "ids": []})
+        entry["ids"].append(item["id"])
+
+    answered = load_answered(output_path)
+    pending = [entry for key, entry in unique.items() if key not in answered]
+    logger.info(f"Вопросов: {len(items)}, уникальных: {len(unique)}, уже отвечено: {len(unique) - len(pending)}, "
+                f"осталось: {len(pending)}")
+    stats = {"questions": len(items), "unique": len(unique), "skipped": len(unique) - len(pending),
+             "answered": 0, "failed": 0}
+    if not pending:
+        return stats
+
+    start = time.perf_counter()
+    with JsonlAppender(output_path) as out, \
+            ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(answer_one, terraria_rag, entry["question"]): entry for entry in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            entry = futures[future]
+            record = {"question": entry["question"], "ids": entry["ids"], **future.result()}
+            out.write(record)
+            if "error" in record:
+                stats["failed"] += 1
+                logger.error(f"Ошибка ({done}/{len(pending)}): {entry['question']}: {record['error']}")
+            else:
+                stats["answered"] += 1
+                logger.info(f"Ответ ({done}/{len(pending)}, {record['trace']['duration']:.1f} с, "
+                            f"всего {time.perf_counter() - start:.0f} с): {entry['question']}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer Terraria questions with TerrariaRAG.")
+    parser.add_argument("--batch", type=str, help="Questions file (JSONL, CSV or JSON array) to answer in bulk.")
+    parser.add_argument("--out", type=str, default="out/answers.jsonl",
+                        help="JSONL file the batch answers are appended to; existing answers are skipped.")
+    parser.add_argument("--workers", type=int, default=2, help="Questions answered concurrently in batch mode.")
+    parser.add_argument("--temperature", type=float, default=0.1, help="LLM temperature sent to the routing, agent and merge requests.")
+    parser.add_argument("--llm_url", type=str, default=None, help="LLM /api/generate URL (default: RAG_LLM_URL).")
+    args = parser.parse_args()
+
     setup_logging()
+    if args.batch:
+        terraria_rag = setup_terraria_rag(args.llm_url)
+        terraria_rag.set_temperature(args.temperature)
+        stats = answer_batch(terraria_rag, args.batch, args.out, args.workers)
+        print(f"✅ Отвечено: {stats['answered']}, ошибок: {stats['failed']}, пропущено (уже есть): {stats['skipped']}, "
+              f"дубликатов: {stats['questions'] - stats['unique']}")
+        print(f"📄 Ответы: {args.out}")
+        return
+
     question = input("Введите ваш вопрос по Terraria: ")
     if question.strip() == "":
         question = (
             "Какой урон у снайперской винтовки?"
         )
 
-    terraria_rag = setup_terraria_rag()
-    terraria_rag.set_temperature(0.1)
+    terraria_rag = setup_terraria_rag(args.llm_url)
+    terraria_rag.set_temperature(args.temperature)
     response = terraria_rag.run(question)
     print("=" * 70)
     print("Вопрос:", question, "\n")
     print("Ответ:", response)
 
 
+if __name__ == "__main__":
+    main()
+
 
 """
 
@@ -1,5 +1,8 @@
+import os
 import json
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
@@ -8,33 +11,137 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from tqdm import tqdm
 import torch
 
-def create_db(json_path: str, 
-              persist_directory: str, 
-              embedding_model: str = "intfloat/multilingual-e5-large",
-              use_cuda: bool = True,
-              chunk_size: int = 5000,
-              chunk_overlap: int = 1000,
-              min_length: int = 0,
-              separators: list[str] = ["\n\n", "\n", " "],
-              ) -> None:
-    print(f"Creating database from {json_path}...")
+try:
+    from .hnsw import hnsw_configuration, set_search_ef
+except ImportError:
+    from hnsw import hnsw_configuration, set_search_ef
+
+# multilingual-e5-large читает не более 512 токенов, всё что дальше обрезается при эмбеддинге
+E5_MAX_TOKENS = 512
+
+def load_pages(json_path: str) -> tuple[list[str], list[dict]]:
+    """
+    Тексты страниц и их метаданные {"title": ...}: по title инкрементальное обновление
+    (update_chunks) находит и удаляет старые чанки страницы.
+    """
     with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+        if json_path.endswith('.jsonl'):
+            data = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
     print(f"Loaded data from {json_path} with {len(data)} items.")
-    inputs = []
+    inputs, metadatas = [], []
     for item in data:
         if isinstance(item, str):
             inputs.append(data[item].get('content', ''))
+            metadatas.append({"title": data[item].get('title', item)})
         else:
             inputs.append(item.get('content', ''))
+            metadatas.append({"title": item.get('title', '')})
+    return inputs, metadatas
 
-    documents = [Document(page_content=text) for text in inputs]
-    
-    text_splitter = RecursiveCharacterTextSplitter(separators=separators, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = text_splitter.split_documents(documents)
-    chunks = [chunk for chunk in chunks if len(chunk.page_content) >= min_length]
-    
-    print(f"Filtered chunks to {len(chunks)} items with minimum length {min_length}.")
+def load_texts(json_path: str) -> list[str]:
+    return load_pages(json_path)[0]
+
+def load_chunks(chunks_path: str) -> list[Document]:
+    """Чанки, уже нарезанные data/scripts/pipeline.py: JSONL {"page_content", "metadata"}."""
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = [Document(**json.loads(line)) for line in f if line.strip()]
+    print(f"Loaded {len(chunks)} ready chunks from {chunks_path}.")
+    return chunks
+
+def load_tokenizer(embedding_model: str = "intfloat/multilingual-e5-large"):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(embedding_model)
+
+def token_length_function(tokenizer):
+    """Длина текста в токенах модели (без служебных токенов)."""
+    def length(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False, verbose=False))
+    return length
+
+def split_texts(texts: list[str],
+                splitter: str = "chars",
+                chunk_size: int = 5000,
+                chunk_overlap: int = 1000,
+                min_length: int = 0,
+                separators: list[str] = ["\n\n", "\n", " "],
+                tokenizer=None,
+                embed_window: int = E5_MAX_TOKENS,
+                embed_overlap: int = 64,
+                metadatas: list[dict] = None,
+                ) -> list[Document]:
+    """
+    Режет тексты на чанки.
+
+    chars  — как раньше: chunk_size/chunk_overlap в символах, эмбеддится весь чанк.
+    tokens — chunk_size/chunk_overlap в токенах задают размер возвращаемого контекста,
+             который дополнительно режется на окна по embed_window токенов. Эмбеддится окно,
+             а в базу кладётся родительский контекст (metadata["context"]).
+
+    metadatas (по одному словарю на текст) копируются в метаданные его чанков.
+    """
+    if metadatas is None:
+        documents = [Document(page_content=text) for text in texts]
+    else:
+        documents = [Document(page_content=text, metadata=dict(metadata)) for text, metadata in zip(texts, metadatas)]
+
+    if splitter == "chars":
+        text_splitter = RecursiveCharacterTextSplitter(separators=separators, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        chunks = text_splitter.split_documents(documents)
+        return [chunk for chunk in chunks if len(chunk.page_content) >= min_length]
+
+    if splitter != "tokens":
+        raise ValueError(f"Unknown splitter: {splitter}")
+    if tokenizer is None:
+        raise ValueError("tokenizer is required for the tokens splitter.")
+
+    length_function = token_length_function(tokenizer)
+    window = embed_window - tokenizer.num_special_tokens_to_add()
+    parent_splitter = RecursiveCharacterTextSplitter(
+        separators=separators, chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function
+    )
+    # пустой разделитель в конце гарантирует, что окно не превысит лимит модели
+    window_splitter = RecursiveCharacterTextSplitter(
+        separators=list(separators) + [""], chunk_size=window, chunk_overlap=min(embed_overlap, window // 2),
+        length_function=length_function
+    )
+
+    parents = parent_splitter.split_documents(documents)
+    parents = [parent for parent in parents if len(parent.page_content) >= min_length]
+
+    chunks = []
+    for parent in parents:
+        parent_id = str(uuid4())
+        for window_text in window_splitter.split_text(parent.page_content):
+            chunks.append(Document(
+                page_content=window_text,
+                metadata={**parent.metadata, "parent_id": parent_id, "context": parent.page_content}
+            ))
+    print(f"Split {len(parents)} context chunks into {len(chunks)} embedding windows of <= {embed_window} tokens.")
+    return chunks
+
+def count_oversized_chunks(chunks: list[Document], tokenizer, max_tokens: int = E5_MAX_TOKENS) -> int:
+    count = 0
+    for chunk in chunks:
+        if len(tokenizer.encode(chunk.page_content, verbose=False)) > max_tokens:
+            count += 1
+    return count
+
+def report_chunks(chunks: list[Document], tokenizer, max_tokens: int = E5_MAX_TOKENS) -> dict:
+    oversized = count_oversized_chunks(chunks, tokenizer, max_tokens)
+    embedded_chars = sum(len(chunk.page_content) for chunk in chunks)
+    stored_chars = sum(len(chunk.metadata.get("context", chunk.page_content)) for chunk in chunks)
+    print(f"{oversized}/{len(chunks)} chunks exceed the {max_tokens}-token model limit and will be truncated at embed time.")
+    print(f"Embedded text: {embedded_chars} chars, stored context: {stored_chars} chars.")
+    return {
+        "chunks": len(chunks),
+        "oversized": oversized,
+        "embedded_chars": embedded_chars,
+        "stored_chars": stored_chars,
+    }
+
+def get_embeddings(embedding_model: str = "intfloat/multilingual-e5-large", use_cuda: bool = True) -> HuggingFaceEmbeddings:
     # Определяем устройство: пытаемся использовать CUDA, но если она недоступна — тихо падаем на CPU.
     if use_cuda and not torch.cuda.is_available():
         print("CUDA запрошена, но недоступна. Использую CPU.")
@@ -45,14 +152,244 @@ def create_db(json_path: str,
         model_kwargs={"device": device}
     )
     print(f"Using embedding model: {embedding_model} on {device}.")
-    vectorstore = Chroma(persist_directory=persist_directory, embedding_function=embedding)
+    return embedding
+
+# метаданные чанка без метаданных: пустой title не совпадает ни с одной страницей при update_chunks
+EMPTY_METADATA = {"title": ""}
+
+
+def embed_batch(batch: list[Document], embedding) -> dict:
+    """
+    Эмбеддит page_content чанков и возвращает аргументы для collection.add:
+    в коллекцию кладётся их контекст (metadata["context"], если есть).
+    Chroma не принимает пустые метаданные — у таких чанков они заменяются на EMPTY_METADATA,
+    чтобы не терять метаданные (title, parent_id) остальных чанков пачки.
+    """
+    vectors = embedding.embed_documents([chunk.page_content for chunk in batch])
+    documents = [chunk.metadata.get("context", chunk.page_content) for chunk in batch]
+    metadatas = [{k: v for k, v in chunk.metadata.items() if k != "context"} or dict(EMPTY_METADATA)
+                 for chunk in batch]
+    return {
+        "ids": [str(uuid4()) for _ in batch],
+        "embeddings": vectors,
+        "documents": documents,
+        "metadatas": metadatas,
+    }
+
+def add_chunks(vectorstore: Chroma, chunks: list[Document], embedding, batch_size: int = 256) -> None:
+    for start in tqdm(range(0, len(chunks), batch_size), desc="Embedding"):
+        batch = chunks[start:start + batch_size]
+        vectorstore._collection.add(**embed_batch(batch, embedding))
+
+def create_db(json_path: str,
+              persist_directory: str,
+              embedding_model: str = "intfloat/multilingual-e5-large",
+              use_cuda: bool = True,
+              chunk_size: int = 5000,
+              chunk_overlap: int = 1000,
+              min_length: int = 0,
+              separators: list[str] = ["\n\n", "\n", " "],
+              splitter: str = "chars",
+              embed_window: int = E5_MAX_TOKENS,
+              embed_overlap: int = 64,
+              hnsw_m: int = None,
+              construction_ef: int = None,
+              search_ef: int = None,
+              ) -> None:
+    print(f"Creating database from {json_path}...")
+    inputs, metadatas = load_pages(json_path)
+
+    tokenizer = load_tokenizer(embedding_model)
+    chunks = split_texts(
+        inputs, splitter, chunk_size, chunk_overlap, min_length, separators,
+        tokenizer=tokenizer, embed_window=embed_window, embed_overlap=embed_overlap, metadatas=metadatas
+    )
+
+    print(f"Filtered chunks to {len(chunks)} items with minimum length {min_length}.")
+    report_chunks(chunks, tokenizer)
+
+    embedding = get_embeddings(embedding_model, use_cuda)
+    vectorstore = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding,
+        collection_configuration=hnsw_configuration(hnsw_m, construction_ef, search_ef)
+    )
     print(f"Initialized Chroma vectorstore at {persist_directory}.")
-    
-    uuids = [str(uuid4()) for _ in range(len(chunks))]
-    vectorstore.add_documents(documents=chunks, ids=uuids)
-    
+
+    add_chunks(vectorstore, chunks, embedding)
+
     print(f"Database created at {persist_directory} with {len(chunks)} chunks.")
-    
+
+def chunk_stats(json_path: str,
+                embedding_model: str = "intfloat/multilingual-e5-large",
+                chunk_size: int = 5000,
+                chunk_overlap: int = 1000,
+                min_length: int = 0,
+                separators: list[str] = ["\n\n", "\n", " "],
+                splitter: str = "chars",
+                embed_window: int = E5_MAX_TOKENS,
+                embed_overlap: int = 64,
+                ) -> dict:
+    """Режет данные так же, как create_db, и печатает отчёт без загрузки модели эмбеддингов."""
+    inputs = load_texts(json_path)
+    tokenizer = load_tokenizer(embedding_model)
+    chunks = split_texts(
+        inputs, splitter, chunk_size, chunk_overlap, min_length, separators,
+        tokenizer=tokenizer, embed_window=embed_window, embed_overlap=embed_overlap
+    )
+    return report_chunks(chunks, tokenizer)
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Манифест описывает все базы, которые нужно построить:
+
+    {
+        "embedding_model": "intfloat/multilingual-e5-large",
+        "stores": [
+            {"name": "general", "json_path": "...", "persist_directory": "...", "chunk_size": 5000, ...},
+            ...
+        ]
+    }
+
+    Параметры разбиения и HNSW (hnsw_m, construction_ef, search_ef) у каждой базы свои,
+    отсутствующие берутся по умолчанию как в create_db. Если у базы указан существующий
+    chunks_path (готовые чанки от data/scripts/pipeline.py), разбиение json_path пропускается.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    for store in manifest.get("stores", []):
+        if not store.get("json_path") or not store.get("persist_directory"):
+            raise ValueError(f"Store {store.get('name')} in {manifest_path} needs json_path and persist_directory.")
+    return manifest
+
+def store_exists(persist_directory: str) -> bool:
+    return os.path.isdir(persist_directory) and bool(os.listdir(persist_directory))
+
+def interleave_batches(stores_chunks: list[list[Document]], batch_size: int):
+    """По очереди отдаёт батчи из всех источников: (индекс базы, батч)."""
+    offsets = [0] * len(stores_chunks)
+    while True:
+        yielded = False
+        for i, chunks in enumerate(stores_chunks):
+            if offsets[i] >= len(chunks):
+                continue
+            yield i, chunks[offsets[i]:offsets[i] + batch_size]
+            offsets[i] += batch_size
+            yielded = True
+        if not yielded:
+            return
+
+def build_all(manifest_path: str,
+              use_cuda: bool = True,
+              batch_size: int = 256,
+              skip_existing: bool = False,
+              max_pending: int = 2,
+              ) -> None:
+    """
+    Строит все базы из манифеста за один запуск: модель эмбеддингов грузится один раз,
+    батчи разных баз эмбеддятся вперемешку в основном потоке, а запись в каждую базу
+    идёт в своём потоке параллельно с эмбеддингом следующих батчей.
+    """
+    manifest = load_manifest(manifest_path)
+    embedding_model = manifest.get("embedding_model", "intfloat/multilingual-e5-large")
+
+    stores = []
+    for store in manifest["stores"]:
+        if skip_existing and store_exists(store["persist_directory"]):
+            print(f"Database {store.get('name', store['persist_directory'])} already exists, skipping.")
+            continue
+        stores.append(store)
+    if not stores:
+        print("Nothing to build.")
+        return
+
+    tokenizer = load_tokenizer(embedding_model)
+    stores_chunks = []
+    for store in stores:
+        if store.get("chunks_path") and os.path.exists(store["chunks_path"]):
+            chunks = load_chunks(store["chunks_path"])
+            report_chunks(chunks, tokenizer)
+            stores_chunks.append(chunks)
+            continue
+        print(f"Preparing {store.get('name', store['persist_directory'])} from {store['json_path']}...")
+        texts, metadatas = load_pages(store["json_path"])
+        chunks = split_texts(
+            texts,
+            splitter=store.get("splitter", "chars"),
+            chunk_size=store.get("chunk_size", 5000),
+            chunk_overlap=store.get("chunk_overlap", 1000),
+            min_length=store.get("min_length", 0),
+            separators=store.get("separators", ["\n\n", "\n", " "]),
+            tokenizer=tokenizer,
+            embed_window=store.get("embed_window", E5_MAX_TOKENS),
+            embed_overlap=store.get("embed_overlap", 64),
+            metadatas=metadatas,
+        )
+        report_chunks(chunks, tokenizer)
+        stores_chunks.append(chunks)
+
+    embedding = get_embeddings(embedding_model, use_cuda)
+    vectorstores = [
+        Chroma(
+            persist_directory=store["persist_directory"],
+            embedding_function=embedding,
+            collection_configuration=hnsw_configuration(
+                store.get("hnsw_m"), store.get("construction_ef"), store.get("search_ef")
+            )
+        )
+        for store in stores
+    ]
+
+    # по одному потоку записи на базу: внутри базы батчи пишутся по порядку
+    writers = [ThreadPoolExecutor(max_workers=1) for _ in stores]
+    pending = [deque() for _ in stores]
+    total = sum((len(chunks) + batch_size - 1) // batch_size for chunks in stores_chunks)
+    try:
+        for i, batch in tqdm(interleave_batches(stores_chunks, batch_size), total=total, desc="Embedding"):
+            payload = embed_batch(batch, embedding)
+            # не даём очереди записи расти бесконечно, если диск медленнее модели
+            while len(pending[i]) >= max_pending:
+                pending[i].popleft().result()
+            pending[i].append(writers[i].submit(vectorstores[i]._collection.add, **payload))
+        for futures in pending:
+            while futures:
+                futures.popleft().result()
+    finally:
+        for writer in writers:
+            writer.shutdown(wait=True)
+
+    for store, chunks in zip(stores, stores_chunks):
+        print(f"Database created at {store['persist_directory']} with {len(chunks)} chunks.")
+
+def update_chunks(persist_directory: str,
+                  chunks: list,
+                  stale_titles: list[str] = None,
+                  embedding_model: str = "intfloat/multilingual-e5-large",
+                  use_cuda: bool = True,
+                  batch_size: int = 256,
+                  collection_configuration: dict = None,
+                  ) -> None:
+    """
+    Переиндексирует только изменившиеся страницы: удаляет их старые чанки по metadata["title"]
+    и добавляет новые. stale_titles=None — базы нет в состоянии pipeline.py, она пересоздаётся целиком.
+    chunks — Document или словари {"page_content", "metadata"} из chunks JSONL.
+    """
+    chunks = [chunk if isinstance(chunk, Document) else Document(**chunk) for chunk in chunks]
+    if stale_titles is None:
+        delete_db(persist_directory)
+    embedding = get_embeddings(embedding_model, use_cuda)
+    vectorstore = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding,
+        collection_configuration=collection_configuration
+    )
+    stale_titles = stale_titles or []
+    for start in range(0, len(stale_titles), 500):
+        vectorstore._collection.delete(where={"title": {"$in": stale_titles[start:start + 500]}})
+    if chunks:
+        add_chunks(vectorstore, chunks, embedding, batch_size)
+    print(f"Database at {persist_directory} updated: {len(stale_titles)} pages removed or replaced, {len(chunks)} chunks added.")
+
 def delete_db(persist_directory: str) -> None:
     try:
         vectorstore = Chroma(persist_directory=persist_directory)
@@ -60,47 +397,102 @@ def delete_db(persist_directory: str) -> None:
         print(f"Database at {persist_directory} has been deleted.")
     except Exception as e:
         print(f"Failed to delete database at {persist_directory}: {e}")
-    
-def update_db(json_path: str, 
-              persist_directory: str, 
+
+def update_db(json_path: str,
+              persist_directory: str,
               embedding_model: str = "intfloat/multilingual-e5-large",
               use_cuda: bool = True,
               chunk_size: int = 5000,
               chunk_overlap: int = 1000,
               min_length: int = 0,
               separators: list[str] = ["\n\n", "\n", " "],
+              splitter: str = "chars",
+              embed_window: int = E5_MAX_TOKENS,
+              embed_overlap: int = 64,
+              hnsw_m: int = None,
+              construction_ef: int = None,
+              search_ef: int = None,
               ) -> None:
     delete_db(persist_directory)
-    create_db(json_path, persist_directory, embedding_model, use_cuda, chunk_size, chunk_overlap, min_length, separators)
+    create_db(json_path, persist_directory, embedding_model, use_cuda, chunk_size, chunk_overlap, min_length, separators,
+              splitter, embed_window, embed_overlap, hnsw_m, construction_ef, search_ef)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Manage the vector database.")
-    parser.add_argument("action", choices=["create", "delete"], help="Action to perform: create or delete the database.")
+    parser.add_argument("action", choices=["create", "delete", "stats", "build-all", "set-search-ef"], help="Action to perform: create or delete the database, report chunk statistics, build every database from a manifest, or change HNSW search ef of an existing database.")
     parser.add_argument("--json_path", type=str, help="Path to the JSON file containing the data.")
-    parser.add_argument("--persist_directory", type=str, required=True, help="Directory to persist the vector database.")
+    parser.add_argument("--persist_directory", type=str, help="Directory to persist the vector database.")
     parser.add_argument("--embedding_model", type=str, default="intfloat/multilingual-e5-large", help="Embedding model to use.")
-    parser.add_argument("--chunk_size", type=int, default=5000, help="Chunk size for text splitting.")
-    parser.add_argument("--chunk_overlap", type=int, default=1000, help="Chunk overlap for text splitting.")
+    parser.add_argument("--chunk_size", type=int, default=5000, help="Chunk size for text splitting (chars, or tokens with --splitter tokens).")
+    parser.add_argument("--chunk_overlap", type=int, default=1000, help="Chunk overlap for text splitting (chars, or tokens with --splitter tokens).")
     parser.add_argument("--min_length", type=int, default=0, help="Minimum length for text chunks.")
     parser.add_argument("--separators", type=str, nargs='+', default=["\n\n", "\n", " "], help="List of separators for text splitting.")
+    parser.add_argument("--splitter", choices=["chars", "tokens"], default="chars", help="Measure chunks in characters or in embedding model tokens.")
+    parser.add_argument("--embed_window", type=int, default=E5_MAX_TOKENS, help="Embedding window in tokens (tokens splitter only).")
+    parser.add_argument("--embed_overlap", type=int, default=64, help="Overlap between embedding windows in tokens (tokens splitter only).")
+    parser.add_argument("--hnsw_m", type=int, help="HNSW M (max neighbors per node), fixed at build time.")
+    parser.add_argument("--construction_ef", type=int, help="HNSW ef used while building the index.")
+    parser.add_argument("--search_ef", type=int, help="HNSW ef used at query time; can be changed on an existing database.")
+    parser.add_argument("--manifest", type=str, default="docker/db_manifest.json", help="Manifest with the databases to build (build-all only).")
+    parser.add_argument("--batch_size", type=int, default=256, help="Chunks per embedding batch (build-all only).")
+    parser.add_argument("--skip_existing", action="store_true", help="Skip databases whose directory is not empty (build-all only).")
+    parser.add_argument("--cpu", action="store_true", help="Do not use CUDA even if it is available.")
     parser.add_argument("--db_path", type=str, help="Path to the database to delete.")
     args = parser.parse_args()
-    
+
     if args.action == "create":
         if not args.json_path:
             raise ValueError("json_path is required for creating the database.")
+        if not args.persist_directory:
+            raise ValueError("persist_directory is required for creating the database.")
         create_db(
             json_path=args.json_path,
             persist_directory=args.persist_directory,
             embedding_model=args.embedding_model,
+            use_cuda=not args.cpu,
             chunk_size=args.chunk_size,
             chunk_overlap=args.chunk_overlap,
             min_length=args.min_length,
-            separators=args.separators
+            separators=args.separators,
+            splitter=args.splitter,
+            embed_window=args.embed_window,
+            embed_overlap=args.embed_overlap,
+            hnsw_m=args.hnsw_m,
+            construction_ef=args.construction_ef,
+            search_ef=args.search_ef
         )
-    
+
     elif args.action == "delete":
         if not args.persist_directory:
             raise ValueError("persist_directory is required for deleting the database.")
         delete_db(persist_directory=args.persist_directory)
+
+    elif args.action == "stats":
+        if not args.json_path:
+            raise ValueError("json_path is required for chunk statistics.")
+        chunk_stats(
+            json_path=args.json_path,
+            embedding_model=args.embedding_model,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            min_length=args.min_length,
+            separators=args.separators,
+            splitter=args.splitter,
+            embed_window=args.embed_window,
+            embed_overlap=args.embed_overlap
+        )
+
+    elif args.action == "build-all":
+        build_all(
+            manifest_path=args.manifest,
+            use_cuda=not args.cpu,
+            batch_size=args.batch_size,
+            skip_existing=args.skip_existing
+        )
+
+    elif args.action == "set-search-ef":
+        if not args.persist_directory or args.search_ef is None:
+            raise ValueError("persist_directory and search_ef are required for set-search-ef.")
+        set_search_ef(Chroma(persist_directory=args.persist_directory)._collection, args.search_ef)
+        print(f"Search ef of {args.persist_directory} set to {args.search_ef}.")
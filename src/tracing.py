@@ -0,0 +1,299 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+logger = logging.getLogger('RAG_tracing')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CHARS_BUCKETS = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+DOCS_BUCKETS = (0, 1, 2, 4, 8, 16, 24, 32)
+TOKENS_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+# поля статистики из ответа Ollama /api/generate -> атрибуты шага (длительности Ollama в нс, у нас в секундах)
+LLM_COUNT_FIELDS = {"prompt_eval_count": "prompt_tokens", "eval_count": "completion_tokens"}
+LLM_DURATION_FIELDS = {
+    "prompt_eval_duration": "prefill_s",
+    "eval_duration": "decode_s",
+    "load_duration": "load_s",
+    "total_duration": "llm_total_s",
+}
+LLM_FIELDS = tuple(LLM_COUNT_FIELDS.values()) + tuple(LLM_DURATION_FIELDS.values())
+# load_duration больше порога — модель загружалась заново (выгрузилась по keep_alive или вытеснена)
+MODEL_LOAD_THRESHOLD_S = 1.0
+
+
+def llm_stats(payload: dict) -> dict:
+    """Счётчики токенов и длительности из ответа Ollama; отсутствующие поля пропускаются."""
+    stats = {"llm_calls": 1}
+    for field, name in LLM_COUNT_FIELDS.items():
+        if isinstance(payload.get(field), (int, float)):
+            stats[name] = int(payload[field])
+    for field, name in LLM_DURATION_FIELDS.items():
+        if isinstance(payload.get(field), (int, float)):
+            stats[name] = payload[field] / 1e9
+    if stats.get("load_s", 0.0) > MODEL_LOAD_THRESHOLD_S:
+        stats["model_loads"] = 1
+    return stats
+
+
+def tokens_per_second(tokens: float, seconds: float) -> Optional[float]:
+    return round(tokens / seconds, 2) if tokens and seconds else None
+
+
+class Trace:
+    """
+    Трасса одного запроса: список шагов (span) с длительностью и атрибутами
+    (число документов, размер промпта, ...). Шаги агентов помечаются атрибутом agent.
+    """
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """
+        Замеряет шаг. Внутри блока в атрибуты можно дописывать значения:
+        with trace.span("retrieval", agent="GeneralAgent") as attrs: attrs["docs"] = len(docs)
+        """
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span = {
+                "name": name,
+                "offset": round(start - self.started, 6),
+                "duration": time.perf_counter() - start,
+                "attrs": attrs,
+            }
+            with self._lock:
+                self.spans.append(span)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+
+    @staticmethod
+    def span_key(span: dict) -> str:
+        agent = span["attrs"].get("agent")
+        return f"{agent}.{span['name']}" if agent else span["name"]
+
+    def durations(self) -> dict:
+        """Суммарная длительность по шагам в секундах: routing, <агент>.retrieval, <агент>.generation, merge."""
+        totals = {}
+        for span in self.spans:
+            key = self.span_key(span)
+            totals[key] = totals.get(key, 0.0) + span["duration"]
+        return totals
+
+    def llm_totals(self) -> dict:
+        """
+        Токены и время LLM по шагам (ключи как в durations): число вызовов, токены промпта
+        и ответа, prefill/decode/load в секундах, перезагрузки модели и скорость токен/с.
+        """
+        totals = {}
+        for span in self.spans:
+            if "llm_calls" not in span["attrs"]:
+                continue
+            stage = totals.setdefault(self.span_key(span), {})
+            for name in ("llm_calls", "model_loads") + LLM_FIELDS:
+                if name in span["attrs"]:
+                    stage[name] = stage.get(name, 0) + span["attrs"][name]
+        for stage in totals.values():
+            stage["prefill_tps"] = tokens_per_second(stage.get("prompt_tokens"), stage.get("prefill_s"))
+            stage["decode_tps"] = tokens_per_second(stage.get("completion_tokens"), stage.get("decode_s"))
+        return totals
+
+    def summary(self) -> dict:
+        """Краткая сводка запроса для результатов бенчмарков: длительности шагов и статистика LLM."""
+        llm = self.llm_totals()
+        return {
+            "duration": None if self.duration is None else round(self.duration, 4),
+            "stages": {key: round(seconds, 4) for key, seconds in self.durations().items()},
+            "llm": llm,
+            "llm_calls": sum(stage.get("llm_calls", 0) for stage in llm.values()),
+            "prompt_tokens": sum(stage.get("prompt_tokens", 0) for stage in llm.values()),
+            "completion_tokens": sum(stage.get("completion_tokens", 0) for stage in llm.values()),
+            "model_loads": sum(stage.get("model_loads", 0) for stage in llm.values()),
+        }
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing (длительности в мс)."""
+        parts = [f"{key};dur={seconds * 1000:.1f}" for key, seconds in self.durations().items()]
+        if self.duration is not None:
+            parts.append(f"total;dur={self.duration * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "duration": None if self.duration is None else round(self.duration, 6),
+            "spans": [dict(span, duration=round(span["duration"], 6)) for span in self.spans],
+        }
+
+    def log(self) -> None:
+        logger.info(json.dumps(self.to_dict(), ensure_ascii=False, default=str))
+
+
+@contextmanager
+def maybe_span(trace: Optional[Trace], name: str, **attrs):
+    """span, если трасса передана; иначе просто отдаёт словарь атрибутов."""
+    if trace is None:
+        yield attrs
+    else:
+        with trace.span(name, **attrs) as span_attrs:
+            yield span_attrs
+
+
+class Histogram:
+
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # значения меток -> [счётчики по корзинам, сумма, число]
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            labels = _labels(self.labels, label_values)
+            for upper, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), label_values + (_num(upper),))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), label_values + ("+Inf",))} {count}')
+            lines.append(f"{self.name}_sum{labels} {_num(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), kind: str = "counter"):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.kind = kind
+        self.series = {}
+
+    def inc(self, *label_values, value: float = 1.0) -> None:
+        self.series[label_values] = self.series.get(label_values, 0.0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_num(value)}")
+        return lines
+
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    Агрегаты по трассам в текстовом формате Prometheus (exposition format 0.0.4),
+    без зависимости от prometheus_client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter("rag_requests_total", "Requests to TerrariaRAG by status.", ("status",))
+        self.in_flight = Counter("rag_requests_in_flight", "Requests being answered right now.", kind="gauge")
+        self.request_seconds = Histogram("rag_request_duration_seconds", "End-to-end request latency.",
+                                         (), LATENCY_BUCKETS)
+        self.stage_seconds = Histogram("rag_stage_duration_seconds", "Pipeline stage latency.",
+                                       ("stage", "agent"), LATENCY_BUCKETS)
+        self.stage_errors = Counter("rag_stage_errors_total", "Pipeline stages that raised.", ("stage", "agent"))
+        self.prompt_chars = Histogram("rag_prompt_chars", "Prompt size sent to the LLM, characters.",
+                                      ("stage", "agent"), CHARS_BUCKETS)
+        self.docs = Histogram("rag_retrieved_docs", "Documents returned by an agent's retriever.",
+                              ("agent",), DOCS_BUCKETS)
+        self.llm_calls = Counter("rag_llm_calls_total", "LLM backend calls.", ("stage", "agent"))
+        self.prompt_tokens = Histogram("rag_llm_prompt_tokens", "Prompt tokens per LLM call (prompt_eval_count).",
+                                       ("stage", "agent"), TOKENS_BUCKETS)
+        self.completion_tokens = Histogram("rag_llm_completion_tokens", "Generated tokens per LLM call (eval_count).",
+                                           ("stage", "agent"), TOKENS_BUCKETS)
+        self.prefill_seconds = Histogram("rag_llm_prefill_seconds", "Prompt evaluation time per LLM call.",
+                                         ("stage", "agent"), LATENCY_BUCKETS)
+        self.decode_seconds = Histogram("rag_llm_decode_seconds", "Generation time per LLM call.",
+                                        ("stage", "agent"), LATENCY_BUCKETS)
+        self.model_loads = Counter("rag_llm_model_loads_total",
+                                   f"LLM calls with load_duration above {MODEL_LOAD_THRESHOLD_S} s.", ("stage", "agent"))
+        self.metrics = [self.requests, self.in_flight, self.request_seconds, self.stage_seconds,
+                        self.stage_errors, self.prompt_chars, self.docs, self.llm_calls, self.prompt_tokens,
+                        self.completion_tokens, self.prefill_seconds, self.decode_seconds, self.model_loads]
+
+    @contextmanager
+    def track_in_flight(self):
+        with self._lock:
+            self.in_flight.inc()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight.inc(value=-1.0)
+
+    def observe(self, trace: Trace, status: str = "ok") -> None:
+        with self._lock:
+            self.requests.inc(status)
+            if trace.duration is not None:
+                self.request_seconds.observe(trace.duration)
+            for span in trace.spans:
+                attrs = span["attrs"]
+                agent = attrs.get("agent", "")
+                self.stage_seconds.observe(span["duration"], span["name"], agent)
+                if "error" in attrs:
+                    self.stage_errors.inc(span["name"], agent)
+                if "prompt_chars" in attrs:
+                    self.prompt_chars.observe(attrs["prompt_chars"], span["name"], agent)
+                if "docs" in attrs:
+                    self.docs.observe(attrs["docs"], agent)
+                if "llm_calls" in attrs:
+                    self.llm_calls.inc(span["name"], agent)
+                    if "prompt_tokens" in attrs:
+                        self.prompt_tokens.observe(attrs["prompt_tokens"], span["name"], agent)
+                    if "completion_tokens" in attrs:
+                        self.completion_tokens.observe(attrs["completion_tokens"], span["name"], agent)
+                    if "prefill_s" in attrs:
+                        self.prefill_seconds.observe(attrs["prefill_s"], span["name"], agent)
+                    if "decode_s" in attrs:
+                        self.decode_seconds.observe(attrs["decode_s"], span["name"], agent)
+                    if "model_loads" in attrs:
+                        self.model_loads.inc(span["name"], agent)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()